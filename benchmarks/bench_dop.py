@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Time computing a session's GDOP/PDOP from orbits (dop_source: orbits)
+on a synthetic multi-GNSS observation file and its navigation file.
+
+    python benchmarks/bench_dop.py [--duration S] [--interval S] [--satellites N]
+        [--systems GREC] [--version 2.11|3.04] [--hatanaka] [--chunk N] [--dir DIR]
+
+The files are written once to --dir (a temporary folder by default) and
+reused while the options are the same; --hatanaka writes the
+observations as Compact RINEX, decoded on the fly while they are read.
+Prints the time to load the orbits, to compute the DOPs and the peak
+memory allocated while doing so (tracemalloc, which also slows the run
+down, so it is measured in a separate pass), plus the resulting
+mean/max values.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_rinex import write_synthetic_navigation, write_synthetic_rinex  # noqa: E402
+from journal_by_rinex.dop import DOP_CHUNK_EPOCHS, format_dop, load_orbits, session_dop  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=86400, help='Seconds of observations')
+    parser.add_argument('--interval', type=float, default=1, help='Sampling interval in seconds')
+    parser.add_argument('--satellites', type=int, default=30, help='Satellites observed per epoch')
+    parser.add_argument('--systems', default='GREC')
+    parser.add_argument('--version', type=float, default=3.04, choices=(2.11, 3.04))
+    parser.add_argument('--hatanaka', action='store_true', help='Compact RINEX (Hatanaka) observations')
+    parser.add_argument('--chunk', type=int, default=DOP_CHUNK_EPOCHS, help='Epochs per chunk')
+    parser.add_argument('--dir', help='Folder for the synthetic files (default: a temporary one)')
+    args = parser.parse_args()
+
+    directory = args.dir or os.path.join(tempfile.gettempdir(), 'journal_by_rinex_bench_dop')
+    os.makedirs(directory, exist_ok=True)
+    name = f'dop_{args.version}_{args.duration:g}_{args.interval:g}_{args.satellites}_{args.systems}'
+    observations = os.path.join(directory, name + ('.crx' if args.hatanaka else '.rnx'))
+    navigation = os.path.join(directory, f'nav_{args.duration:g}s_{args.systems}.rnx')
+    if not os.path.exists(observations):
+        print(f'Writing {observations} ...')
+        write_synthetic_rinex(
+            observations, version=args.version, duration=args.duration, interval=args.interval,
+            satellites=args.satellites, systems=args.systems, hatanaka=args.hatanaka)
+    if not os.path.exists(navigation):
+        write_synthetic_navigation(navigation, duration=args.duration, systems=args.systems)
+
+    start = time.perf_counter()
+    orbits = load_orbits([navigation])
+    loaded = time.perf_counter() - start
+    start = time.perf_counter()
+    dops = session_dop(observations, orbits, args.chunk)
+    computed = time.perf_counter() - start
+
+    tracemalloc.start()
+    session_dop(observations, orbits, args.chunk)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    size = os.path.getsize(observations) / 2 ** 20
+    print(f'{dops["epochs"]} epochs ({size:.0f} MB), {dops["epochs_used"]} with a DOP')
+    print(f'orbits loaded in {loaded:.3f} s, DOPs computed in {computed:.3f} s '
+          f'({dops["epochs"] / computed:,.0f} epochs/s), peak {peak / 2 ** 20:.1f} MB')
+    print(f'GDOP {format_dop(dops["gdop_mean"], dops["gdop_max"])}, '
+          f'PDOP {format_dop(dops["pdop_mean"], dops["pdop_max"])} (mean/max)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Compare the built-in RINEX header reader used by get_info() against
+georinex's rinexheader() (what get_info() used before), on real files.
+
+    python benchmarks/bench_header.py [--repeat N] FILE [FILE ...]
+
+For each file it prints the best-of-N time of: georinex.rinexheader(),
+read_rinex_header() alone, and a complete get_info() (header plus
+session bounds, in a single pass over the file). It also checks that
+both header readers agree on every label get_info() relies on.
+Requires georinex (pip install journal_by_rinex[bench]).
+"""
+
+import argparse
+import time
+
+import georinex as gr
+
+from journal_by_rinex.functions import get_info, read_rinex_header
+
+COMPARED_LABELS = (
+    'MARKER NAME',
+    'APPROX POSITION XYZ',
+    'REC # / TYPE / VERS',
+    'ANT # / TYPE',
+    'ANTENNA: DELTA H/E/N',
+)
+
+
+def best_of(repeat, func, *args):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def read_native(rinex_file):
+    with open(rinex_file, 'rb') as f:
+        return read_rinex_header(f)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"file":40} {"georinex":>10} {"native":>10} {"speedup":>8} {"get_info":>10}')
+    for rinex_file in args.files:
+        georinex_time, georinex_header = best_of(args.repeat, gr.rinexheader, rinex_file)
+        native_time, native_header = best_of(args.repeat, read_native, rinex_file)
+        info_time, _ = best_of(args.repeat, get_info, rinex_file)
+
+        for label in COMPARED_LABELS:
+            if georinex_header.get(label, '').strip() != native_header.get(label, '').strip():
+                print(f'  MISMATCH in {label!r}: {georinex_header.get(label)!r} != {native_header.get(label)!r}')
+        if float(georinex_header['version']) != native_header['version']:
+            print(f'  MISMATCH in version: {georinex_header["version"]!r} != {native_header["version"]!r}')
+
+        print(
+            f'{rinex_file[-40:]:40} {georinex_time * 1e3:8.2f}ms {native_time * 1e3:8.2f}ms '
+            f'{georinex_time / native_time:7.1f}x {info_time * 1e3:8.2f}ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
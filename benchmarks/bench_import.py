@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Measure how long importing the application's entry points takes in a
+fresh interpreter, and check it against a budget.
+
+    python benchmarks/bench_import.py [--repeat N] [--budget-ms MS] [--top N] [MODULE ...]
+
+Each module (by default the GUI, the CLI and the batch runner) is
+imported --repeat times, each time in a new `python -X importtime`
+process. The median wall time is compared with --budget-ms, and the
+modules that took longest to import (cumulative, from -X importtime)
+are listed. The heavy dependencies (pylatex, pikepdf, matplotlib,
+cartopy, ...) are only needed once a journal is actually generated, so
+importing any of them counts as a failure too. Exits with status 1 on
+any failure, so it can run as a CI check.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ('journal_by_rinex.main', 'journal_by_rinex.cli', 'journal_by_rinex.batch')
+
+# Generous next to the ~1 s these imports took when every dependency was
+# imported up front, but tight enough to catch one of those coming back
+DEFAULT_BUDGET_MS = 300
+
+HEAVY_MODULES = (
+    'pylatex', 'pikepdf', 'matplotlib', 'cartopy', 'pyproj', 'numpy', 'PIL',
+    'pypandoc', 'geopandas', 'contextily', 'shapely',
+)
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": sorted(m for m in {heavy!r} if m in sys.modules)}}))
+'''
+
+
+def import_once(module):
+    """(wall seconds, heavy modules loaded, {module: cumulative us}) of
+    importing `module` in a new interpreter."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD.format(module=module, heavy=HEAVY_MODULES)],
+        capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        if name.strip() == 'site':
+            # Everything before (and including) site is interpreter startup
+            cumulative.clear()
+            continue
+        cumulative[name.strip()] = int(total)
+    measurement = json.loads(result.stdout.splitlines()[-1])
+    return measurement['seconds'], measurement['loaded'], cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--top', type=int, default=8, help='How many of the slowest imports to list')
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        runs = [import_once(module) for _ in range(max(args.repeat, 1))]
+        median_ms = statistics.median(seconds for seconds, _, _ in runs) * 1000
+        loaded = runs[-1][1]
+        over_budget = median_ms > args.budget_ms
+        status = 'OK' if not over_budget and not loaded else 'FAIL'
+        print(f'{module}: {median_ms:.1f} ms (budget {args.budget_ms:.0f} ms)  {status}')
+        if loaded:
+            print(f'  heavy dependencies imported: {", ".join(loaded)}')
+        cumulative = runs[-1][2]
+        for name, total in sorted(cumulative.items(), key=lambda item: -item[1])[:args.top]:
+            print(f'  {total / 1000:8.1f} ms  {name}')
+        failed = failed or status == 'FAIL'
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""Time every stage of the journal pipeline on synthetic RINEX files
+(see synthetic_rinex.py), and compare the timings with a saved baseline.
+
+    python benchmarks/bench_pipeline.py run [--repeat N] [--files N] [--stage NAME ...] [--save BASELINE.json]
+    python benchmarks/bench_pipeline.py compare BASELINE.json CURRENT.json [--threshold 0.2] [--min-change-ms MS]
+
+`run` times each stage --repeat times (after one untimed warm-up run)
+and prints the median and best time per stage: get_info() on small,
+large (1 Hz), gzipped and event-flagged RINEX 2.11 and 3.04 files with
+both epoch scans, crd2cell_100(), the location map with both renderers
+(get_map() and render_map(), from a local stand-in tile source so no
+network is used), _build_journal_document(), the LaTeX compile (both
+compile modes), _merge_radio_widgets(), the form template fill, the
+.docx writers and finally an end-to-end run_batch() over --files files
+(one of them with a blank MARKER NAME), with offline tiles and every
+cache and the build manifest disabled, run both one file after another
+and as a pipeline (batch[pipeline]). Stages whose dependencies are
+missing (pdflatex, cartopy, pandoc) are listed as skipped, and stages
+that raise as failed (the exit status is then 1). --save writes the
+timings as JSON.
+
+`compare` flags every stage whose median got slower than the baseline
+by more than --threshold (a fraction: 0.2 is 20 %) and by at least
+--min-change-ms milliseconds, and exits with status 1 if any did, so it
+can run as a CI check. Timings only compare meaningfully between runs
+on the same machine.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from synthetic_rinex import write_synthetic_rinex
+
+import journal_by_rinex
+from journal_by_rinex.batch import ANTENNA_HEIGHT_TYPES, run_batch, settings_from_config
+from journal_by_rinex.functions import (
+    ANTENNA_HEIGHT_RADIO_FIELD, ANTENNA_HEIGHT_RADIO_VALUES, MAP_EXTENT, MAP_ZOOM,
+    _build_journal_docx, _build_journal_document, _fill_journal_template, _include_graphics,
+    _merge_radio_widgets, crd2cell_100, get_info, get_map,
+)
+from journal_by_rinex.latexbuild import LatexBuilder
+from journal_by_rinex.maprender import TILE_SIZE, _mercator_pixel, render_map
+from journal_by_rinex.pdftemplate import FormTemplates
+
+DEFAULT_THRESHOLD = 0.2
+
+# Slowdowns smaller than this (in milliseconds) are never flagged: the
+# sub-millisecond stages vary by more than any threshold from run to run
+DEFAULT_MIN_CHANGE_MS = 0.5
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(journal_by_rinex.__file__)), 'images')
+
+# The synthetic files get_info() is timed on: name -> synthetic_rinex() options
+RINEX_FILES = {
+    'v2_30s': dict(version=2.11),
+    'v3_30s': dict(version=3.04),
+    'v3_1hz': dict(version=3.04, duration=6 * 3600, interval=1, satellites=20),
+    'v3_1hz_gz': dict(version=3.04, duration=6 * 3600, interval=1, satellites=20, compress=True),
+    'v2_events': dict(version=2.11, events=20),
+}
+
+
+class Skipped(Exception):
+    """Raised by a stage's setup when it can't run here."""
+
+
+class StubTiles:
+    """Local stand-in for a map tile source: a plain tile for every
+    request, so the map stages time drawing rather than the network."""
+
+    key = 'bench-stub'
+
+    def __init__(self):
+        from PIL import Image
+        data = io.BytesIO()
+        Image.new('RGB', (TILE_SIZE, TILE_SIZE), (170, 200, 160)).save(data, 'PNG')
+        self.tile = data.getvalue()
+
+    def get_tile(self, z, x, y):
+        return self.tile
+
+    def stats(self):
+        return {}
+
+
+def write_tile_directory(directory, tile, longitude, latitude):
+    """An offline XYZ tile tree (tile_offline) covering the map around
+    one station."""
+    west, north = _mercator_pixel(longitude - MAP_EXTENT[0], latitude + MAP_EXTENT[1], MAP_ZOOM)
+    east, south = _mercator_pixel(longitude + MAP_EXTENT[0], latitude - MAP_EXTENT[1], MAP_ZOOM)
+    for x in range(int(west // TILE_SIZE), int(east // TILE_SIZE) + 1):
+        os.makedirs(os.path.join(directory, str(MAP_ZOOM), str(x)), exist_ok=True)
+        for y in range(int(north // TILE_SIZE), int(south // TILE_SIZE) + 1):
+            with open(os.path.join(directory, str(MAP_ZOOM), str(x), f'{y}.png'), 'wb') as f:
+                f.write(tile)
+
+
+def journal_data(rinex_file):
+    # What process_file() passes to journal_generator()
+    data = get_info(rinex_file)
+    data.update({
+        'organization': 'ООО "Ромашка", отдел №1',
+        'object': 'Объект 42',
+        'operator': 'Иванов И. И.',
+        'centre type': 'Тип 1',
+        'benchmark type': 'Тип 2',
+        'gdop': '1.7',
+        'pdop': '1.6',
+        'antenna height type': ANTENNA_HEIGHT_TYPES['Tripod, to base'],
+        'map sheets': [],
+        'coordinate systems': [],
+    })
+    return data
+
+
+class Pipeline:
+    """The synthetic inputs shared by the stages, in a temporary folder."""
+
+    def __init__(self, directory, file_count):
+        self.directory = directory
+        self.file_count = file_count
+        self.rinex = {
+            name: write_synthetic_rinex(
+                os.path.join(directory, f'{name}.24o' + ('.gz' if options.get('compress') else '')), **options)
+            for name, options in RINEX_FILES.items()
+        }
+        self.data = journal_data(self.rinex['v3_30s'])
+        self.tiles = StubTiles()
+        self.map_path = os.path.join(directory, f'{self.data["marker name"]}.png')
+        render_map(self.data['longitude'], self.data['latitude'], self.data['marker name'],
+                   self.tiles, MAP_ZOOM, MAP_EXTENT).save(self.map_path)
+        self.a_pic_path = os.path.join(IMAGES_DIR, 'default')
+        self.b_pic_path = os.path.join(IMAGES_DIR, 'tripod_base')
+        self._compiled = None
+
+    def document(self, as_form, fields=None):
+        return _build_journal_document(
+            self.data, as_form,
+            _include_graphics(self.a_pic_path, '0.2'),
+            _include_graphics(self.b_pic_path, '0.2'),
+            _include_graphics(self.map_path, '0.6'),
+            fields=fields,
+        )
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def compiled_pdf(self):
+        """A compiled journal PDF whose radio group isn't merged yet."""
+        if self._compiled is None:
+            require_pdflatex()
+            builder = LatexBuilder('precompiled', self.path('latex-merge'))
+            builder.compile(self.document(True), self.path('unmerged'))
+            self._compiled = self.path('unmerged.pdf')
+        return self._compiled
+
+
+def require_pdflatex():
+    if shutil.which('pdflatex') is None:
+        raise Skipped('pdflatex not found')
+
+
+def require_module(name):
+    import importlib.util
+    if importlib.util.find_spec(name) is None:
+        raise Skipped(f'{name} not installed')
+
+
+# Each stage's setup gets the Pipeline and returns the function to time
+
+def stage_get_info(name, epoch_scan):
+    def setup(pipeline):
+        return lambda: get_info(pipeline.rinex[name], epoch_scan=epoch_scan)
+    return setup
+
+
+def stage_crd2cell_100(pipeline):
+    longitude, latitude = pipeline.data['longitude'], pipeline.data['latitude']
+    return lambda: crd2cell_100(longitude, latitude)
+
+
+def stage_render_map(pipeline):
+    data = pipeline.data
+    path = pipeline.path('render_map.png')
+    return lambda: render_map(data['longitude'], data['latitude'], data['marker name'],
+                              pipeline.tiles, MAP_ZOOM, MAP_EXTENT).save(path)
+
+
+def stage_get_map(pipeline):
+    require_module('cartopy')
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    data = pipeline.data
+    path = pipeline.path('get_map.png')
+
+    def draw():
+        figure = get_map(data['longitude'], data['latitude'], data['marker name'], pipeline.tiles)
+        figure.savefig(path, bbox_inches='tight')
+        plt.close(figure)
+    return draw
+
+
+def stage_build_document(as_form):
+    def setup(pipeline):
+        return lambda: pipeline.document(as_form).dumps()
+    return setup
+
+
+def stage_latex_compile(mode):
+    def setup(pipeline):
+        require_pdflatex()
+        builder = LatexBuilder(mode, pipeline.path(f'latex-{mode}'))
+        doc = pipeline.document(True)
+        return lambda: builder.compile(doc, pipeline.path(f'compiled-{mode}'))
+    return setup
+
+
+def stage_merge_radio_widgets(pipeline):
+    source = pipeline.compiled_pdf()
+    path = pipeline.path('merged.pdf')
+
+    def merge():
+        shutil.copyfile(source, path)
+        _merge_radio_widgets(path, ANTENNA_HEIGHT_RADIO_FIELD, ANTENNA_HEIGHT_RADIO_VALUES,
+                             pipeline.data['antenna height type'])
+    return merge
+
+
+def stage_template_fill(pipeline):
+    require_pdflatex()
+    templates = FormTemplates(LatexBuilder('precompiled', pipeline.path('latex-template')),
+                              pipeline.path('templates'))
+    images = {
+        'map': pipeline.map_path,
+        'antenna_a': pipeline.a_pic_path + '.png',
+        'antenna_b': pipeline.b_pic_path + '.png',
+    }
+    filename = pipeline.path('filled')
+    # The template itself is compiled by the warm-up run
+    return lambda: _fill_journal_template(pipeline.data, filename, templates, images)
+
+
+def stage_docx_native(pipeline):
+    path = pipeline.path('native.docx')
+    return lambda: _build_journal_docx(pipeline.data, pipeline.a_pic_path, pipeline.b_pic_path,
+                                       pipeline.map_path).save(path)
+
+
+def stage_docx_pandoc(pipeline):
+    require_module('pypandoc')
+    import pypandoc
+    try:
+        pypandoc.get_pandoc_version()
+    except OSError:
+        raise Skipped('pandoc not found')
+    tex_base = pipeline.path('plain')
+    pipeline.document(False).generate_tex(tex_base)
+    path = pipeline.path('pandoc.docx')
+    return lambda: pypandoc.convert_file(tex_base + '.tex', 'docx', outputfile=path)
+
+
+def stage_batch(pipelined):
+    def setup(pipeline):
+        return batch_setup(pipeline, pipelined)
+    return setup
+
+
+def batch_setup(pipeline, pipelined):
+    require_pdflatex()
+    data = pipeline.data
+    tile_dir = pipeline.path('tiles')
+    write_tile_directory(tile_dir, pipeline.tiles.tile, data['longitude'], data['latitude'])
+    input_dir = pipeline.path('batch')
+    os.makedirs(input_dir, exist_ok=True)
+    files = [
+        write_synthetic_rinex(os.path.join(input_dir, f'site{index:03d}0.24o'), seed=index,
+                              marker_name='' if index == 0 else f'S{index:03d}')
+        for index in range(pipeline.file_count)
+    ]
+    settings = settings_from_config({
+        'save_path': pipeline.path('batch-pipeline-out' if pipelined else 'batch-out'),
+        'organization': 'Bench', 'object': 'Bench', 'operator': 'Bench',
+        'measurement_type': 'Tripod, to base',
+        'gdop': '1.7', 'pdop': '1.6',
+        'tile_offline': tile_dir,
+        'map_cache_max_mb': 0,
+        'latex_build_dir': pipeline.path('latex-batch'),
+        'incremental': False,
+        'deduplicate': False,
+        'header_index': False,
+        'pipeline': pipelined,
+    })
+    os.makedirs(settings['save_path'], exist_ok=True)
+
+    def batch():
+        summary = run_batch(files, settings)
+        if summary['failed']:
+            raise RuntimeError(f'{len(summary["failed"])} files failed: {summary["failed"][0][1]}')
+    return batch
+
+
+STAGES = {
+    **{f'get_info[{name},{scan}]': stage_get_info(name, scan)
+       for name in RINEX_FILES for scan in ('bounds', 'full')},
+    'crd2cell_100': stage_crd2cell_100,
+    'render_map': stage_render_map,
+    'get_map': stage_get_map,
+    'build_document[form]': stage_build_document(True),
+    'build_document[plain]': stage_build_document(False),
+    'latex_compile[precompiled]': stage_latex_compile('precompiled'),
+    'latex_compile[standard]': stage_latex_compile('standard'),
+    'merge_radio_widgets': stage_merge_radio_widgets,
+    'template_fill': stage_template_fill,
+    'docx[native]': stage_docx_native,
+    'docx[pandoc]': stage_docx_pandoc,
+    'batch': stage_batch(False),
+    'batch[pipeline]': stage_batch(True),
+}
+
+
+def time_stage(func, repeat):
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'median_s': statistics.median(times), 'min_s': min(times), 'runs': repeat}
+
+
+def run(args):
+    names = args.stage or list(STAGES)
+    unknown = [name for name in names if name not in STAGES]
+    if unknown:
+        raise SystemExit(f'Unknown stage(s): {", ".join(unknown)}')
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='journal_by_rinex-bench-') as directory:
+        pipeline = Pipeline(directory, args.files)
+        print(f'{"stage":36} {"median (ms)":>12} {"min (ms)":>10}')
+        for name in names:
+            try:
+                func = STAGES[name](pipeline)
+                # Warnings printed by the stages (e.g. the blank MARKER
+                # NAME) would only clutter the table
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    result = time_stage(func, args.repeat)
+            except Skipped as e:
+                result = {'skipped': str(e)}
+            except Exception as e:
+                # Recorded, so one broken stage doesn't lose the others
+                result = {'failed': f'{type(e).__name__}: {e}'}
+            results[name] = result
+            if 'skipped' in result or 'failed' in result:
+                print(f'{name:36} {"skipped" if "skipped" in result else "FAILED"}: {result.get("skipped") or result["failed"]}')
+            else:
+                print(f'{name:36} {result["median_s"] * 1e3:12.2f} {result["min_s"] * 1e3:10.2f}')
+
+    if args.save:
+        baseline = {
+            'meta': {
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'files': args.files,
+                'repeat': args.repeat,
+            },
+            'stages': results,
+        }
+        with open(args.save, 'w') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+    if any('failed' in result for result in results.values()):
+        sys.exit(1)
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)['stages']
+    with open(args.current) as f:
+        current = json.load(f)['stages']
+
+    regressions = 0
+    print(f'{"stage":36} {"baseline (ms)":>14} {"current (ms)":>13} {"change":>8}')
+    for name in sorted(set(baseline) & set(current), key=list(current).index):
+        before, after = baseline[name], current[name]
+        if 'median_s' not in before or 'median_s' not in after:
+            print(f'{name:36} {"not timed":>14}')
+            continue
+        change = after['median_s'] / before['median_s'] - 1
+        flag = ''
+        if change > args.threshold and (after['median_s'] - before['median_s']) * 1e3 >= args.min_change_ms:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f'{name:36} {before["median_s"] * 1e3:14.2f} {after["median_s"] * 1e3:13.2f} {change:+8.0%}{flag}')
+    for name in sorted(set(baseline) ^ set(current)):
+        print(f'{name:36} only in {"the baseline" if name in baseline else "the current run"}')
+    if regressions:
+        print(f'{regressions} stage(s) more than {args.threshold:.0%} slower than the baseline')
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='Time the pipeline stages')
+    run_parser.add_argument('--repeat', type=int, default=5, help='Timed runs per stage')
+    run_parser.add_argument('--files', type=int, default=10, help='Files in the end-to-end batch')
+    run_parser.add_argument('--stage', nargs='+', metavar='NAME', help=f'Only these stages (of: {", ".join(STAGES)})')
+    run_parser.add_argument('--save', metavar='BASELINE.json', help='Write the timings to this file')
+    compare_parser = commands.add_parser('compare', help='Compare two saved runs')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='Slowdown flagged as a regression, as a fraction (default: %(default)s)')
+    compare_parser.add_argument('--min-change-ms', type=float, default=DEFAULT_MIN_CHANGE_MS,
+                                help='Smallest slowdown flagged, in milliseconds (default: %(default)s)')
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
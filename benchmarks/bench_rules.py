@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Measure how matching files against file_rules scales with the number
+of rules, testing every rule in turn (file_matches_rule()) versus
+resolve_file_metadata() with the rule index a batch builds once
+(journal_by_rinex.rules).
+
+    python benchmarks/bench_rules.py [--rules N ...] [--globs N] [--sample N]
+
+For each rule count N this builds the config a batch of N files gets
+from "Save YAML" (one exact-path rule per file, see processed_config()),
+plus --globs wildcard rules, and matches all N files against it. Testing
+every rule is O(files x rules), so it is only timed on --sample files
+and scaled up. Both must find the same rules for every sampled file:
+each rule sets its own operator, so the resolved metadata tells them
+apart.
+"""
+
+import argparse
+import time
+
+from journal_by_rinex.batch import file_matches_rule, processed_config, resolve_file_metadata, settings_from_config
+from journal_by_rinex.rules import file_rule_index
+
+DEFAULT_RULE_COUNTS = (100, 1000, 10000)
+
+GLOBS = ('*.24o', 'site*', '*/backup/*', '*[0-9][0-9][0-9]0.2?o', '*/2024/*/SITE*')
+
+
+def synthetic_files(count):
+    return [f'/archive/2024/day{index % 366:03d}/site{index:05d}0.24o' for index in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rules', type=int, nargs='+', default=DEFAULT_RULE_COUNTS)
+    parser.add_argument('--globs', type=int, default=len(GLOBS), help='Wildcard rules added to the exact-path ones')
+    parser.add_argument('--sample', type=int, default=200, help='Files matched rule by rule per rule count')
+    args = parser.parse_args()
+
+    print(f'{"rules":>8} {"per rule (s)":>14} {"index build (s)":>16} {"indexed (s)":>12} {"speedup":>9}')
+    for count in args.rules:
+        files = synthetic_files(count)
+        rules = processed_config([(file, {'operator': f'file {index}'}) for index, file in enumerate(files)])['file_rules']
+        rules += [{'pattern': GLOBS[index % len(GLOBS)], 'operator': f'glob {index}'} for index in range(args.globs)]
+        patterns = [rule['pattern'] for rule in rules]
+        settings = settings_from_config({'file_rules': rules})
+
+        sample = files[::max(len(files) // args.sample, 1)][:args.sample]
+        start = time.perf_counter()
+        expected = []
+        for file in sample:
+            matching = [rule for rule, pattern in zip(rules, patterns) if file_matches_rule(file, pattern)]
+            expected.append(matching[-1]['operator'] if matching else '')
+        per_rule = (time.perf_counter() - start) * len(files) / len(sample)
+
+        # As run_batch() does once per batch
+        start = time.perf_counter()
+        settings['file_rule_index'] = file_rule_index(rules)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        resolved = [resolve_file_metadata(file, settings)['operator'] for file in files]
+        indexed = time.perf_counter() - start
+
+        sampled = [resolved[files.index(file)] for file in sample]
+        if sampled != expected:
+            raise SystemExit(f'{count} rules: resolve_file_metadata() disagrees with file_matches_rule()')
+        print(f'{count:8d} {per_rule:14.3f} {build:16.3f} {indexed:12.3f} {per_rule / (build + indexed):8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
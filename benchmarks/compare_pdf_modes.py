@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Check that filled form templates (pdf_mode: template) give the same
+journal PDFs as compiling every journal (pdf_mode: latex), and time both.
+
+    python benchmarks/compare_pdf_modes.py [--render] FILE [FILE ...]
+
+Each RINEX file's journal is generated both ways, then both PDFs are
+compared: the value of every form field, the antenna height radio
+choice, the decoded pixels of every image and the page content streams
+byte for byte. With --render the pages are also rasterized with
+pdftoppm (poppler-utils) and compared pixel for pixel. Requires
+pdflatex.
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+import pikepdf
+from PIL import Image, ImageChops
+
+from journal_by_rinex.batch import ANTENNA_HEIGHT_TYPES
+from journal_by_rinex.functions import get_info, journal_generator
+from journal_by_rinex.latexbuild import LatexBuilder
+from journal_by_rinex.pdftemplate import FormTemplates
+
+
+def journal_data(rinex_file):
+    data = get_info(rinex_file)
+    data.update({
+        'organization': 'ООО "Ромашка", отдел №1',
+        'object': 'Объект 42',
+        'operator': 'Иванов И. И.',
+        'centre type': 'Тип 1',
+        'benchmark type': 'Тип 2',
+        'gdop': '1.7',
+        'pdop': '1.6',
+        'antenna height type': ANTENNA_HEIGHT_TYPES['Tripod, to base'],
+    })
+    return data
+
+
+def pdf_summary(path):
+    """(field values, image pixels, page contents) of a journal PDF."""
+    with pikepdf.open(path) as pdf:
+        fields = {}
+        for field in pdf.Root.AcroForm.Fields:
+            if '/Kids' in field:
+                value = (str(field.V), [str(kid.get('/AS')) for kid in field.Kids])
+            else:
+                value = str(field.get('/V', ''))
+            fields.setdefault(str(field.T), []).append(value)
+        images = []
+        contents = []
+        for page in pdf.pages:
+            for name, xobject in sorted(page.Resources.get('/XObject', {}).items()):
+                if xobject.get('/Subtype') == pikepdf.Name.Image:
+                    images.append((name, pikepdf.PdfImage(xobject).as_pil_image().convert('RGBA').tobytes()))
+            page.contents_coalesce()
+            contents.append(page.Contents.read_bytes())
+        return fields, images, contents
+
+
+def render(pdf_path):
+    subprocess.check_call(['pdftoppm', '-r', '100', '-png', '-singlefile', pdf_path, pdf_path])
+    return Image.open(pdf_path + '.png').convert('RGB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--render', action='store_true', help='Also compare the rasterized pages (needs pdftoppm)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        latex = LatexBuilder('precompiled', os.path.join(work_dir, 'build'))
+        templates = FormTemplates(latex, os.path.join(work_dir, 'templates'))
+        print(f'{"file":40} {"latex":>8} {"template":>9}  result')
+        for index, rinex_file in enumerate(args.files):
+            data = journal_data(rinex_file)
+            outputs = {}
+            timings = {}
+            for mode in ('latex', 'template'):
+                output_dir = os.path.join(work_dir, f'{mode}-{index}')
+                os.makedirs(output_dir)
+                outputs[mode] = os.path.join(output_dir, data['marker name'])
+                start = time.perf_counter()
+                journal_generator(dict(data), outputs[mode], latex=latex,
+                                  templates=templates if mode == 'template' else None)
+                timings[mode] = time.perf_counter() - start
+
+            expected = pdf_summary(outputs['latex'] + '.pdf')
+            actual = pdf_summary(outputs['template'] + '.pdf')
+            problems = [
+                what for what, a, b in zip(('fields', 'images', 'page contents'), expected, actual) if a != b
+            ]
+            if args.render:
+                difference = ImageChops.difference(render(outputs['latex'] + '.pdf'), render(outputs['template'] + '.pdf'))
+                if difference.getbbox() is not None:
+                    problems.append(f'rendered pages differ in {difference.getbbox()}')
+            result = 'identical' if not problems else 'MISMATCH: ' + ', '.join(problems)
+            print(f'{os.path.basename(rinex_file):40} {timings["latex"]:8.3f} {timings["template"]:9.3f}  {result}')
+        print(f'template builds: {templates.builds} ({templates.build_seconds:.3f} s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Write deterministic synthetic RINEX observation files, for the
+benchmarks.
+
+    python benchmarks/synthetic_rinex.py OUT [--version 2.11|3.04] [--duration S]
+        [--interval S] [--satellites N] [--systems GREC] [--events N]
+        [--marker NAME | --blank-marker] [--navigation NAV] [--hatanaka] [--gzip] [--seed N]
+
+The same options (and seed) always give byte-identical files: a valid
+header (marker, receiver, antenna, approximate position), then an epoch
+every --interval seconds for --duration seconds, each with --satellites
+satellites of --systems (GPS only by default) and random but plausible
+pseudorange, phase, Doppler and signal strength values. --events spreads
+that many event-flag records (flag 4, a header comment without a
+timestamp) over the file, as receivers write them. --navigation also
+writes a RINEX 3 navigation file covering the same time span, with
+broadcast orbits for every satellite of --systems (see
+synthetic_navigation()). --hatanaka writes the file as Compact RINEX
+(see compact_rinex()), which --gzip then compresses in turn.
+"""
+
+import argparse
+import gzip
+import math
+import random
+from datetime import datetime, timedelta
+
+DEFAULT_START = datetime(2024, 3, 1)
+
+# A station in Moscow, as (longitude, latitude, height)
+DEFAULT_POSITION = (37.6173, 55.7558, 150.0)
+
+OBSERVATION_TYPES = ('C1C', 'L1C', 'D1C', 'S1C')
+RINEX2_OBSERVATION_TYPES = ('C1', 'L1', 'D1', 'S1')
+
+# Satellites, orbit (semi-major axis in m, inclination in degrees, orbital
+# planes) and broadcast ephemeris interval (s) of each system; BeiDou has
+# its MEO satellites only
+CONSTELLATIONS = {
+    'G': ([f'G{prn:02d}' for prn in range(1, 33)], 26559700.0, 55.0, 6, 7200),
+    'R': ([f'R{prn:02d}' for prn in range(1, 25)], 25510000.0, 64.8, 3, 1800),
+    'E': ([f'E{prn:02d}' for prn in range(1, 25)], 29600000.0, 56.0, 3, 3600),
+    'C': ([f'C{prn:02d}' for prn in range(19, 43)], 27906000.0, 55.0, 3, 3600),
+}
+SYSTEM_NAMES = {'G': 'G (GPS)', 'R': 'R (GLONASS)', 'E': 'E (GALILEO)', 'C': 'C (BEIDOU)'}
+EARTH_ROTATION = 7.2921151467e-5
+GM = 3.986005e14
+GPS_EPOCH = datetime(1980, 1, 6)
+
+
+def ecef_from_geodetic(longitude, latitude, height):
+    # WGS 84
+    a, f = 6378137.0, 1 / 298.257223563
+    e2 = f * (2 - f)
+    lon, lat = math.radians(longitude), math.radians(latitude)
+    n = a / math.sqrt(1 - e2 * math.sin(lat) ** 2)
+    return (
+        (n + height) * math.cos(lat) * math.cos(lon),
+        (n + height) * math.cos(lat) * math.sin(lon),
+        (n * (1 - e2) + height) * math.sin(lat),
+    )
+
+
+def _header(version, marker_name, start, interval, position, systems):
+    x, y, z = ecef_from_geodetic(*position)
+    lines = []
+
+    def line(value, label):
+        lines.append(f'{value:<60}{label}')
+
+    system = SYSTEM_NAMES[systems] if len(systems) == 1 else 'M (MIXED)'
+    line(f'{version:9.2f}           OBSERVATION DATA    {system}', 'RINEX VERSION / TYPE')
+    line('synthetic_rinex     benchmarks          20240301 000000 UTC', 'PGM / RUN BY / DATE')
+    line(marker_name, 'MARKER NAME')
+    line('BENCH               JOURNAL_BY_RINEX', 'OBSERVER / AGENCY')
+    line('5329K12345          TRIMBLE R10         5.45', 'REC # / TYPE / VERS')
+    line('1441012345          TRM57971.00     NONE', 'ANT # / TYPE')
+    line(f'{x:14.4f}{y:14.4f}{z:14.4f}', 'APPROX POSITION XYZ')
+    line(f'{1.5:14.4f}{0.0:14.4f}{0.0:14.4f}', 'ANTENNA: DELTA H/E/N')
+    if version >= 3:
+        for system in systems:
+            line(f'{system}{len(OBSERVATION_TYPES):5d} ' + ' '.join(OBSERVATION_TYPES), 'SYS / # / OBS TYPES')
+    else:
+        line('     1     1', 'WAVELENGTH FACT L1/2')
+        line(f'{len(RINEX2_OBSERVATION_TYPES):6d}' + ''.join(f'{t:>6}' for t in RINEX2_OBSERVATION_TYPES),
+             '# / TYPES OF OBSERV')
+    line(f'{interval:10.3f}', 'INTERVAL')
+    line(f'{start.year:6d}{start.month:6d}{start.day:6d}{start.hour:6d}{start.minute:6d}'
+         f'{start.second:13.7f}     GPS', 'TIME OF FIRST OBS')
+    line('', 'END OF HEADER')
+    return lines
+
+
+def _observations(rng, count):
+    values = (rng.uniform(2.0e7, 2.6e7), rng.uniform(1.0e8, 1.4e8), rng.uniform(-4000, 4000), rng.uniform(30, 52))
+    return ''.join(f'{value:14.3f}{rng.randint(1, 9)} ' for value in values[:count]).rstrip()
+
+
+def synthetic_rinex(version=3.04, duration=3600, interval=30, satellites=12, events=0,
+                    marker_name='SYNT', start=DEFAULT_START, position=DEFAULT_POSITION, seed=0, systems='G'):
+    """The text of a synthetic RINEX observation file (see the module
+    docstring)."""
+    rng = random.Random(f'{seed}:{version}:{satellites}' + (f':{systems}' if systems != 'G' else ''))
+    lines = _header(version, marker_name, start, interval, position, systems)
+    epochs = int(duration // interval) + 1
+    event_epochs = {round((index + 1) * epochs / (events + 1)) for index in range(events)}
+    all_satellites = [satellite for system in systems for satellite in CONSTELLATIONS[system][0]]
+    for epoch in range(epochs):
+        time = start + timedelta(seconds=epoch * interval)
+        seconds = time.second + time.microsecond / 1e6
+        visible = sorted(rng.sample(all_satellites, min(satellites, len(all_satellites))))
+        if version >= 3:
+            lines.append(f'> {time:%Y %m %d %H %M} {seconds:10.7f}  0{len(visible):3d}')
+            for satellite in visible:
+                lines.append(satellite + _observations(rng, len(OBSERVATION_TYPES)))
+        else:
+            head = f' {time:%y} {time.month:2d} {time.day:2d} {time.hour:2d} {time.minute:2d}{seconds:11.7f}  0{len(visible):3d}'
+            for first in range(0, len(visible), 12):
+                lines.append((head if first == 0 else ' ' * 32) + ''.join(visible[first:first + 12]))
+            for satellite in visible:
+                lines.append(_observations(rng, len(RINEX2_OBSERVATION_TYPES)))
+        if epoch in event_epochs:
+            # Event flag 4 (header information follows), no timestamp
+            lines.append('>' + ' ' * 30 + '4  1' if version >= 3 else ' ' * 28 + '4  1')
+            lines.append(f'{"synthetic event record":<60}COMMENT')
+    return '\n'.join(lines) + '\n'
+
+
+def _orbit(system, index, time):
+    # ECEF position and velocity (m, m/s) of the index-th satellite of a
+    # system's circular orbits at `time` (seconds since the GPS epoch)
+    satellites, a, inclination, planes, _ = CONSTELLATIONS[system]
+    per_plane = math.ceil(len(satellites) / planes)
+    node = 2 * math.pi * (index % planes) / planes
+    motion = math.sqrt(GM / a ** 3)
+    u = 2 * math.pi * (index // planes) / per_plane + math.pi * (index % planes) / len(satellites) + motion * time
+    i = math.radians(inclination)
+    # Inertial position/velocity, then rotated by the Earth's angle
+    x, y = a * math.cos(u), a * math.sin(u)
+    vx, vy = -a * motion * math.sin(u), a * motion * math.cos(u)
+    inertial = [
+        (x * math.cos(node) - y * math.cos(i) * math.sin(node), vx * math.cos(node) - vy * math.cos(i) * math.sin(node)),
+        (x * math.sin(node) + y * math.cos(i) * math.cos(node), vx * math.sin(node) + vy * math.cos(i) * math.cos(node)),
+        (y * math.sin(i), vy * math.sin(i)),
+    ]
+    theta = EARTH_ROTATION * time
+    (px, pvx), (py, pvy), (pz, pvz) = inertial
+    ex = px * math.cos(theta) + py * math.sin(theta)
+    ey = -px * math.sin(theta) + py * math.cos(theta)
+    evx = pvx * math.cos(theta) + pvy * math.sin(theta) + EARTH_ROTATION * ey
+    evy = -pvx * math.sin(theta) + pvy * math.cos(theta) - EARTH_ROTATION * ex
+    return (ex, ey, pz), (evx, evy, pvz)
+
+
+def _kepler_elements(system, index, time, toe):
+    # Broadcast elements of the same circular orbit as _orbit() at GPS
+    # `time`, which is `toe` seconds into the week of the system's own
+    # time scale: (sqrt(A), e, i0, OMEGA0, omega, M0)
+    satellites, a, inclination, planes, _ = CONSTELLATIONS[system]
+    per_plane = math.ceil(len(satellites) / planes)
+    node = 2 * math.pi * (index % planes) / planes
+    motion = math.sqrt(GM / a ** 3)
+    u = 2 * math.pi * (index // planes) / per_plane + math.pi * (index % planes) / len(satellites) + motion * time
+    return math.sqrt(a), 0.0, math.radians(inclination), node - EARTH_ROTATION * (time - toe), 0.0, u
+
+
+def synthetic_navigation(start=DEFAULT_START, duration=3600, systems='G'):
+    """The text of a RINEX 3.04 navigation file with broadcast orbits of
+    every satellite of `systems` over `duration` seconds from `start`,
+    at each system's usual ephemeris interval: circular orbits whose
+    Keplerian elements (GPS, Galileo, BeiDou MEO) or PZ-90 state vectors
+    (GLONASS, at UTC times) describe the same motion as the positions
+    the benchmarks check them against (see _orbit())."""
+    lines = [
+        f'{"     3.04           N: GNSS NAV DATA    M: MIXED":<60}RINEX VERSION / TYPE',
+        f'{"synthetic_rinex     benchmarks          20240301 000000 UTC":<60}PGM / RUN BY / DATE',
+        f'{"    18":<60}LEAP SECONDS',
+        f'{"":<60}END OF HEADER',
+    ]
+    first = (start - GPS_EPOCH).total_seconds()
+
+    def values(*numbers):
+        return ''.join(f'{number:19.12E}' for number in numbers)
+
+    for system in systems:
+        satellites, _, _, _, step = CONSTELLATIONS[system]
+        time = first - first % step
+        while time <= first + duration + step:
+            for index, satellite in enumerate(satellites):
+                if system == 'R':
+                    # Reference times are UTC, GPS - 18 s
+                    epoch = GPS_EPOCH + timedelta(seconds=time - 18)
+                    (x, y, z), (vx, vy, vz) = _orbit(system, index, time)
+                    lines.append(f'{satellite} {epoch:%Y %m %d %H %M %S}' + values(0.0, 0.0, 0.0))
+                    lines.append('    ' + values(x / 1000, vx / 1000, 0.0, 0.0))
+                    lines.append('    ' + values(y / 1000, vy / 1000, 0.0, 1.0))
+                    lines.append('    ' + values(z / 1000, vz / 1000, 0.0, 0.0))
+                else:
+                    # BeiDou times are BDT, GPS - 14 s
+                    own_time = time - 14 if system == 'C' else time
+                    epoch = GPS_EPOCH + timedelta(seconds=own_time)
+                    toe = own_time % 604800
+                    sqrt_a, e, i0, omega0, omega, m0 = _kepler_elements(system, index, time, toe)
+                    lines.append(f'{satellite} {epoch:%Y %m %d %H %M %S}' + values(0.0, 0.0, 0.0))
+                    lines.append('    ' + values(1.0, 0.0, 0.0, m0))
+                    lines.append('    ' + values(0.0, e, 0.0, sqrt_a))
+                    lines.append('    ' + values(toe, 0.0, omega0, 0.0))
+                    lines.append('    ' + values(i0, 0.0, omega, 0.0))
+                    lines.append('    ' + values(0.0, 0.0, own_time // 604800, 0.0))
+                    lines.append('    ' + values(2.0, 0.0, 0.0, 1.0))
+                    lines.append('    ' + values(toe, 4.0))
+            time += step
+    return '\n'.join(lines) + '\n'
+
+
+def write_synthetic_navigation(path, **options):
+    with open(path, 'w', encoding='ascii') as f:
+        f.write(synthetic_navigation(**options))
+    return path
+
+
+def _compact_observations(line):
+    # A RINEX observation line (without any satellite number) as a
+    # Compact RINEX data line: every value initialized as a 3rd order
+    # difference, then the LLI/signal strength flags
+    fields = [line[start:start + 16] for start in range(0, len(line), 16)]
+    values = ' '.join(f'3&{round(float(field[:14]) * 1000)}' for field in fields)
+    return values + ' ' + ''.join(field[14:16].ljust(2) for field in fields).rstrip()
+
+
+def compact_rinex(text):
+    """The Compact RINEX (Hatanaka) 1.0/3.0 version of the RINEX text of
+    synthetic_rinex(), as rnx2crx would write it, except that every
+    epoch line and value is initialized rather than differenced from the
+    previous one (which the format allows, and readers must handle)."""
+    lines = text.splitlines()
+    end = next(index for index, line in enumerate(lines) if line[60:].strip() == 'END OF HEADER') + 1
+    rinex_2 = float(lines[0][:9]) < 3
+    compact = [
+        f'{"1.0" if rinex_2 else "3.0":<20}{"COMPACT RINEX FORMAT":<40}CRINEX VERS   / TYPE',
+        f'{"synthetic_rinex":<40}{"01-Mar-24 00:00":<20}CRINEX PROG / DATE',
+        *lines[:end],
+    ]
+    position = end
+    while position < len(lines):
+        line = lines[position]
+        flag, count = (line[28], int(line[29:32])) if rinex_2 else (line[31], int(line[32:35]))
+        if flag not in '01':
+            # Event records: the epoch line, then its header lines as they are
+            compact += ['&' + line[1:] if rinex_2 else line, *lines[position + 1:position + count + 1]]
+            position += count + 1
+            continue
+        if rinex_2:
+            epoch_lines = (count - 1) // 12 + 1
+            satellites = ''.join(epoch_line[32:] for epoch_line in lines[position:position + epoch_lines])
+            data = lines[position + epoch_lines:position + epoch_lines + count]
+            compact.append('&' + line[1:32] + satellites)
+            position += epoch_lines + count
+        else:
+            data = lines[position + 1:position + count + 1]
+            satellites = ''.join(data_line[:3] for data_line in data)
+            data = [data_line[3:] for data_line in data]
+            compact.append(line[:35].ljust(41) + satellites)
+            position += count + 1
+        # The receiver clock offset line (none), then the observations
+        compact.append('')
+        compact += [_compact_observations(data_line) for data_line in data]
+    return '\n'.join(compact) + '\n'
+
+
+def write_synthetic_rinex(path, compress=False, hatanaka=False, **options):
+    text = synthetic_rinex(**options)
+    if hatanaka:
+        text = compact_rinex(text)
+    data = text.encode('ascii')
+    if compress:
+        # mtime=0 keeps the .gz byte-identical between runs
+        with open(path, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+            f.write(data)
+    else:
+        with open(path, 'wb') as f:
+            f.write(data)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output')
+    parser.add_argument('--version', type=float, default=3.04, choices=(2.11, 3.04))
+    parser.add_argument('--duration', type=float, default=3600, help='Seconds of observations')
+    parser.add_argument('--interval', type=float, default=30, help='Sampling interval in seconds')
+    parser.add_argument('--satellites', type=int, default=12)
+    parser.add_argument('--systems', default='G', help='Satellite systems, any of GREC')
+    parser.add_argument('--events', type=int, default=0, help='Event-flag records spread over the file')
+    parser.add_argument('--marker', default='SYNT', help='MARKER NAME')
+    parser.add_argument('--blank-marker', action='store_true', help='Leave MARKER NAME blank')
+    parser.add_argument('--navigation', metavar='NAV', help='Also write a navigation file with their orbits')
+    parser.add_argument('--hatanaka', action='store_true', help='Write Compact RINEX (Hatanaka)')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if set(args.systems) - set(CONSTELLATIONS):
+        parser.error(f'--systems must be letters of {"".join(CONSTELLATIONS)}')
+    write_synthetic_rinex(
+        args.output, compress=args.gzip, hatanaka=args.hatanaka, version=args.version,
+        duration=args.duration, interval=args.interval, satellites=args.satellites, events=args.events,
+        marker_name='' if args.blank_marker else args.marker, seed=args.seed, systems=args.systems,
+    )
+    if args.navigation:
+        write_synthetic_navigation(args.navigation, duration=args.duration, systems=args.systems)
+
+
+if __name__ == '__main__':
+    main()
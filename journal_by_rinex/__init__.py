@@ -1,4 +1,12 @@
-from .main import run_app
+def __getattr__(name):
+    # The GUI (and tkinter) is only imported once run_app is looked up, so
+    # the CLI and worker processes don't load it
+    if name == 'run_app':
+        from .main import run_app
+        return run_app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 if __name__ == "__main__":
-    run_app()
\ No newline at end of file
+    from .main import run_app
+    run_app()
@@ -0,0 +1,1034 @@
+import os
+import fnmatch
+import glob
+import random
+import shutil
+import time
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import importlib.util
+import yaml
+from journal_by_rinex.functions import EPOCH_SCAN_MODES, get_info, journal_map, journal_pdf, journal_text
+from journal_by_rinex.compression import is_rinex_obs_file, strip_compression_suffix
+from journal_by_rinex.tiles import DEFAULT_TILE_CACHE_MAX_MB, tile_source_from_settings, tile_url_template
+from journal_by_rinex.mapcache import DEFAULT_MAP_CACHE_MAX_AGE_DAYS, DEFAULT_MAP_CACHE_MAX_MB, map_cache_from_settings
+from journal_by_rinex.maprender import DEFAULT_MAP_WIDTH_PX, MAP_RENDERERS
+from journal_by_rinex.latexbuild import LATEX_COMPILE_MODES, JournalBatch, latex_builder_from_settings
+from journal_by_rinex.pdftemplate import PDF_MODES, form_templates
+from journal_by_rinex.docxwriter import DOCX_WRITERS
+from journal_by_rinex.manifest import build_key, build_manifest
+from journal_by_rinex.dedup import content_fingerprints
+from journal_by_rinex.headerindex import header_index_from_settings
+from journal_by_rinex.rules import file_rule_index
+from journal_by_rinex.sessionstats import DEFAULT_GAP_INTERVALS, session_statistics_rows
+from journal_by_rinex.pipeline import DEFAULT_PIPELINE_QUEUE_SIZE, run_pipeline
+from journal_by_rinex.dop import DOP_SOURCES, find_orbit_files, format_dop, load_orbits, orbit_signature, session_dop
+from journal_by_rinex import trace
+from journal_by_rinex.geodesy import (
+    coordinate_rows, map_sheet_rows, parse_coordinate_systems, parse_map_sheet_scales,
+)
+
+MEASUREMENT_OPTIONS = [
+    "No tripod, to base",
+    "No tripod, to phase center",
+    "Tripod, slant",
+    "Tripod, to base",
+    "Tripod, to phase center",
+    "Not specified",
+]
+
+SAVE_MODES = ('custom', 'source')
+
+# Default randomization range for GDOP/PDOP
+DEFAULT_DOP_MIN = '1.5'
+DEFAULT_DOP_MAX = '2.0'
+
+# Maps config/metadata field names to the corresponding file_info key
+FIELD_TO_INFO_KEY = {
+    'organization': 'organization',
+    'object': 'object',
+    'operator': 'operator',
+    'geodetic_mark_type': 'centre type',
+    'benchmark_type': 'benchmark type',
+    'gdop': 'gdop',
+    'pdop': 'pdop',
+}
+
+# Settings that are only configurable via YAML config / command line
+# options (there are no GUI controls for them), with their defaults
+BATCH_OPTION_DEFAULTS = {
+    'workers': 1,
+    'max_in_flight': None,
+    'random_seed': None,
+    'epoch_scan': 'bounds',
+    'coordinate_systems': [],
+    'map_sheet_scales': [],
+    'tile_provider': 'quadtree',
+    'tile_cache_dir': None,
+    'tile_cache_max_mb': DEFAULT_TILE_CACHE_MAX_MB,
+    'tile_offline': None,
+    'map_cache_dir': None,
+    'map_cache_max_mb': DEFAULT_MAP_CACHE_MAX_MB,
+    'map_cache_max_age_days': DEFAULT_MAP_CACHE_MAX_AGE_DAYS,
+    'map_renderer': 'fast',
+    'map_width_px': DEFAULT_MAP_WIDTH_PX,
+    'latex_compile': 'precompiled',
+    'latex_build_dir': None,
+    'pdf_mode': 'latex',
+    'latex_batch_size': 1,
+    'docx_writer': 'native',
+    'incremental': True,
+    'deduplicate': True,
+    'header_index': False,
+    'header_index_path': None,
+    'trace': None,
+    'dop_source': 'form',
+    'orbit_files': [],
+    'session_statistics': False,
+    'gap_intervals': DEFAULT_GAP_INTERVALS,
+    'pipeline': False,
+    'pipeline_parsers': 2,
+    'pipeline_tile_fetches': 4,
+    'pipeline_latex_processes': 2,
+    'pipeline_pandoc_processes': 2,
+    'pipeline_queue_size': DEFAULT_PIPELINE_QUEUE_SIZE,
+}
+
+# Settings that change what a journal looks like, so changing any of
+# them rebuilds every journal (see journal_by_rinex.manifest)
+BUILD_OPTIONS = (
+    'epoch_scan', 'coordinate_systems', 'map_sheet_scales', 'tile_provider', 'tile_offline',
+    'map_renderer', 'map_width_px', 'pdf_mode', 'docx_writer', 'dop_source',
+    'session_statistics', 'gap_intervals',
+)
+
+# The stages of process_file() as run by a pipelined batch (pipeline:
+# true), with the setting that limits how many files each one works on
+# at once: parsing, in processes of their own; drawing maps, each
+# fetching its tiles one at a time; the PDFs, compiled by LaTeX; the
+# .tex and .docx, converted by pandoc
+PIPELINE_STAGE_LIMITS = (
+    ('parse', 'pipeline_parsers'),
+    ('map', 'pipeline_tile_fetches'),
+    ('pdf', 'pipeline_latex_processes'),
+    ('docx', 'pipeline_pandoc_processes'),
+)
+
+# What process_file() writes to the output folder for each journal
+JOURNAL_OUTPUT_EXTENSIONS = ('.pdf', '.tex', '.png', '.docx')
+
+# Threads listing folders at once in a folder scan; listing a folder is
+# mostly waiting on the file system (especially over the network), which
+# threads can overlap
+SCAN_WORKERS = 8
+
+# How often a parallel batch checks whether it has been cancelled while
+# it waits for files to finish, in seconds
+CANCEL_POLL_SECONDS = 0.2
+
+ANTENNA_HEIGHT_TYPES = {
+    'No tripod, to base': 'base',
+    'No tripod, to phase center': 'phase',
+    'Tripod, slant': 'tripod_slant',
+    'Tripod, to base': 'tripod_base',
+    'Tripod, to phase center': 'tripod_phase',
+    'Not specified': None,
+}
+
+
+def read_config_file(config_file):
+    with open(config_file, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+
+def read_config_files(config_files):
+    """Merge several YAML config files in order, so later files override
+    values from earlier ones (same as loading them together in the GUI)."""
+    config = {}
+    for config_file in config_files:
+        config.update(read_config_file(config_file))
+    return config
+
+
+def parse_dop_range(min_str, max_str, label):
+    try:
+        lo = float(min_str)
+        hi = float(max_str)
+    except (TypeError, ValueError):
+        raise ValueError(f"{label} min/max must be numbers.")
+    if lo > hi:
+        lo, hi = hi, lo
+    return lo, hi
+
+
+def validate_file_rules(file_rules):
+    if not isinstance(file_rules, list) or not all(
+        isinstance(rule, dict) and 'pattern' in rule for rule in file_rules
+    ):
+        raise ValueError("file_rules must be a list of mappings, each with a 'pattern' key.")
+    return file_rules
+
+
+def file_matches_rule(file_path, pattern):
+    # Match against the file's basename, or its full path (with forward
+    # slashes) for patterns that include a directory part. Batches match
+    # all their rules at once through journal_by_rinex.rules instead.
+    basename = os.path.basename(file_path)
+    normalized_path = os.path.abspath(file_path).replace(os.sep, '/')
+    return fnmatch.fnmatch(basename, pattern) or fnmatch.fnmatch(normalized_path, pattern)
+
+
+def settings_from_config(config):
+    """Resolve a merged YAML config (the same keys apply_config() in the
+    GUI understands) into the settings used by process_file(). Fields
+    missing from the config are left blank rather than taking the GUI's
+    'Enter ...' placeholder texts, which would end up in the journal."""
+    base_metadata = {
+        field_key: str(config[field_key]) if config.get(field_key) is not None else ''
+        for field_key in FIELD_TO_INFO_KEY
+    }
+    base_metadata['measurement_type'] = config.get('measurement_type', MEASUREMENT_OPTIONS[0])
+
+    dop_ranges = {}
+    for prefix in ('gdop', 'pdop'):
+        dop_ranges[prefix] = None
+        if config.get(f'{prefix}_random'):
+            dop_ranges[prefix] = parse_dop_range(
+                config.get(f'{prefix}_min', DEFAULT_DOP_MIN),
+                config.get(f'{prefix}_max', DEFAULT_DOP_MAX),
+                prefix.upper(),
+            )
+
+    save_mode = config.get('save_mode', 'custom')
+    if save_mode not in SAVE_MODES:
+        raise ValueError(f"Unknown save_mode: {save_mode!r}")
+
+    file_rules = config.get('file_rules')
+    file_rules = validate_file_rules(file_rules) if file_rules is not None else []
+
+    return {
+        'base_metadata': base_metadata,
+        'gdop_range': dop_ranges['gdop'],
+        'pdop_range': dop_ranges['pdop'],
+        'file_rules': file_rules,
+        'save_mode': save_mode,
+        'save_path': config.get('save_path') or '',
+        **BATCH_OPTION_DEFAULTS,
+        **batch_options_from_config(config),
+    }
+
+
+def batch_options_from_config(config):
+    """Validate the BATCH_OPTION_DEFAULTS keys present in `config`,
+    returning only those (so they can be layered over earlier values)."""
+    options = {}
+    for key in ('workers', 'max_in_flight', *(setting for _, setting in PIPELINE_STAGE_LIMITS)):
+        if config.get(key) is not None:
+            options[key] = parse_workers(config[key])
+    if 'random_seed' in config:
+        options['random_seed'] = config['random_seed']
+    if config.get('epoch_scan') is not None:
+        if config['epoch_scan'] not in EPOCH_SCAN_MODES:
+            raise ValueError(f"Unknown epoch_scan: {config['epoch_scan']!r}")
+        options['epoch_scan'] = config['epoch_scan']
+    if config.get('coordinate_systems') is not None:
+        options['coordinate_systems'] = parse_coordinate_systems(config['coordinate_systems'])
+    if config.get('map_sheet_scales') is not None:
+        options['map_sheet_scales'] = parse_map_sheet_scales(config['map_sheet_scales'])
+    if config.get('tile_provider') is not None:
+        tile_url_template(config['tile_provider'])
+        options['tile_provider'] = config['tile_provider']
+    if config.get('tile_cache_dir') is not None:
+        options['tile_cache_dir'] = str(config['tile_cache_dir'])
+    if 'tile_offline' in config:
+        tile_offline = config['tile_offline']
+        if tile_offline and not os.path.exists(tile_offline):
+            raise ValueError(f"tile_offline not found: {tile_offline}")
+        options['tile_offline'] = tile_offline or None
+    if config.get('header_index_path') is not None:
+        options['header_index_path'] = str(config['header_index_path'])
+    if config.get('trace') is not None:
+        options['trace'] = str(config['trace'])
+    if config.get('dop_source') is not None:
+        if config['dop_source'] not in DOP_SOURCES:
+            raise ValueError(f"Unknown dop_source: {config['dop_source']!r}")
+        options['dop_source'] = config['dop_source']
+    if config.get('orbit_files') is not None:
+        orbit_files = config['orbit_files']
+        if isinstance(orbit_files, str):
+            orbit_files = [orbit_files]
+        if not isinstance(orbit_files, list):
+            raise ValueError(f"orbit_files must be a list of paths or patterns, got {orbit_files!r}")
+        options['orbit_files'] = [str(pattern) for pattern in orbit_files]
+    if config.get('gap_intervals') is not None:
+        try:
+            options['gap_intervals'] = float(config['gap_intervals'])
+        except (TypeError, ValueError):
+            raise ValueError(f"gap_intervals must be a number, got {config['gap_intervals']!r}")
+        if options['gap_intervals'] <= 0:
+            raise ValueError(f"gap_intervals must be positive, got {config['gap_intervals']!r}")
+    if config.get('map_cache_dir') is not None:
+        options['map_cache_dir'] = str(config['map_cache_dir'])
+    for key in ('tile_cache_max_mb', 'map_cache_max_mb', 'map_cache_max_age_days'):
+        if config.get(key) is not None:
+            try:
+                options[key] = max(int(config[key]), 0)
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be an integer, got {config[key]!r}")
+    if config.get('map_renderer') is not None:
+        if config['map_renderer'] not in MAP_RENDERERS:
+            raise ValueError(f"Unknown map_renderer: {config['map_renderer']!r}")
+        options['map_renderer'] = config['map_renderer']
+    if config.get('map_width_px') is not None:
+        try:
+            options['map_width_px'] = int(config['map_width_px'])
+        except (TypeError, ValueError):
+            raise ValueError(f"map_width_px must be an integer, got {config['map_width_px']!r}")
+        if options['map_width_px'] <= 0:
+            raise ValueError(f"map_width_px must be positive, got {config['map_width_px']!r}")
+    if config.get('latex_compile') is not None:
+        if config['latex_compile'] not in LATEX_COMPILE_MODES:
+            raise ValueError(f"Unknown latex_compile: {config['latex_compile']!r}")
+        options['latex_compile'] = config['latex_compile']
+    if config.get('latex_build_dir') is not None:
+        options['latex_build_dir'] = str(config['latex_build_dir'])
+    if config.get('pdf_mode') is not None:
+        if config['pdf_mode'] not in PDF_MODES:
+            raise ValueError(f"Unknown pdf_mode: {config['pdf_mode']!r}")
+        options['pdf_mode'] = config['pdf_mode']
+    if config.get('pipeline_queue_size') is not None:
+        try:
+            options['pipeline_queue_size'] = max(int(config['pipeline_queue_size']), 1)
+        except (TypeError, ValueError):
+            raise ValueError(f"pipeline_queue_size must be an integer, got {config['pipeline_queue_size']!r}")
+    if config.get('latex_batch_size') is not None:
+        try:
+            options['latex_batch_size'] = max(int(config['latex_batch_size']), 1)
+        except (TypeError, ValueError):
+            raise ValueError(f"latex_batch_size must be an integer, got {config['latex_batch_size']!r}")
+    if config.get('docx_writer') is not None:
+        if config['docx_writer'] not in DOCX_WRITERS:
+            raise ValueError(f"Unknown docx_writer: {config['docx_writer']!r}")
+        if config['docx_writer'] == 'pandoc' and importlib.util.find_spec('pypandoc') is None:
+            raise ValueError("docx_writer: pandoc needs pypandoc (pip install journal_by_rinex[pandoc])")
+        options['docx_writer'] = config['docx_writer']
+    for key in ('incremental', 'deduplicate', 'header_index', 'session_statistics', 'pipeline'):
+        if config.get(key) is not None:
+            options[key] = bool(config[key])
+    return options
+
+
+def parse_workers(value):
+    # 0 means "one worker per CPU core"
+    try:
+        workers = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Worker count must be an integer, got {value!r}")
+    if workers < 0:
+        raise ValueError(f"Worker count must not be negative, got {workers}")
+    return workers or os.cpu_count() or 1
+
+
+def file_random(file, seed):
+    """Random generator for one file's GDOP/PDOP draws. With a seed set,
+    it's derived from the seed and the file's absolute path only, so the
+    values drawn for a file don't depend on which worker processes it or
+    in what order the batch happens to run."""
+    if seed is None:
+        return random
+    normalized_path = os.path.abspath(file).replace(os.sep, '/')
+    return random.Random(f'{seed}:{normalized_path}')
+
+
+def _rule_index(settings):
+    # The FileRuleIndex of settings['file_rules']: the one run_batch()
+    # built for the batch, or else one built now (at a cost that grows
+    # with the number of rules)
+    rules = settings.get('file_rule_index')
+    return rules if rules is not None else file_rule_index(settings['file_rules'])
+
+
+def resolve_file_metadata(file, settings):
+    # Start from the global form values, draw fresh random GDOP/PDOP for
+    # this file if enabled, then let any matching file_rules override
+    # individual fields for this specific file. The rules are matched
+    # through the batch's index, so the cost per file doesn't grow with
+    # their number
+    file_metadata = dict(settings['base_metadata'])
+    rng = file_random(file, settings.get('random_seed'))
+    if settings['gdop_range'] is not None:
+        file_metadata['gdop'] = f'{rng.uniform(*settings["gdop_range"]):.2f}'
+    if settings['pdop_range'] is not None:
+        file_metadata['pdop'] = f'{rng.uniform(*settings["pdop_range"]):.2f}'
+    file_rules = settings['file_rules']
+    for rule_index in _rule_index(settings).matches(file):
+        file_metadata.update({k: v for k, v in file_rules[rule_index].items() if k != 'pattern'})
+    return file_metadata
+
+
+@trace.traced('docx.pandoc')
+def convert_tex_to_docx(tex_file_path, output_dir):
+    # Define the output .docx file path
+    docx_file_path = os.path.join(output_dir, os.path.splitext(os.path.basename(tex_file_path))[0]+'.docx')
+
+    try:
+        # Convert .tex to .docx using pypandoc (only needed for
+        # docx_writer: pandoc, so only imported then)
+        import pypandoc
+        pypandoc.convert_file(tex_file_path, 'docx', outputfile=docx_file_path)
+    except Exception as e:
+        print(f"Error converting {tex_file_path} to docx: {e}")
+
+
+class BatchCancelled(Exception):
+    """Raised by process_file() between stages once its batch has been
+    cancelled."""
+
+
+def _check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise BatchCancelled('Cancelled')
+
+
+def build_options(file, settings):
+    # The BUILD_OPTIONS a journal was built with, plus the orbit files
+    # its computed DOPs came from, so new or updated orbits rebuild it
+    options = {option: settings.get(option) for option in BUILD_OPTIONS}
+    if settings.get('dop_source', 'form') == 'orbits':
+        options['orbit_files'] = orbit_signature(find_orbit_files(file, settings.get('orbit_files', [])))
+    return options
+
+
+def computed_dops(file, settings):
+    """The file's GDOP and PDOP (session mean/max) computed from the
+    satellites it observed and their orbits (see journal_by_rinex.dop),
+    as {'gdop', 'pdop'} journal values."""
+    orbit_files = find_orbit_files(file, settings.get('orbit_files', []))
+    if not orbit_files:
+        raise ValueError(
+            f'No navigation or SP3 files found for {file}: put them next to it or list them in orbit_files')
+    with trace.span('dop'):
+        dops = session_dop(file, load_orbits(orbit_files))
+    return {
+        'gdop': format_dop(dops['gdop_mean'], dops['gdop_max']),
+        'pdop': format_dop(dops['pdop_mean'], dops['pdop_max']),
+    }
+
+
+def output_dir_for(file, settings):
+    if settings['save_mode'] == "source":
+        return os.path.dirname(os.path.abspath(file))
+    return settings['save_path']
+
+
+class JournalJob:
+    """One file on its way through the stages of process_file(): what
+    prepare_journal() resolved for it and, once drawn, the path of its
+    location map. file_info is None if its journal is already up to
+    date, in which case there is nothing left to do."""
+
+    def __init__(self, file, file_metadata, output_dir, key):
+        self.file = file
+        self.file_metadata = file_metadata
+        self.output_dir = output_dir
+        self.key = key
+        self.file_info = None
+        self.save_file = None
+        self.map_path = None
+
+
+def prepare_journal(file, settings, cancel=None):
+    """The parsing stage of process_file(): the file's metadata, RINEX
+    header and epochs (and computed DOPs), resolved into a JournalJob."""
+    file_metadata = resolve_file_metadata(file, settings)
+    if settings.get('dop_source', 'form') == 'orbits':
+        # The computed DOPs replace the form's values before anything
+        # records them: the build key and the processed config
+        file_metadata.update(computed_dops(file, settings))
+        _check_cancelled(cancel)
+    output_dir = output_dir_for(file, settings)
+    job = JournalJob(file, file_metadata, output_dir, build_key(file, file_metadata, build_options(file, settings)))
+    if settings.get('incremental', True) and build_manifest().is_current(output_dir, file, job.key):
+        return job
+
+    # Unchanged files are answered from the header index without being
+    # parsed again. Session statistics need every epoch read
+    index = header_index_from_settings(settings)
+    session_statistics = settings.get('session_statistics', False)
+    epoch_scan = 'full' if session_statistics else settings.get('epoch_scan', 'bounds')
+    gap_intervals = settings.get('gap_intervals', DEFAULT_GAP_INTERVALS)
+    if index is not None:
+        file_info = index.get_info(file, epoch_scan, gap_intervals)
+    else:
+        file_info = get_info(file, epoch_scan=epoch_scan, gap_intervals=gap_intervals)
+    _check_cancelled(cancel)
+
+    measurement_type = file_metadata['measurement_type']
+    if measurement_type not in ANTENNA_HEIGHT_TYPES:
+        raise ValueError(f"Unknown measurement_type {measurement_type!r}")
+    file_info['antenna height type'] = ANTENNA_HEIGHT_TYPES[measurement_type]
+
+    for field_key, info_key in FIELD_TO_INFO_KEY.items():
+        file_info[info_key] = file_metadata.get(field_key, '')
+
+    # Extra map sheets and coordinate systems shown in the journal; the
+    # transformers behind them are built once per process, not per file
+    position = ([file_info['longitude']], [file_info['latitude']])
+    file_info['map sheets'] = map_sheet_rows(*position, settings.get('map_sheet_scales', []))[0]
+    file_info['coordinate systems'] = coordinate_rows(*position, settings.get('coordinate_systems', []))[0]
+    file_info['session statistics'] = session_statistics_rows(file_info) if session_statistics else []
+
+    marker_name = file_info['marker name'].strip()
+    if not marker_name:
+        # MARKER NAME is blank in the RINEX header; fall back to
+        # the source file's own name so output isn't silently
+        # lost/broken, and keep file_info consistent so the map
+        # image and the journal itself use the same name
+        marker_name = os.path.splitext(strip_compression_suffix(os.path.basename(file)))[0]
+        print(f'Warning! Empty MARKER NAME in {file}, using source filename "{marker_name}" instead.')
+    file_info['marker name'] = marker_name
+
+    job.file_info = file_info
+    job.save_file = os.path.join(output_dir, marker_name)
+    return job
+
+
+def draw_journal_map(job, settings):
+    """The map stage of process_file(): the journal's location map."""
+    job.map_path = journal_map(
+        job.file_info, job.save_file,
+        tiles=tile_source_from_settings(settings),
+        map_cache=map_cache_from_settings(settings),
+        map_renderer=settings.get('map_renderer', 'fast'),
+        map_width=settings.get('map_width_px', DEFAULT_MAP_WIDTH_PX),
+    )
+
+
+def write_journal_pdf(job, settings, latex=None):
+    """The PDF stage of process_file(): a filled form template, or a
+    LaTeX compile (only queued, with `latex` a JournalBatch)."""
+    latex_builder = latex_builder_from_settings(settings)
+    journal_pdf(
+        job.file_info, job.save_file, job.map_path,
+        latex=latex if latex is not None else latex_builder,
+        templates=form_templates(latex_builder) if settings.get('pdf_mode', 'latex') == 'template' else None,
+    )
+
+
+def write_journal_docx(job, settings, cancel=None):
+    """The last stage of process_file(): the plain .tex and the .docx
+    (native, or converted from the .tex by pandoc), then the journal's
+    build manifest entry."""
+    journal_text(job.file_info, job.save_file, job.map_path, docx=settings.get('docx_writer', 'native') == 'native')
+    if settings.get('docx_writer', 'native') == 'pandoc':
+        _check_cancelled(cancel)
+        convert_tex_to_docx(job.save_file + '.tex', job.output_dir)
+
+    marker_name = os.path.basename(job.save_file)
+    build_manifest().record(job.output_dir, job.file, job.key, [marker_name + ext for ext in JOURNAL_OUTPUT_EXTENSIONS])
+
+
+def process_file(file, settings, latex=None, cancel=None):
+    """Run the full journal pipeline (RINEX parsing, map, PDF, .tex and
+    .docx) for a single file. Returns the (file, file_metadata) record
+    that save_processed_config()/write_processed_config() expect; any
+    failure is raised to the caller. With `latex` given (a JournalBatch),
+    the PDF is only compiled when that is flushed. Once `cancel` (a
+    threading.Event) is set, BatchCancelled is raised before the next
+    stage starts. With settings['incremental'] set, nothing is rebuilt if
+    the build manifest in the output folder shows the journal's outputs
+    are current."""
+    job = prepare_journal(file, settings, cancel)
+    if job.file_info is None:
+        return file, job.file_metadata
+    _check_cancelled(cancel)
+    draw_journal_map(job, settings)
+    _check_cancelled(cancel)
+    write_journal_pdf(job, settings, latex)
+    _check_cancelled(cancel)
+    write_journal_docx(job, settings, cancel)
+    return file, job.file_metadata
+
+
+def _scan_folder(folder):
+    # (RINEX files, subfolders) directly in `folder`; like os.walk(),
+    # symlinked folders are not followed and unreadable ones are skipped
+    files, subfolders = [], []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if not is_dir:
+                    if is_rinex_obs_file(entry.name):
+                        files.append(entry.path)
+                elif not entry.is_symlink():
+                    subfolders.append(entry.path)
+    except OSError:
+        pass
+    return files, subfolders
+
+
+def scan_rinex_files(folder, workers=SCAN_WORKERS):
+    """Recursively search `folder` for observation RINEX files (*.??o,
+    Hatanaka *.??d / *.crx, and any of those as .gz/.Z/.zip), listing up
+    to `workers` subfolders at a time on threads. Yields the files of
+    each folder as a list as soon as that folder is listed, so a caller
+    can show them while the scan goes on; the order of the folders
+    depends on which listing finishes first."""
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        pending = {executor.submit(_scan_folder, folder)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subfolders = future.result()
+                pending.update(executor.submit(_scan_folder, subfolder) for subfolder in subfolders)
+                if files:
+                    yield files
+
+
+def find_rinex_files(folder):
+    # Every observation RINEX file under `folder` (see scan_rinex_files()),
+    # sorted, so the result doesn't depend on the scan's timing
+    return sorted(file for files in scan_rinex_files(folder) for file in files)
+
+
+def collect_input_files(paths):
+    """Expand a mix of file and folder paths into a de-duplicated file
+    list, scanning folders recursively for observation RINEX files."""
+    files = []
+    seen = set()
+    for path in paths:
+        candidates = find_rinex_files(path) if os.path.isdir(path) else [path]
+        for file in candidates:
+            if file not in seen:
+                seen.add(file)
+                files.append(file)
+    return files
+
+
+def find_duplicates(files, settings):
+    """{duplicate index: index of its first copy} for the files with
+    the same content as an earlier one in `files` (e.g. the same
+    observation file copied into raw, backup and delivery folders) and
+    matched by the same file_rules, so their journals are the same."""
+    fingerprints = content_fingerprints(files)
+    rules = _rule_index(settings)
+    first_copies = {}
+    duplicates = {}
+    for index, file in enumerate(files):
+        if file not in fingerprints:
+            continue
+        matching_rules = tuple(rules.matches(file))
+        first_copy = first_copies.setdefault((fingerprints[file], matching_rules), index)
+        if first_copy != index:
+            duplicates[index] = first_copy
+    return duplicates
+
+
+def reuse_outputs(file, duplicate, file_metadata, settings):
+    """Give `duplicate` the outputs already built from `file` (with
+    identical content): nothing to do when both share an output folder,
+    since the journal is the same, otherwise they are copied, and
+    recorded in the build manifest as built from `duplicate`."""
+    source_dir = output_dir_for(file, settings)
+    target_dir = output_dir_for(duplicate, settings)
+    if os.path.abspath(source_dir) == os.path.abspath(target_dir):
+        return
+    manifest = build_manifest()
+    names = manifest.outputs(source_dir, file)
+    for name in names:
+        shutil.copyfile(os.path.join(source_dir, name), os.path.join(target_dir, name))
+    key = build_key(duplicate, file_metadata, build_options(duplicate, settings))
+    manifest.record(target_dir, duplicate, key, names, built=False)
+
+
+def _process_stats(settings):
+    # Counters of this process's header index, map tile and rendered map
+    # caches, its LaTeX compiles, its form template fills and its skipped
+    # and built journals
+    map_cache = map_cache_from_settings(settings)
+    latex = latex_builder_from_settings(settings)
+    index = header_index_from_settings(settings)
+    return {
+        'header_index': index.stats() if index is not None else {},
+        'tile_cache': tile_source_from_settings(settings).stats(),
+        'map_cache': map_cache.stats() if map_cache is not None else {},
+        'latex': latex.stats(),
+        'pdf_template': form_templates(latex).stats(),
+        'build': build_manifest().stats(),
+    }
+
+
+def _process_stats_delta(before, after):
+    return {
+        cache: {key: counters[key] - before[cache].get(key, 0) for key in counters}
+        for cache, counters in after.items()
+    }
+
+
+def _timed_process_file(file, settings, cancel=None):
+    # Runs in the worker process; errors come back as values rather than
+    # exceptions so one failed file never tears down the pool (except for
+    # BatchCancelled, which stops the batch). Cache and compile counters
+    # and trace spans are per process, so each file reports its own share
+    trace.enable(trace.trace_path_from_settings(settings) is not None)
+    file_start = time.perf_counter()
+    try:
+        stats_before = _process_stats(settings)
+        with trace.traced_file(file):
+            _, file_metadata = process_file(file, settings, cancel=cancel)
+    except BatchCancelled:
+        raise
+    except Exception as e:
+        return file, None, str(e), time.perf_counter() - file_start, {}, trace.drain()
+    file_stats = _process_stats_delta(stats_before, _process_stats(settings))
+    return file, file_metadata, None, time.perf_counter() - file_start, file_stats, trace.drain()
+
+
+def _timed_process_files(files, settings, cancel=None):
+    # _timed_process_file() results for a group of files whose journals
+    # are compiled together in a single LaTeX run when the group is done
+    # (see JournalBatch); the run's time is shared out between them. If
+    # the batch is cancelled part way, the journals queued so far are
+    # still compiled and only their files' results are returned
+    if len(files) == 1:
+        return [_timed_process_file(files[0], settings, cancel)]
+    trace.enable(trace.trace_path_from_settings(settings) is not None)
+    stats_before = _process_stats(settings)
+    journals = JournalBatch(latex_builder_from_settings(settings))
+    results = []
+    owners = {}
+    for file in files:
+        file_start = time.perf_counter()
+        queued = len(journals.pending)
+        try:
+            with trace.traced_file(file):
+                _, file_metadata = process_file(file, settings, latex=journals, cancel=cancel)
+        except BatchCancelled:
+            del journals.pending[queued:]
+            break
+        except Exception as e:
+            del journals.pending[queued:]
+            results.append([file, None, str(e), time.perf_counter() - file_start, {}, trace.drain()])
+            continue
+        for _, filename, _ in journals.pending[queued:]:
+            owners[filename] = len(results)
+        results.append([file, file_metadata, None, time.perf_counter() - file_start, {}, trace.drain()])
+
+    flush_start = time.perf_counter()
+    with trace.span('latex.batch', journals=len(journals.pending)):
+        errors = journals.flush()
+    flush_seconds = (time.perf_counter() - flush_start) / max(len(owners), 1)
+    manifest = build_manifest()
+    for filename, owner in owners.items():
+        results[owner][3] += flush_seconds
+        # The manifest entries were written before the PDFs were
+        output_dir = output_dir_for(results[owner][0], settings)
+        if filename in errors:
+            results[owner][1:3] = [None, errors[filename]]
+            manifest.forget(output_dir, results[owner][0])
+        else:
+            manifest.refresh(output_dir, results[owner][0])
+    if results:
+        results[0][4] = _process_stats_delta(stats_before, _process_stats(settings))
+        # The spans of the shared compile go with the first file's
+        results[0][5] += trace.drain()
+    return [tuple(result) for result in results]
+
+
+def _file_groups(files, settings):
+    # (index, file) groups processed as a unit: several files at a time
+    # when journals are compiled in batches, one at a time otherwise
+    size = 1
+    if settings.get('pdf_mode', 'latex') == 'latex':
+        size = settings.get('latex_batch_size') or 1
+    indexed = list(enumerate(files))
+    return [indexed[start:start + size] for start in range(0, len(indexed), size)]
+
+
+def _cancelled(cancel):
+    return cancel is not None and cancel.is_set()
+
+
+def _iter_sequential(files, settings, cancel=None):
+    for group in _file_groups(files, settings):
+        if _cancelled(cancel):
+            return
+        try:
+            results = _timed_process_files([file for _, file in group], settings, cancel)
+        except BatchCancelled:
+            return
+        for (index, _), result in zip(group, results):
+            yield (index, *result)
+
+
+# The settings of the batch a worker process works for: given to it
+# once when it starts (see _init_worker()), not pickled again with each
+# of its files, as they may carry thousands of file_rules and their index
+_worker_settings = None
+
+
+def _init_worker(settings):
+    global _worker_settings
+    _worker_settings = settings
+
+
+def _worker_process_files(files):
+    return _timed_process_files(files, _worker_settings)
+
+
+def _process_pool(workers, settings):
+    # Spawned rather than forked workers: the pool is started from the
+    # GUI's batch thread, and a fork of a multi-threaded Tk process only
+    # carries over the forking thread (and whatever locks the others held)
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker, initargs=(settings,),
+    )
+
+
+def _iter_parallel(files, settings, workers, max_in_flight, cancel=None):
+    # At most max_in_flight groups of files are submitted at any time, so
+    # a huge batch doesn't queue thousands of pending tasks (and their
+    # results) in memory up front. Once cancelled, no more files are
+    # submitted and the ones not started yet are dropped; the files the
+    # workers are already on are finished
+    pending = {}
+    group_iter = iter(_file_groups(files, settings))
+    with _process_pool(workers, settings) as executor:
+        while True:
+            while len(pending) < max_in_flight and not _cancelled(cancel):
+                try:
+                    group = next(group_iter)
+                except StopIteration:
+                    break
+                pending[executor.submit(_worker_process_files, [file for _, file in group])] = group
+            if _cancelled(cancel):
+                for future in [future for future in pending if future.cancel()]:
+                    del pending[future]
+            if not pending:
+                break
+            done, _ = wait(
+                pending, timeout=CANCEL_POLL_SECONDS if cancel is not None else None,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                group = pending.pop(future)
+                for (index, _), result in zip(group, future.result()):
+                    yield (index, *result)
+
+
+def _pipeline_parse(task):
+    # The parse stage of a pipelined batch, in a parser process; like
+    # _timed_process_file(), the error, counters and spans of the file
+    # come back with it
+    settings = _worker_settings
+    trace.enable(trace.trace_path_from_settings(settings) is not None)
+    stats_before = _process_stats(settings)
+    try:
+        with trace.traced_file(task['file'], 'pipeline.parse'):
+            task['job'] = prepare_journal(task['file'], settings)
+    except Exception as e:
+        task['error'] = str(e)
+    task['stats'] = _process_stats_delta(stats_before, _process_stats(settings))
+    task['spans'] = trace.drain()
+    return task
+
+
+def _pipeline_stage(name, stage, cancel, task):
+    # The other stages of a pipelined batch, on threads of this process
+    if _cancelled(cancel):
+        task['cancelled'] = True
+        return task
+    try:
+        with trace.traced_file(task['file'], f'pipeline.{name}'):
+            stage(task['job'])
+    except BatchCancelled:
+        task['cancelled'] = True
+    except Exception as e:
+        task['error'] = str(e)
+    return task
+
+
+def _pipeline_finished(task):
+    return task['error'] is not None or task['cancelled'] or task['job'].file_info is None
+
+
+def _add_stats(total, stats):
+    for stage, counters in stats.items():
+        for key, value in counters.items():
+            total.setdefault(stage, {})[key] = total.get(stage, {}).get(key, 0) + value
+    return total
+
+
+def _iter_pipeline(files, settings, cancel=None):
+    # Every file goes through the stages of process_file() on its own,
+    # each stage working on several files at once (see
+    # PIPELINE_STAGE_LIMITS and journal_by_rinex.pipeline), so parsing,
+    # tile downloads, LaTeX and pandoc all overlap. Results come as the
+    # files finish; their counters and spans are those of their parser
+    # process plus this process's since the previous result
+    limits = [settings.get(setting) or BATCH_OPTION_DEFAULTS[setting] for _, setting in PIPELINE_STAGE_LIMITS]
+    stage_functions = {
+        'map': lambda job: draw_journal_map(job, settings),
+        'pdf': lambda job: write_journal_pdf(job, settings),
+        'docx': lambda job: write_journal_docx(job, settings, cancel),
+    }
+    with _process_pool(limits[0], settings) as parsers, \
+            ThreadPoolExecutor(max_workers=limits[1]) as maps, \
+            ThreadPoolExecutor(max_workers=limits[2]) as pdfs, \
+            ThreadPoolExecutor(max_workers=limits[3]) as docxs:
+        executors = {'map': maps, 'pdf': pdfs, 'docx': docxs}
+        stages = [('parse', _pipeline_parse, parsers, limits[0])]
+        stages += [
+            (name, functools.partial(_pipeline_stage, name, stage_functions[name], cancel), executors[name], limit)
+            for (name, _), limit in zip(PIPELINE_STAGE_LIMITS[1:], limits[1:])
+        ]
+        tasks = (
+            {'position': position, 'file': file, 'start': time.perf_counter(),
+             'job': None, 'error': None, 'cancelled': False, 'stats': {}, 'spans': []}
+            for position, file in enumerate(files)
+        )
+        stats_before = _process_stats(settings)
+        for task in run_pipeline(
+                tasks, stages, settings.get('pipeline_queue_size') or DEFAULT_PIPELINE_QUEUE_SIZE,
+                finished=_pipeline_finished, stop=lambda: _cancelled(cancel)):
+            if task['cancelled']:
+                continue
+            stats_after = _process_stats(settings)
+            file_stats = _add_stats(task['stats'], _process_stats_delta(stats_before, stats_after))
+            stats_before = stats_after
+            file_metadata = task['job'].file_metadata if task['error'] is None else None
+            yield (task['position'], task['file'], file_metadata, task['error'],
+                   time.perf_counter() - task['start'], file_stats, task['spans'] + trace.drain())
+
+
+def run_batch(files, settings, on_result=None, cancel=None):
+    """Process every file, never stopping on a single file's failure.
+    With settings['workers'] > 1 the files are spread over a process
+    pool, and with settings['pipeline'] set they go through the stages
+    of process_file() as a pipeline instead (see _iter_pipeline());
+    on_result(file, file_metadata, error, seconds) is then called in
+    completion order, with exactly one of file_metadata/error set.
+    Setting `cancel` (a threading.Event, e.g. from another thread) stops
+    the batch cleanly between stages; the files that were not (fully)
+    processed by then are listed under 'cancelled'. With
+    settings['deduplicate'] set, files with the same content as an
+    earlier one are processed only once; each such duplicate gets its
+    first copy's outputs (see reuse_outputs()), metadata or error, and
+    is listed under 'duplicates' as a (duplicate, first copy) pair.
+
+    Returns a summary dict with the processed (file, file_metadata)
+    records (including files skipped as up to date) and the (file, error
+    message) failures, both in input order regardless of scheduling,
+    overall timing, and the header index, map tile and rendered map
+    cache counters, LaTeX compile and form template timings and the
+    skipped/built journal counts summed over all files. With tracing on
+    (settings['trace'] or the JOURNAL_BY_RINEX_TRACE environment
+    variable set to the trace file's path), every file's stage spans are
+    written there and 'stages' sums them up per stage (see
+    journal_by_rinex.trace).
+    """
+    files = list(files)
+    # The file_rules are compiled once for the whole batch, rather than
+    # looked up again for every file (see resolve_file_metadata())
+    settings = {**settings, 'file_rule_index': file_rule_index(settings.get('file_rules') or [])}
+    workers = settings.get('workers') or 1
+    batch_start = time.perf_counter()
+    trace_path = trace.trace_path_from_settings(settings)
+    trace.enable(trace_path is not None)
+    trace.drain()
+
+    duplicates = {}
+    if settings.get('deduplicate', True):
+        with trace.span('deduplicate', files=len(files)):
+            duplicates = find_duplicates(files, settings)
+    spans = trace.drain()
+    copies = {}
+    for index, first_copy in duplicates.items():
+        copies.setdefault(first_copy, []).append(index)
+    # Indexes (into files) of the files actually processed
+    scheduled = [index for index in range(len(files)) if index not in duplicates]
+    scheduled_files = [files[index] for index in scheduled]
+
+    if settings.get('pipeline') and scheduled_files:
+        results = _iter_pipeline(scheduled_files, settings, cancel)
+    elif workers > 1 and len(_file_groups(scheduled_files, settings)) > 1:
+        max_in_flight = settings.get('max_in_flight') or 2 * workers
+        results = _iter_parallel(scheduled_files, settings, workers, max(max_in_flight, workers), cancel)
+    else:
+        results = _iter_sequential(scheduled_files, settings, cancel)
+
+    processed_records = []
+    failed_files = []
+    stats = {'header_index': {}, 'tile_cache': {}, 'map_cache': {}, 'latex': {}, 'pdf_template': {}, 'build': {}}
+
+    def add_result(index, file, file_metadata, error, seconds):
+        if error is None:
+            processed_records.append((index, file, file_metadata))
+        else:
+            failed_files.append((index, file, error))
+        if on_result is not None:
+            on_result(file, file_metadata, error, seconds)
+
+    for position, file, file_metadata, error, seconds, file_stats, file_spans in results:
+        spans += file_spans
+        for stage, counters in file_stats.items():
+            for key, value in counters.items():
+                stats[stage][key] = stats[stage].get(key, 0) + value
+        index = scheduled[position]
+        add_result(index, file, file_metadata, error, seconds)
+        for duplicate_index in copies.get(index, []):
+            duplicate = files[duplicate_index]
+            copy_start = time.perf_counter()
+            copy_metadata, copy_error = file_metadata, error
+            if error is None:
+                try:
+                    reuse_outputs(file, duplicate, file_metadata, settings)
+                except OSError as e:
+                    copy_metadata, copy_error = None, f'Could not copy the outputs of {file}: {e}'
+            add_result(duplicate_index, duplicate, copy_metadata, copy_error, time.perf_counter() - copy_start)
+
+    elapsed = time.perf_counter() - batch_start
+    stages = {}
+    if trace_path is not None:
+        spans += trace.drain()
+        try:
+            trace.write_trace(trace_path, spans)
+        except OSError as e:
+            print(f'Warning! Could not write the trace file {trace_path}: {e}')
+        stages = trace.stage_summary(spans)
+    finished = {index for index, _, _ in processed_records} | {index for index, _, _ in failed_files}
+    return {
+        'processed': [(file, metadata) for _, file, metadata in sorted(processed_records, key=lambda r: r[0])],
+        'failed': [(file, error) for _, file, error in sorted(failed_files, key=lambda r: r[0])],
+        'cancelled': [file for index, file in enumerate(files) if index not in finished],
+        'duplicates': [(files[index], files[first_copy]) for index, first_copy in sorted(duplicates.items())],
+        'elapsed': elapsed,
+        'files_per_second': len(finished) / elapsed if elapsed > 0 else 0.0,
+        'stages': stages,
+        **stats,
+    }
+
+
+def processed_config(processed_records):
+    # One file_rules entry per processed file, matched by its exact
+    # absolute path, with the exact parameters that were applied to it
+    return {
+        'file_rules': [
+            {
+                'pattern': glob.escape(os.path.abspath(file)).replace(os.sep, '/'),
+                **metadata,
+            }
+            for file, metadata in processed_records
+        ]
+    }
+
+
+def write_processed_config(config_file, processed_records):
+    with open(config_file, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(processed_config(processed_records), f, allow_unicode=True, sort_keys=False)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import argparse
+import contextlib
+
+# No display on batch servers: pick matplotlib's non-interactive backend
+# before anything imports pyplot
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from journal_by_rinex.functions import EPOCH_SCAN_MODES
+from journal_by_rinex.batch import (
+    SAVE_MODES, collect_input_files, read_config_files, settings_from_config,
+    run_batch, write_processed_config,
+)
+from journal_by_rinex.dop import DOP_SOURCES
+from journal_by_rinex.mapcache import map_cache_from_settings
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='journal_by_rinex_batch',
+        description='Generate GNSS observation journals from RINEX files without the GUI. '
+                    'Prints one JSON object per processed file and a final summary to stdout.',
+    )
+    parser.add_argument(
+        'paths', nargs='+',
+        help='RINEX files and/or folders (folders are scanned recursively for *.??o, *.??d and *.crx '
+             'files, also compressed as .gz/.Z/.zip)')
+    parser.add_argument(
+        '-c', '--config', action='append', default=[],
+        help='YAML config file; may be given several times, later files override earlier ones')
+    parser.add_argument('--save-path', help='Output folder (overrides save_path from the config)')
+    parser.add_argument(
+        '--save-mode', choices=SAVE_MODES,
+        help='"custom" (single output folder) or "source" (next to each RINEX file)')
+    parser.add_argument(
+        '-j', '--workers', type=int,
+        help='Number of worker processes (0 = one per CPU core; overrides workers from the config)')
+    parser.add_argument(
+        '--max-in-flight', type=int,
+        help='Maximum number of files queued to the workers at once (default: 2 x workers)')
+    parser.add_argument(
+        '--pipeline', action='store_true',
+        help='Overlap parsing, map drawing, LaTeX and .docx output of different files, each stage '
+             'with its own limit (same as pipeline: true in the config; pipeline_* set the limits)')
+    parser.add_argument(
+        '--seed',
+        help='Seed for the random GDOP/PDOP draws, making them reproducible (overrides random_seed)')
+    parser.add_argument(
+        '--epoch-scan', choices=EPOCH_SCAN_MODES,
+        help='"bounds" reads only the first and last epochs of each file (default), '
+             '"full" reads every epoch record (overrides epoch_scan from the config)')
+    parser.add_argument(
+        '--session-statistics', action='store_true',
+        help='Read every epoch of each file and add its epoch count, sampling interval, gaps, '
+             'completeness and satellites per epoch to the session table (same as '
+             'session_statistics: true in the config)')
+    parser.add_argument(
+        '--tile-offline', metavar='PATH',
+        help='Read map tiles only from this MBTiles file or XYZ tile directory, without any downloads '
+             '(overrides tile_offline from the config)')
+    parser.add_argument(
+        '--latex-batch-size', type=int, metavar='N',
+        help='With pdf_mode: latex, compile N journals in one LaTeX run, trading latency '
+             'for throughput (overrides latex_batch_size from the config)')
+    parser.add_argument(
+        '--dop-source', choices=DOP_SOURCES,
+        help='"form" takes GDOP/PDOP from the config (typed or random, default), "orbits" computes '
+             'their session mean/max from the observed satellites and the navigation or SP3 files '
+             '(overrides dop_source from the config)')
+    parser.add_argument(
+        '--orbit-files', nargs='+', metavar='PATH',
+        help='Navigation or SP3 files (or glob patterns) for --dop-source orbits, in addition to '
+             'the navigation files found next to each RINEX file (overrides orbit_files)')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Rebuild every journal, even those whose outputs the build manifest in the output '
+             'folder shows are up to date (same as incremental: false in the config)')
+    parser.add_argument(
+        '--trace', metavar='FILE',
+        help='Record how long each stage of every file took and write it to FILE: a Chrome trace '
+             '(chrome://tracing, Perfetto), or JSON lines if FILE ends in .jsonl (overrides trace '
+             'from the config and the JOURNAL_BY_RINEX_TRACE environment variable)')
+    parser.add_argument(
+        '--clear-map-cache', action='store_true',
+        help='Delete all cached location maps before the run, e.g. after the tile provider '
+             'changed its imagery, so every map is drawn again')
+    parser.add_argument(
+        '--save-yaml', metavar='FILE',
+        help='Write the resolved per-file parameters as file_rules to this YAML file')
+    return parser
+
+
+def _emit(stream, record):
+    stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+    stream.flush()
+
+
+def run_cli(argv=None):
+    args = build_parser().parse_args(argv)
+    out = sys.stdout
+
+    try:
+        config = read_config_files(args.config)
+        if args.save_mode is not None:
+            config['save_mode'] = args.save_mode
+        if args.save_path is not None:
+            config['save_path'] = args.save_path
+        if args.workers is not None:
+            config['workers'] = args.workers
+        if args.max_in_flight is not None:
+            config['max_in_flight'] = args.max_in_flight
+        if args.pipeline:
+            config['pipeline'] = True
+        if args.seed is not None:
+            config['random_seed'] = args.seed
+        if args.epoch_scan is not None:
+            config['epoch_scan'] = args.epoch_scan
+        if args.session_statistics:
+            config['session_statistics'] = True
+        if args.tile_offline is not None:
+            config['tile_offline'] = args.tile_offline
+        if args.latex_batch_size is not None:
+            config['latex_batch_size'] = args.latex_batch_size
+        if args.dop_source is not None:
+            config['dop_source'] = args.dop_source
+        if args.orbit_files is not None:
+            config['orbit_files'] = args.orbit_files
+        if args.force:
+            config['incremental'] = False
+        if args.trace is not None:
+            config['trace'] = args.trace
+        settings = settings_from_config(config)
+    except Exception as e:
+        _emit(out, {'event': 'error', 'error': f'Invalid configuration: {e}'})
+        return 2
+
+    if settings['save_mode'] == 'custom' and not settings['save_path']:
+        _emit(out, {'event': 'error', 'error': 'No save path: use --save-path, save_path or --save-mode source'})
+        return 2
+
+    if settings['save_mode'] == 'custom':
+        os.makedirs(settings['save_path'], exist_ok=True)
+
+    if args.clear_map_cache:
+        map_cache = map_cache_from_settings(settings)
+        if map_cache is not None:
+            map_cache.clear()
+
+    files = collect_input_files(args.paths)
+
+    def on_result(file, file_metadata, error, seconds):
+        record = {'event': 'file', 'file': file, 'status': 'ok' if error is None else 'error'}
+        if error is not None:
+            record['error'] = error
+        record['seconds'] = round(seconds, 3)
+        _emit(out, record)
+
+    # Warnings printed by the pipeline go to stderr, so stdout stays
+    # parseable as JSON lines
+    with contextlib.redirect_stdout(sys.stderr):
+        summary = run_batch(files, settings, on_result=on_result)
+
+    if args.save_yaml and summary['processed']:
+        write_processed_config(args.save_yaml, summary['processed'])
+
+    _emit(out, {
+        'event': 'summary',
+        'files': len(files),
+        'processed': len(summary['processed']),
+        'failed': len(summary['failed']),
+        'failures': [{'file': f, 'error': err} for f, err in summary['failed']],
+        'duplicates': [{'file': f, 'same_as': first} for f, first in summary['duplicates']],
+        'elapsed': round(summary['elapsed'], 3),
+        'files_per_second': round(summary['files_per_second'], 3),
+        'header_index': summary['header_index'],
+        'tile_cache': summary['tile_cache'],
+        'map_cache': summary['map_cache'],
+        'latex': {key: round(value, 3) for key, value in summary['latex'].items()},
+        'pdf_template': {key: round(value, 3) for key, value in summary['pdf_template'].items()},
+        'build': summary['build'],
+        'stages': {
+            stage: {key: value if key == 'count' else round(value, 4) for key, value in timings.items()}
+            for stage, timings in summary['stages'].items()
+        },
+    })
+    return 1 if summary['failed'] else 0
+
+
+def main():
+    sys.exit(run_cli())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import os
+import re
+import math
+import gzip
+import zipfile
+import fnmatch
+import itertools
+import contextlib
+
+# Observation RINEX file name patterns: plain RINEX 2/3 short names
+# (*.??o), Hatanaka-compressed short names (*.??d) and RINEX 3 long
+# names of Hatanaka-compressed files (*.crx)
+RINEX_OBS_PATTERNS = ('*.??o', '*.??O', '*.??d', '*.??D', '*.crx', '*.CRX')
+
+# All of RINEX_OBS_PATTERNS as one regular expression, so a folder scan
+# matches each file name once rather than once per pattern
+_RINEX_OBS_RE = re.compile('|'.join(fnmatch.translate(os.path.normcase(pattern)) for pattern in RINEX_OBS_PATTERNS))
+
+# Outer compression suffixes a RINEX file name may additionally carry,
+# e.g. "site1530.23d.Z" or "SITE00XXX_R_20241530000_01D_30S_MO.crx.gz"
+COMPRESSION_SUFFIXES = ('.gz', '.z', '.zip')
+
+# Leading bytes of gzip, Unix compress (.Z) and zip files. The format
+# is recognized by these rather than by the file name, since archives
+# are not always named consistently
+GZIP_MAGIC = b'\x1f\x8b'
+LZW_MAGIC = b'\x1f\x9d'
+ZIP_MAGIC = b'PK\x03\x04'
+
+# Chunk size for reading .Z files, in bytes
+LZW_READ_SIZE = 64 * 1024
+
+
+def strip_compression_suffix(filename):
+    """`filename` without a trailing .gz/.Z/.zip suffix, if it has one."""
+    root, ext = os.path.splitext(filename)
+    return root if ext.lower() in COMPRESSION_SUFFIXES else filename
+
+
+def is_rinex_obs_file(filename):
+    # Compressed files are matched by the name they have once decompressed
+    name = strip_compression_suffix(os.path.basename(filename))
+    return _RINEX_OBS_RE.match(os.path.normcase(name)) is not None
+
+
+class _LineStream:
+    """Forward-only binary file interface over an iterator of lines, for
+    the parts of the RINEX readers that only ever call readline()."""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+
+    def readline(self):
+        return next(self._lines, b'')
+
+    def __iter__(self):
+        return self._lines
+
+    def seekable(self):
+        return False
+
+
+@contextlib.contextmanager
+def open_rinex(rinex_file):
+    """Open a RINEX observation file for reading in binary mode, decoding
+    gzip, Unix compress (.Z), zip and Hatanaka (Compact RINEX) on the fly
+    so the decompressed file is never written out anywhere.
+
+    Plain RINEX files are yielded as the open (seekable) file itself.
+    Anything compressed is yielded as a forward-only stream whose
+    seekable() is False, read in small chunks however large the file is.
+    """
+    with contextlib.ExitStack() as stack:
+        f = stack.enter_context(open(rinex_file, 'rb'))
+        magic = f.read(len(ZIP_MAGIC))
+        f.seek(0)
+        compressed = True
+        if magic.startswith(GZIP_MAGIC):
+            f = stack.enter_context(gzip.GzipFile(fileobj=f))
+        elif magic.startswith(LZW_MAGIC):
+            f = _LineStream(_iter_lines(_unlzw(f)))
+        elif magic.startswith(ZIP_MAGIC):
+            archive = stack.enter_context(zipfile.ZipFile(f))
+            f = stack.enter_context(archive.open(_zip_member(archive, rinex_file)))
+        else:
+            compressed = False
+
+        first_line = f.readline()
+        if first_line[60:].strip() == b'CRINEX VERS   / TYPE':
+            yield _LineStream(_crinex_lines(first_line, f))
+        elif compressed:
+            yield _LineStream(itertools.chain([first_line], f))
+        else:
+            f.seek(0)
+            yield f
+
+
+def _zip_member(archive, rinex_file):
+    """The RINEX observation file inside a zip archive: the only member
+    with an observation file name, or else the archive's only member."""
+    names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    candidates = [name for name in names if is_rinex_obs_file(name)] or names
+    if len(candidates) != 1:
+        raise ValueError(f'Expected a single RINEX observation file in zip archive, found {len(candidates)}: {rinex_file}')
+    return candidates[0]
+
+
+def _iter_lines(chunks):
+    """Split a stream of byte chunks into lines, keeping the newlines."""
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+
+def _unlzw(f, read_size=LZW_READ_SIZE):
+    """Incrementally decompress a Unix compress (.Z) stream, yielding the
+    output in chunks. Follows the reference ncompress decoder, including
+    its quirk of skipping the rest of the current group of 8 codes
+    whenever the code width grows or the table is cleared."""
+    header = f.read(3)
+    if len(header) < 3 or header[:2] != LZW_MAGIC:
+        raise ValueError('Not a Unix compress (.Z) file')
+    max_bits = header[2] & 0x1f
+    block_mode = bool(header[2] & 0x80)
+    if not 9 <= max_bits <= 16:
+        raise ValueError(f'Unsupported .Z code width: {max_bits} bits')
+
+    def max_code_for(n_bits):
+        return 1 << max_bits if n_bits >= max_bits else (1 << n_bits) - 1
+
+    # Each entry holds its whole decoded string, so decoding a code is a
+    # single lookup instead of walking a prefix chain
+    table = [bytes([i]) for i in range(256)] + [b''] * ((1 << max_bits) - 256)
+    first_free = 257 if block_mode else 256
+    free_ent = first_free
+    n_bits = 9
+    max_code = max_code_for(n_bits)
+    previous = None
+    buffer = b''
+    position = 0
+    eof = False
+
+    while True:
+        if free_ent > max_code:
+            n_bits += 1
+            max_code = max_code_for(n_bits)
+        while len(buffer) - position < n_bits and not eof:
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+        group = buffer[position:position + n_bits]
+        position += n_bits
+        if not group:
+            break
+
+        bits = int.from_bytes(group, 'little')
+        mask = (1 << n_bits) - 1
+        output = []
+        for shift in range(0, len(group) * 8 - n_bits + 1, n_bits):
+            code = (bits >> shift) & mask
+            if previous is None:
+                if code >= 256:
+                    raise ValueError('Corrupt .Z file: invalid first code')
+                previous = table[code]
+                output.append(previous)
+                continue
+            if code == 256 and block_mode:
+                free_ent = first_free - 1
+                n_bits = 9
+                max_code = max_code_for(n_bits)
+                break
+            if code < free_ent:
+                entry = table[code]
+            elif code == free_ent:
+                entry = previous + previous[:1]
+            else:
+                raise ValueError('Corrupt .Z file: code out of range')
+            output.append(entry)
+            if free_ent < 1 << max_bits:
+                table[free_ent] = previous + entry[:1]
+                free_ent += 1
+            previous = entry
+            if free_ent > max_code:
+                break
+        if output:
+            yield b''.join(output)
+
+
+def _crinex_repair(old, diff):
+    """Apply a Compact RINEX text difference to the previous epoch line:
+    a space keeps the old character, '&' blanks it, anything else
+    replaces it."""
+    new = bytearray(old.ljust(len(diff)))
+    for i, char in enumerate(diff):
+        if char == 0x26:  # '&'
+            new[i] = 0x20
+        elif char != 0x20:
+            new[i] = char
+    return bytes(new)
+
+
+def _crinex_lines(first_line, f):
+    """Decode a Compact RINEX (Hatanaka) 1.0/3.0 stream incrementally into
+    RINEX lines: the header as-is, then every epoch record line (with the
+    event header records that follow flag 2-5 epochs).
+
+    Observation data lines are skipped without being decoded, since only
+    the header, the epoch records and which satellites each epoch has
+    are read downstream: the yielded text is a RINEX file with blank
+    observations, one blank line per line of observations in RINEX 2 and
+    a line of just the satellite's number per satellite in RINEX 3.
+    """
+    lines = iter(f)
+    rinex_2 = first_line[:9].strip().startswith(b'1')
+    # Epoch line layout: initialization marker, event flag column, number
+    # of satellites columns (which end the RINEX epoch fields) and where
+    # Compact RINEX puts the satellite list
+    if rinex_2:
+        init_marker, flag_index, count_slice, sats_offset = b'&', 28, slice(29, 32), 32
+    else:
+        init_marker, flag_index, count_slice, sats_offset = b'>', 31, slice(32, 35), 41
+
+    # CRINEX PROG / DATE, then the RINEX header unchanged
+    next(lines, None)
+    lines_per_satellite = 1
+    for line in lines:
+        yield line
+        label = line[60:].strip()
+        if label == b'# / TYPES OF OBSERV' and line[:6].strip():
+            lines_per_satellite = max(math.ceil(int(line[:6]) / 5), 1)
+        elif label == b'END OF HEADER':
+            break
+    else:
+        return
+
+    epoch = b''
+    for line in lines:
+        line = line.rstrip(b'\r\n')
+        if line[:1] == init_marker:
+            new_epoch = b' ' + line[1:] if rinex_2 else line
+        else:
+            new_epoch = _crinex_repair(epoch, line)
+        count = int(new_epoch[count_slice].strip() or 0)
+
+        if new_epoch[flag_index:flag_index + 1] in (b'2', b'3', b'4', b'5'):
+            # Event record: `count` header lines follow uncompressed
+            yield new_epoch[:count_slice.stop] + b'\n'
+            for _ in range(count):
+                yield next(lines, b'')
+            continue
+
+        epoch = new_epoch
+        sats = [epoch[i:i + 3] for i in range(sats_offset, sats_offset + 3 * count, 3)]
+        if rinex_2:
+            # RINEX 2 lists the satellites on the epoch line itself, 12 per
+            # line with continuation lines as needed
+            for start in range(0, max(len(sats), 1), 12):
+                prefix = epoch[:count_slice.stop] if start == 0 else b' ' * count_slice.stop
+                yield prefix + b''.join(sats[start:start + 12]) + b'\n'
+            for _ in range(len(sats) * lines_per_satellite):
+                yield b'\n'
+        else:
+            yield epoch[:count_slice.stop] + b'\n'
+            for sat in sats:
+                yield sat + b'\n'
+        # Receiver clock offset line, then one data line per satellite
+        for _ in range(count + 1):
+            next(lines, None)
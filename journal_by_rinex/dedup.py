@@ -0,0 +1,62 @@
+import os
+import hashlib
+
+# Bytes hashed from each end of a file by quick_hash(); the first block
+# holds the whole RINEX header of any ordinary observation file
+QUICK_HASH_BLOCK = 64 * 1024
+
+FULL_HASH_CHUNK = 1024 * 1024
+
+
+def quick_hash(path, size):
+    """Hash of the first and last QUICK_HASH_BLOCK bytes of a file of
+    `size` bytes: different for nearly all files that differ, but only
+    equal for identical ones once confirmed by full_hash()."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(QUICK_HASH_BLOCK))
+        if size > QUICK_HASH_BLOCK:
+            f.seek(max(size - QUICK_HASH_BLOCK, QUICK_HASH_BLOCK))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def full_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FULL_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _bucket(paths, key):
+    buckets = {}
+    for path in paths:
+        try:
+            buckets.setdefault(key(path), []).append(path)
+        except OSError:
+            # Unreadable files are never duplicates; processing them
+            # reports the error
+            pass
+    return buckets
+
+
+def content_fingerprints(paths):
+    """{path: fingerprint} for the given files, equal only for files
+    with identical content. Files are compared by size first, then by
+    quick_hash(), and only those still alike are hashed in full, so a
+    batch without duplicates costs little more than a stat per file.
+    Unreadable files are left out."""
+    fingerprints = {}
+    for size, same_size in _bucket(paths, os.path.getsize).items():
+        if len(same_size) == 1:
+            fingerprints[same_size[0]] = f'{size}'
+            continue
+        for quick, same_quick in _bucket(same_size, lambda path: quick_hash(path, size)).items():
+            if len(same_quick) == 1:
+                fingerprints[same_quick[0]] = f'{size}:{quick}'
+                continue
+            for full, same_content in _bucket(same_quick, full_hash).items():
+                for path in same_content:
+                    fingerprints[path] = f'{size}:{quick}:{full}'
+    return fingerprints
@@ -0,0 +1,270 @@
+import io
+import re
+import zipfile
+from functools import lru_cache
+from html import escape
+
+# How the .docx is written: 'native' builds the OOXML package directly
+# from the journal data, 'pandoc' converts the plain .tex with pypandoc
+# (which must then be installed, along with pandoc itself)
+DOCX_WRITERS = ('native', 'pandoc')
+
+# A4 with 2 cm margins, like the LaTeX journal; lengths in twips
+PAGE_WIDTH = 11906
+PAGE_HEIGHT = 16838
+PAGE_MARGIN = 1134
+TEXT_WIDTH = PAGE_WIDTH - 2 * PAGE_MARGIN
+
+EMU_PER_CM = 360000
+TEXT_WIDTH_CM = 17.0
+
+# Characters XML 1.0 doesn't allow at all, escaped or not (control
+# characters other than tab, LF and CR, as RINEX headers sometimes
+# carry): Word refuses to open a document containing any
+_XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+# Every image slot has a fixed relationship id and part name, so the
+# relationships and content types never change from one journal to the
+# next and only document.xml and the media differ
+IMAGE_SLOTS = {
+    'map': 'rIdMap',
+    'antenna_a': 'rIdAntennaA',
+    'antenna_b': 'rIdAntennaB',
+}
+
+NAMESPACES = (
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+    'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"'
+)
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Default Extension="png" ContentType="image/png"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '<Override PartName="/docProps/core.xml" '
+    'ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+    '</Types>'
+)
+
+PACKAGE_RELATIONSHIPS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" '
+    'Target="docProps/core.xml"/>'
+    '</Relationships>'
+)
+
+CORE_PROPERTIES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<cp:coreProperties '
+    'xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+    '<dc:title>Журнал спутниковых наблюдений</dc:title>'
+    '<dc:creator>journal_by_rinex</dc:creator>'
+    '</cp:coreProperties>'
+)
+
+# 10 pt text and the sizes of LaTeX's \section* and \subsection* headings
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:docDefaults>'
+    '<w:rPrDefault><w:rPr>'
+    '<w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman" w:cs="Times New Roman"/>'
+    '<w:sz w:val="20"/><w:szCs w:val="20"/><w:lang w:val="ru-RU"/>'
+    '</w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="0" w:line="240" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+    '</w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/>'
+    '<w:basedOn w:val="Normal"/><w:next w:val="Normal"/>'
+    '<w:pPr><w:keepNext/><w:spacing w:before="240" w:after="120"/><w:outlineLvl w:val="0"/></w:pPr>'
+    '<w:rPr><w:b/><w:sz w:val="29"/><w:szCs w:val="29"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/>'
+    '<w:basedOn w:val="Normal"/><w:next w:val="Normal"/>'
+    '<w:pPr><w:keepNext/><w:spacing w:before="200" w:after="100"/><w:outlineLvl w:val="1"/></w:pPr>'
+    '<w:rPr><w:b/><w:sz w:val="24"/><w:szCs w:val="24"/></w:rPr></w:style>'
+    '<w:style w:type="table" w:default="1" w:styleId="TableNormal"><w:name w:val="Normal Table"/>'
+    '<w:tblPr><w:tblCellMar><w:left w:w="85" w:type="dxa"/><w:right w:w="85" w:type="dxa"/>'
+    '</w:tblCellMar></w:tblPr></w:style>'
+    '<w:style w:type="table" w:styleId="TableGrid"><w:name w:val="Table Grid"/>'
+    '<w:basedOn w:val="TableNormal"/><w:tblPr><w:tblBorders>'
+    + ''.join(f'<w:{side} w:val="single" w:sz="4" w:space="0" w:color="000000"/>'
+              for side in ('top', 'left', 'bottom', 'right', 'insideH', 'insideV')) +
+    '</w:tblBorders></w:tblPr></w:style>'
+    '</w:styles>'
+)
+
+DOCUMENT_RELATIONSHIPS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rIdStyles" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    + ''.join(
+        f'<Relationship Id="{relationship_id}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" '
+        f'Target="media/{slot}.png"/>'
+        for slot, relationship_id in IMAGE_SLOTS.items()
+    ) +
+    '</Relationships>'
+)
+
+
+@lru_cache(maxsize=None)
+def _template_archive():
+    """The parts every journal .docx shares, zipped once per process."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+        archive.writestr('_rels/.rels', PACKAGE_RELATIONSHIPS)
+        archive.writestr('docProps/core.xml', CORE_PROPERTIES)
+        archive.writestr('word/styles.xml', STYLES)
+        archive.writestr('word/_rels/document.xml.rels', DOCUMENT_RELATIONSHIPS)
+    return buffer.getvalue()
+
+
+class Cell:
+    """A table cell: text (or a list of already rendered paragraphs),
+    spanning `span` grid columns, optionally bold and centred. A cell
+    with vmerge='restart' is continued by the cells below it in the same
+    column that have vmerge='continue'."""
+
+    def __init__(self, content='', span=1, bold=False, center=False, vmerge=None):
+        self.content = content
+        self.span = span
+        self.bold = bold
+        self.center = center
+        self.vmerge = vmerge
+
+
+class DocxDocument:
+    """A minimal WordprocessingML document, built up block by block much
+    like a pylatex Document and written with save(). Images go into the
+    fixed IMAGE_SLOTS, so the rest of the package is always the same
+    pre-built template archive."""
+
+    def __init__(self):
+        self.body = []
+        self.images = {}
+
+    @staticmethod
+    def _run(text, bold=False):
+        properties = '<w:rPr><w:b/></w:rPr>' if bold else ''
+        text = escape(_XML_INVALID_CHARS.sub('', str(text)), quote=False)
+        return f'<w:r>{properties}<w:t xml:space="preserve">{text}</w:t></w:r>'
+
+    @staticmethod
+    def _paragraph(runs, style=None, align=None, space_before=None):
+        properties = ''
+        if style is not None:
+            properties += f'<w:pStyle w:val="{style}"/>'
+        if space_before is not None:
+            properties += f'<w:spacing w:before="{space_before}"/>'
+        if align is not None:
+            properties += f'<w:jc w:val="{align}"/>'
+        if properties:
+            properties = f'<w:pPr>{properties}</w:pPr>'
+        return f'<w:p>{properties}{runs}</w:p>'
+
+    def heading(self, text, level=1):
+        self.body.append(self._paragraph(self._run(text), style=f'Heading{level}'))
+
+    def paragraph(self, text, align=None, space_before=None):
+        self.body.append(self._paragraph(self._run(text), align=align, space_before=space_before))
+
+    def image(self, slot, path, width):
+        """A centred paragraph with the PNG file `path` as the `slot`
+        image, `width` times the text width wide."""
+        from PIL import Image
+        self.images[slot] = path
+        with Image.open(path) as image:
+            pixel_width, pixel_height = image.size
+        cx = round(width * TEXT_WIDTH_CM * EMU_PER_CM)
+        cy = round(cx * pixel_height / pixel_width)
+        picture_id = list(IMAGE_SLOTS).index(slot) + 1
+        drawing = (
+            '<w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0">'
+            f'<wp:extent cx="{cx}" cy="{cy}"/>'
+            f'<wp:docPr id="{picture_id}" name="{slot}"/>'
+            '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+            f'<pic:pic><pic:nvPicPr><pic:cNvPr id="{picture_id}" name="{slot}.png"/><pic:cNvPicPr/></pic:nvPicPr>'
+            f'<pic:blipFill><a:blip r:embed="{IMAGE_SLOTS[slot]}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+            f'<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+            '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr></pic:pic>'
+            '</a:graphicData></a:graphic></wp:inline></w:drawing></w:r>'
+        )
+        return self._paragraph(drawing, align='center')
+
+    def table(self, widths, rows):
+        """A bordered table whose columns take the given fractions of the
+        text width; each row is a list of Cells or strings."""
+        grid = [round(width * TEXT_WIDTH) for width in widths]
+        xml = [
+            '<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/>'
+            f'<w:tblW w:w="{sum(grid)}" w:type="dxa"/><w:tblLayout w:type="fixed"/></w:tblPr>'
+            '<w:tblGrid>' + ''.join(f'<w:gridCol w:w="{width}"/>' for width in grid) + '</w:tblGrid>'
+        ]
+        for row in rows:
+            xml.append('<w:tr>')
+            column = 0
+            for cell in row:
+                if not isinstance(cell, Cell):
+                    cell = Cell(cell)
+                properties = f'<w:tcW w:w="{sum(grid[column:column + cell.span])}" w:type="dxa"/>'
+                if cell.span > 1:
+                    properties += f'<w:gridSpan w:val="{cell.span}"/>'
+                if cell.vmerge == 'restart':
+                    properties += '<w:vMerge w:val="restart"/>'
+                elif cell.vmerge == 'continue':
+                    properties += '<w:vMerge/>'
+                if isinstance(cell.content, list):
+                    paragraphs = ''.join(cell.content) or self._paragraph('')
+                else:
+                    paragraphs = self._paragraph(
+                        self._run(cell.content, cell.bold) if cell.content != '' else '',
+                        align='center' if cell.center else None,
+                    )
+                xml.append(f'<w:tc><w:tcPr>{properties}</w:tcPr>{paragraphs}</w:tc>')
+                column += cell.span
+            xml.append('</w:tr>')
+        xml.append('</w:tbl>')
+        self.body.append(''.join(xml))
+        # Word merges tables that directly follow each other
+        self.body.append(self._paragraph(''))
+
+    def dumps(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<w:document {NAMESPACES}><w:body>'
+            + ''.join(self.body) +
+            f'<w:sectPr><w:pgSz w:w="{PAGE_WIDTH}" w:h="{PAGE_HEIGHT}"/>'
+            f'<w:pgMar w:top="{PAGE_MARGIN}" w:right="{PAGE_MARGIN}" w:bottom="{PAGE_MARGIN}" '
+            f'w:left="{PAGE_MARGIN}" w:header="0" w:footer="0" w:gutter="0"/></w:sectPr>'
+            '</w:body></w:document>'
+        )
+
+    def save(self, path):
+        """Write the .docx to `path`: the template archive's parts, this
+        document.xml and the images."""
+        with zipfile.ZipFile(io.BytesIO(_template_archive())) as template, \
+                zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for info in template.infolist():
+                archive.writestr(info, template.read(info))
+            archive.writestr('word/document.xml', self.dumps())
+            for slot, image_path in self.images.items():
+                # PNG data is already compressed
+                archive.write(image_path, f'word/media/{slot}.png', compress_type=zipfile.ZIP_STORED)
@@ -0,0 +1,632 @@
+import os
+import re
+import glob
+import math
+import itertools
+import collections
+from datetime import datetime
+from functools import lru_cache
+from journal_by_rinex.compression import _LineStream, open_rinex, strip_compression_suffix
+from journal_by_rinex.functions import read_rinex_header
+
+# numpy is imported where it's used (see journal_by_rinex.geodesy), so
+# this module only loads it once DOPs are actually computed
+
+# Where a journal's GDOP/PDOP come from: 'form' is the value typed in (or
+# drawn at random, see gdop_random), 'orbits' computes them from the
+# satellites observed in the file and their orbits
+DOP_SOURCES = ('form', 'orbits')
+
+# Observation epochs read (and their DOPs computed) at a time, which
+# bounds the memory used however long the session is
+DOP_CHUNK_EPOCHS = 3600
+
+# Satellites below this elevation (degrees) are left out of the DOPs
+DOP_ELEVATION_MASK = 0.0
+
+# Satellite positions are evaluated on a grid of this spacing (seconds)
+# and interpolated to every epoch with a 4-point Lagrange polynomial,
+# which is accurate to well under a metre for GNSS orbits, so a 1 Hz
+# session costs no more orbit evaluations than a 60 s one
+ORBIT_NODE_SECONDS = 60
+NODE_INTERPOLATION_POINTS = 4
+
+# Points of the Lagrange polynomial interpolating SP3 orbits
+SP3_INTERPOLATION_POINTS = 10
+
+# Broadcast ephemerides are used up to this far (seconds) from their
+# reference time: GPS/Galileo/BeiDou/QZSS/NavIC Keplerian elements, and
+# GLONASS state vectors (integrated numerically, in steps of
+# GLONASS_STEP_SECONDS)
+MAX_KEPLER_AGE = 4 * 3600
+MAX_GLONASS_AGE = 3600
+GLONASS_STEP_SECONDS = 60
+
+GPS_EPOCH = datetime(1980, 1, 6)
+WEEK_SECONDS = 604800
+
+# GPS - UTC, for GLONASS (UTC-based) times when the file doesn't give
+# its LEAP SECONDS; unchanged since 2017
+GPS_UTC_LEAP_SECONDS = 18
+
+# GPS time - BeiDou time
+BDT_OFFSET_SECONDS = 14
+
+# Satellite systems, in the order of their satellite codes: system index
+# * 100 + PRN, e.g. G05 -> 5, R12 -> 112
+SYSTEMS = 'GRECJIS'
+KEPLER_SYSTEMS = 'GECJI'
+
+# (gravitational constant, Earth rotation rate) of each system's
+# broadcast orbits
+KEPLER_CONSTANTS = {
+    'G': (3.986005e14, 7.2921151467e-5),
+    'E': (3.986004418e14, 7.2921151467e-5),
+    'C': (3.986004418e14, 7.292115e-5),
+    'J': (3.986005e14, 7.2921151467e-5),
+    'I': (3.986005e14, 7.2921151467e-5),
+}
+
+# BeiDou geostationary satellites, whose broadcast orbits are given in
+# an inclined frame
+BDS_GEO_PRNS = {1, 2, 3, 4, 5, 59, 60, 61, 62, 63}
+
+# PZ-90 constants of the GLONASS equations of motion
+GLONASS_MU = 398600.4418e9
+GLONASS_AE = 6378136.0
+GLONASS_J2 = 1.08262575e-3
+GLONASS_OMEGA = 7.292115e-5
+
+# RINEX 2 navigation file types (the 21st character of the first
+# header line) and the system their records belong to
+RINEX2_NAV_SYSTEMS = {'N': 'G', 'G': 'R', 'L': 'E', 'E': 'E', 'F': 'C', 'C': 'C', 'Q': 'J', 'J': 'J', 'I': 'I'}
+
+# Last character of the extension of RINEX 2 navigation file names
+# (e.g. site0610.24n, or .24p for mixed systems), and the type code of
+# RINEX 3 long names (e.g. ..._01D_MN.rnx)
+RINEX2_NAV_LETTERS = 'nglpfqiNGLPFQI'
+RINEX3_NAV_RE = re.compile(r'_[A-Z]N\.rnx$', re.IGNORECASE)
+
+# Time systems of observation and SP3 files, as seconds to add to get
+# GPS time (GLONASS time follows UTC)
+TIME_SYSTEM_OFFSETS = {'GPS': 0, 'GAL': 0, 'QZS': 0, 'IRN': 0, 'BDT': BDT_OFFSET_SECONDS, 'TAI': -19}
+UTC_TIME_SYSTEMS = ('GLO', 'UTC')
+
+
+@lru_cache(maxsize=None)
+def _day_seconds(year, month, day):
+    return (datetime(year, month, day) - GPS_EPOCH).total_seconds()
+
+
+def _seconds(year, month, day, hour, minute, second):
+    # Seconds since the GPS epoch, in the time scale the fields are in
+    if year < 100:
+        year += 2000 if year < 80 else 1900
+    return _day_seconds(year, month, day) + hour * 3600 + minute * 60 + second
+
+
+def _time_offset(time_system, leap_seconds):
+    if time_system in UTC_TIME_SYSTEMS:
+        return leap_seconds
+    return TIME_SYSTEM_OFFSETS.get(time_system, 0)
+
+
+def _leap_seconds(header):
+    value = header.get('LEAP SECONDS', '')[:6].strip()
+    return int(value) if value else GPS_UTC_LEAP_SECONDS
+
+
+@lru_cache(maxsize=4096)
+def satellite_code(satellite):
+    """Integer code of a satellite as written in RINEX ('G05', 'R12';
+    RINEX 2's 'G 5' or ' 5' for GPS), or -1 for an unknown system."""
+    system = satellite[:1].upper() if satellite[:1].strip() else 'G'
+    try:
+        return SYSTEMS.index(system) * 100 + int(satellite[1:3])
+    except ValueError:
+        return -1
+
+
+def _nav_float(field):
+    field = field.strip()
+    return float(field.replace('D', 'E').replace('d', 'e')) if field else 0.0
+
+
+def read_navigation(f, header):
+    """Broadcast ephemerides of a RINEX 2/3 navigation file, read from
+    `f` (positioned after the header): (keplerian, glonass) lists of
+    records, see Orbits."""
+    version = header['version']
+    file_type = header['RINEX VERSION / TYPE'][20:21].upper()
+    leap_seconds = _leap_seconds(header)
+    if version >= 3:
+        first_fields, fields, new_record = (23, 42, 61), (4, 23, 42, 61), lambda line: line[:1] != ' '
+    else:
+        first_fields, fields, new_record = (22, 41, 60), (3, 22, 41, 60), lambda line: line[1:2] != ' '
+        default_system = RINEX2_NAV_SYSTEMS.get(file_type)
+
+    keplerian, glonass = [], []
+    record = []
+
+    def finish(record):
+        first = record[0]
+        if version >= 3:
+            system, prn = first[:1], int(first[1:3])
+            year, month, day, hour, minute, second = first[3:23].split()
+        else:
+            system, prn = default_system, int(first[:2])
+            year, month, day, hour, minute, second = first[2:22].split()
+        values = [_nav_float(first[start:start + 19]) for start in first_fields]
+        for line in record[1:]:
+            values += [_nav_float(line[start:start + 19]) for start in fields]
+        toc = _seconds(int(year), int(month), int(day), int(hour), int(minute), float(second))
+        code = satellite_code(f'{system}{prn:02d}')
+        if system in KEPLER_SYSTEMS and len(values) >= 20:
+            keplerian.append((code, toc, *values[3:20]))
+        elif system == 'R' and len(values) >= 14:
+            glonass.append((code, toc + leap_seconds, *values[3:6], *values[7:10], *values[11:14]))
+
+    for line in iter(f.readline, b''):
+        line = line.decode('latin-1').rstrip('\r\n')
+        if not line.strip():
+            continue
+        if new_record(line) and record:
+            finish(record)
+            record = []
+        record.append(line)
+    if record:
+        finish(record)
+    return keplerian, glonass
+
+
+def read_sp3(f, first_line):
+    """Precise orbits of an SP3 file: (times, satellite codes, positions)
+    with times in GPS seconds and positions as {(time, code): (x, y, z)}
+    in metres."""
+    time_system = 'GPS'
+    times, positions = [], {}
+    time = None
+    for line in itertools.chain([first_line], iter(f.readline, b'')):
+        line = line.decode('latin-1').rstrip('\r\n')
+        if line.startswith('%c') and time_system == 'GPS' and line[9:12].strip() not in ('', 'ccc'):
+            time_system = line[9:12].strip()
+        elif line.startswith('*'):
+            year, month, day, hour, minute, second = line[1:].split()[:6]
+            time = _seconds(int(year), int(month), int(day), int(hour), int(minute), float(second))
+            time += _time_offset(time_system, GPS_UTC_LEAP_SECONDS)
+            times.append(time)
+        elif line.startswith('P') and time is not None:
+            code = satellite_code(line[1:4])
+            xyz = [float(value) for value in line[4:46].split()[:3]]
+            # Missing positions are written as zeros
+            if code >= 0 and any(xyz):
+                positions[time, code] = tuple(value * 1000 for value in xyz)
+    return times, positions
+
+
+@lru_cache(maxsize=8)
+def _load_orbits(signature):
+    keplerian, glonass, precise = [], [], []
+    for path, _, _ in signature:
+        with open_rinex(path) as f:
+            first_line = f.readline()
+            if first_line.startswith(b'#'):
+                precise.append(read_sp3(f, first_line))
+                continue
+            stream = _LineStream(itertools.chain([first_line], iter(f.readline, b'')))
+            header, _ = read_rinex_header(stream)
+            file_type = header['RINEX VERSION / TYPE'][20:21].upper()
+            if header['version'] >= 3 and file_type != 'N' or header['version'] < 3 and file_type not in RINEX2_NAV_SYSTEMS:
+                raise ValueError(f'Not a navigation or SP3 file: {path}')
+            records = read_navigation(stream, header)
+        keplerian += records[0]
+        glonass += records[1]
+    return Orbits(keplerian, glonass, precise)
+
+
+def load_orbits(paths):
+    """Orbits of a list of navigation and SP3 files, read once per
+    process for as long as the files don't change."""
+    signature = []
+    for path in sorted(set(os.path.abspath(path) for path in paths)):
+        stat = os.stat(path)
+        signature.append((path, stat.st_size, stat.st_mtime_ns))
+    return _load_orbits(tuple(signature))
+
+
+def orbit_signature(paths):
+    """(path, size, modification time) of each orbit file, for the build
+    manifest."""
+    return [
+        (os.path.abspath(path).replace(os.sep, '/'), os.stat(path).st_size, os.stat(path).st_mtime_ns)
+        for path in sorted(paths)
+    ]
+
+
+def find_orbit_files(rinex_file, orbit_files=()):
+    """The orbit files for a RINEX observation file: the navigation files
+    next to it with the matching name (site0610.24n/.24g/... for
+    site0610.24o, or SITE..._01D_MN.rnx and the like for a RINEX 3 long
+    name), plus every file matching the `orbit_files` paths or glob
+    patterns (e.g. daily broadcast or SP3 files)."""
+    found = set()
+    for pattern in orbit_files:
+        found.update(path for path in glob.glob(os.path.expanduser(str(pattern))) if os.path.isfile(path))
+    directory, name = os.path.split(os.path.abspath(rinex_file))
+    root, ext = os.path.splitext(strip_compression_suffix(name))
+    if len(ext) == 4 and ext[1:3].isdigit():
+        pattern = glob.escape(os.path.join(directory, root + ext[:3])) + f'[{RINEX2_NAV_LETTERS}]*'
+        found.update(
+            path for path in glob.glob(pattern)
+            if os.path.splitext(strip_compression_suffix(path))[1][3:] in RINEX2_NAV_LETTERS
+        )
+    elif root.count('_') >= 3:
+        prefix = '_'.join(root.split('_')[:3])
+        found.update(
+            path for path in glob.glob(glob.escape(os.path.join(directory, prefix)) + '_*')
+            if RINEX3_NAV_RE.search(strip_compression_suffix(path))
+        )
+    return sorted(found)
+
+
+def _lagrange_weights(s, points):
+    # Weights of `points` nodes at 0, 1, ... for positions s (in node
+    # spacings from the first node)
+    import numpy as np
+    weights = np.ones((len(s), points))
+    for j in range(points):
+        for m in range(points):
+            if m != j:
+                weights[:, j] *= (s - m) / (j - m)
+    return weights
+
+
+def _nearest_records(record_codes, record_times, codes, times, max_age):
+    """Index of the record of the same satellite nearest in time to each
+    (code, time), and whether it is within max_age. record_codes and
+    record_times must be sorted by code, then time."""
+    import numpy as np
+    if not len(record_codes):
+        return np.zeros(len(codes), dtype=int), np.zeros(len(codes), dtype=bool)
+    # One sorted key per record; satellite codes stay apart by far more
+    # than any time span
+    origin = record_times.min()
+    scale = 1e10
+    keys = record_codes * scale + (record_times - origin)
+    position = np.searchsorted(keys, codes * scale + (times - origin))
+    before = np.clip(position - 1, 0, len(keys) - 1)
+    after = np.clip(position, 0, len(keys) - 1)
+    age_before = np.where(record_codes[before] == codes, np.abs(times - record_times[before]), np.inf)
+    age_after = np.where(record_codes[after] == codes, np.abs(times - record_times[after]), np.inf)
+    nearest = np.where(age_after < age_before, after, before)
+    return nearest, np.minimum(age_before, age_after) <= max_age
+
+
+class Orbits:
+    """Satellite positions from broadcast ephemerides and/or SP3 precise
+    orbits (which take precedence where they cover a satellite).
+
+    `keplerian` records are (code, time of clock, IODE, Crs, delta n, M0,
+    Cuc, e, Cus, sqrt(A), toe, Cic, OMEGA0, Cis, i0, Crc, omega,
+    OMEGA DOT, IDOT) as in the navigation file, times in seconds since
+    the GPS epoch in the system's own time scale; `glonass` records are
+    (code, reference time in GPS time, x, vx, ax, y, vy, ay, z, vz, az)
+    in km, km/s and km/s^2; `precise` is a list of read_sp3() results."""
+
+    def __init__(self, keplerian, glonass, precise):
+        import numpy as np
+        self.keplerian = self._table(keplerian, 19)
+        if len(self.keplerian):
+            codes = self.keplerian[:, 0]
+            toc = self.keplerian[:, 1]
+            toe_sow = self.keplerian[:, 10]
+            # Absolute toe from the week of the time of clock, which is
+            # at most half a week away from it
+            toe = toc - np.mod(toc, WEEK_SECONDS) + toe_sow
+            toe += np.where(toe - toc > WEEK_SECONDS / 2, -WEEK_SECONDS, 0)
+            toe += np.where(toc - toe > WEEK_SECONDS / 2, WEEK_SECONDS, 0)
+            # BeiDou times are BDT; everything else here is GPS time
+            self.keplerian_time = toe + np.where(codes // 100 == SYSTEMS.index('C'), BDT_OFFSET_SECONDS, 0)
+        else:
+            self.keplerian_time = np.zeros(0)
+        self.glonass = self._table(glonass, 11)
+        self.glonass_time = self.glonass[:, 1] if len(self.glonass) else np.zeros(0)
+        self.precise = self._precise_grid(precise)
+
+    @staticmethod
+    def _table(records, columns):
+        # Records sorted by satellite code, then reference time
+        import numpy as np
+        if not records:
+            return np.zeros((0, columns))
+        table = np.array(records, dtype=float)
+        return table[np.lexsort((table[:, 1], table[:, 0]))]
+
+    @staticmethod
+    def _precise_grid(precise):
+        # (first time, interval, {code: column}, positions[epoch, column])
+        # of every SP3 file merged onto one time grid
+        import numpy as np
+        times = sorted({time for file_times, _ in precise for time in file_times})
+        if len(times) < SP3_INTERPOLATION_POINTS:
+            return None
+        steps = np.diff(times)
+        interval = float(np.min(steps))
+        if not np.allclose(np.mod(steps, interval), 0):
+            raise ValueError('SP3 files with different epoch intervals cannot be combined')
+        codes = sorted({code for _, positions in precise for _, code in positions})
+        columns = {code: column for column, code in enumerate(codes)}
+        grid = np.full((round((times[-1] - times[0]) / interval) + 1, len(codes), 3), np.nan)
+        for _, positions in precise:
+            for (time, code), xyz in positions.items():
+                grid[round((time - times[0]) / interval), columns[code]] = xyz
+        return times[0], interval, columns, grid
+
+    def positions(self, codes, times):
+        """ECEF positions (metres) of satellites `codes` at GPS `times`
+        (arrays of the same length); NaN where no orbit covers them."""
+        import numpy as np
+        codes = np.asarray(codes, dtype=float)
+        times = np.asarray(times, dtype=float)
+        result = np.full((len(codes), 3), np.nan)
+
+        index, valid = _nearest_records(self.keplerian[:, 0], self.keplerian_time, codes, times, MAX_KEPLER_AGE)
+        if valid.any():
+            result[valid] = self._keplerian_positions(index[valid], times[valid])
+        index, valid = _nearest_records(self.glonass[:, 0], self.glonass_time, codes, times, MAX_GLONASS_AGE)
+        if valid.any():
+            result[valid] = self._glonass_positions(index[valid], times[valid])
+        if self.precise is not None:
+            precise = self._precise_positions(codes, times)
+            known = np.isfinite(precise[:, 0])
+            result[known] = precise[known]
+        return result
+
+    def _keplerian_positions(self, index, times):
+        # IS-GPS-200 user algorithm (also used by Galileo, BeiDou, QZSS
+        # and NavIC), evaluated for all satellites and times at once
+        import numpy as np
+        (codes, _, _, crs, delta_n, m0, cuc, e, cus, sqrt_a, toe_sow, cic, omega0, cis, i0, crc,
+         omega, omega_dot, idot) = self.keplerian[index].T
+        systems = (codes // 100).astype(int)
+        mu = np.array([KEPLER_CONSTANTS.get(SYSTEMS[s], KEPLER_CONSTANTS['G'])[0] for s in range(len(SYSTEMS))])[systems]
+        earth_rate = np.array([KEPLER_CONSTANTS.get(SYSTEMS[s], KEPLER_CONSTANTS['G'])[1] for s in range(len(SYSTEMS))])[systems]
+        tk = times - self.keplerian_time[index]
+
+        a = sqrt_a ** 2
+        mean_anomaly = m0 + (np.sqrt(mu / a ** 3) + delta_n) * tk
+        eccentric_anomaly = mean_anomaly
+        for _ in range(10):
+            eccentric_anomaly = mean_anomaly + e * np.sin(eccentric_anomaly)
+        true_anomaly = np.arctan2(np.sqrt(1 - e ** 2) * np.sin(eccentric_anomaly), np.cos(eccentric_anomaly) - e)
+        phi = true_anomaly + omega
+        sin2, cos2 = np.sin(2 * phi), np.cos(2 * phi)
+        u = phi + cus * sin2 + cuc * cos2
+        r = a * (1 - e * np.cos(eccentric_anomaly)) + crs * sin2 + crc * cos2
+        inclination = i0 + idot * tk + cis * sin2 + cic * cos2
+        x_orbit, y_orbit = r * np.cos(u), r * np.sin(u)
+
+        geo = (systems == SYSTEMS.index('C')) & np.isin(codes % 100, list(BDS_GEO_PRNS))
+        node = omega0 + (omega_dot - np.where(geo, 0, earth_rate)) * tk - earth_rate * toe_sow
+        x = x_orbit * np.cos(node) - y_orbit * np.cos(inclination) * np.sin(node)
+        y = x_orbit * np.sin(node) + y_orbit * np.cos(inclination) * np.cos(node)
+        z = y_orbit * np.sin(inclination)
+        if geo.any():
+            # BeiDou GEO orbits are given in a frame inclined by -5
+            # degrees, rotating with the Earth from toe
+            tilt = math.radians(-5)
+            rotation = earth_rate[geo] * tk[geo]
+            y_tilted = y[geo] * math.cos(tilt) + z[geo] * math.sin(tilt)
+            z[geo] = -y[geo] * math.sin(tilt) + z[geo] * math.cos(tilt)
+            x_geo = x[geo]
+            x[geo] = x_geo * np.cos(rotation) + y_tilted * np.sin(rotation)
+            y[geo] = -x_geo * np.sin(rotation) + y_tilted * np.cos(rotation)
+        return np.column_stack((x, y, z))
+
+    def _glonass_positions(self, index, times):
+        # GLONASS ICD: the broadcast state vector integrated with 4th
+        # order Runge-Kutta under the PZ-90 equations of motion, all
+        # satellites at once with one step count
+        import numpy as np
+        records = self.glonass[index]
+        position = records[:, [2, 5, 8]] * 1000
+        velocity = records[:, [3, 6, 9]] * 1000
+        acceleration = records[:, [4, 7, 10]] * 1000
+        dt = times - records[:, 1]
+        steps = max(int(np.ceil(np.max(np.abs(dt)) / GLONASS_STEP_SECONDS)), 1)
+        h = (dt / steps)[:, None]
+
+        def derivatives(position, velocity):
+            x, y, z = position.T
+            vx, vy = velocity[:, 0], velocity[:, 1]
+            r2 = np.sum(position ** 2, axis=1)
+            r = np.sqrt(r2)
+            gravity = -GLONASS_MU / r ** 3
+            oblateness = -1.5 * GLONASS_J2 * GLONASS_MU * GLONASS_AE ** 2 / r ** 5
+            zz = 5 * z ** 2 / r2
+            ax = gravity * x + oblateness * x * (1 - zz) + GLONASS_OMEGA ** 2 * x + 2 * GLONASS_OMEGA * vy
+            ay = gravity * y + oblateness * y * (1 - zz) + GLONASS_OMEGA ** 2 * y - 2 * GLONASS_OMEGA * vx
+            az = gravity * z + oblateness * z * (3 - zz)
+            return velocity, np.column_stack((ax, ay, az)) + acceleration
+
+        for _ in range(steps):
+            k1p, k1v = derivatives(position, velocity)
+            k2p, k2v = derivatives(position + h / 2 * k1p, velocity + h / 2 * k1v)
+            k3p, k3v = derivatives(position + h / 2 * k2p, velocity + h / 2 * k2v)
+            k4p, k4v = derivatives(position + h * k3p, velocity + h * k3v)
+            position = position + h / 6 * (k1p + 2 * k2p + 2 * k3p + k4p)
+            velocity = velocity + h / 6 * (k1v + 2 * k2v + 2 * k3v + k4v)
+        return position
+
+    def _precise_positions(self, codes, times):
+        import numpy as np
+        first_time, interval, columns, grid = self.precise
+        result = np.full((len(codes), 3), np.nan)
+        column = np.array([columns.get(int(code), -1) for code in codes], dtype=int)
+        offset = (times - first_time) / interval
+        usable = (column >= 0) & (offset >= 0) & (offset <= len(grid) - 1)
+        if not usable.any():
+            return result
+        points = SP3_INTERPOLATION_POINTS
+        start = np.clip(np.floor(offset[usable]).astype(int) - (points // 2 - 1), 0, len(grid) - points)
+        weights = _lagrange_weights(offset[usable] - start, points)
+        nodes = grid[start[:, None] + np.arange(points), column[usable][:, None]]
+        result[usable] = np.einsum('np,npk->nk', weights, nodes)
+        return result
+
+
+def observed_satellites(f, header, chunk_epochs=DOP_CHUNK_EPOCHS):
+    """The satellites observed at each epoch of a RINEX 2/3 observation
+    file, read from `f` (positioned after the header), in chunks of up
+    to chunk_epochs epochs: (times, epochs, codes) with the epoch times
+    in GPS seconds, and for every observation record its epoch's index
+    into times and its satellite code (arrays). Event records (flags 2-5)
+    and cycle slip records (flag 6) are skipped."""
+    version = header['version']
+    time_system = header.get('TIME OF FIRST OBS', '')[48:51].strip() or 'GPS'
+    offset = _time_offset(time_system, _leap_seconds(header))
+    # Iterating the file rather than calling readline() for each of the
+    # millions of lines of a long session is a good deal faster
+    lines = iter(f)
+    if version < 3:
+        types = int(header.get('# / TYPES OF OBSERV', '0')[:6] or 0)
+        lines_per_satellite = max(math.ceil(types / 5), 1)
+
+    times, epochs, satellites = [], [], []
+    for line in lines:
+        if version >= 3:
+            if line[:1] != b'>':
+                continue
+            flag, count = line[31:32], int(line[32:35] or 0)
+            if flag not in (b'0', b'1'):
+                collections.deque(itertools.islice(lines, count), maxlen=0)
+                continue
+            listed = [record[:3] for record in itertools.islice(lines, count)]
+            fields = line[1:29].split()
+        else:
+            flag, count = line[28:29], int(line[29:32] or 0)
+            if flag in (b'2', b'3', b'4', b'5'):
+                collections.deque(itertools.islice(lines, count), maxlen=0)
+                continue
+            listed = line[32:68].rstrip(b'\r\n')
+            for _ in range((count - 1) // 12):
+                listed += next(lines, b'')[32:68].rstrip(b'\r\n')
+            collections.deque(itertools.islice(lines, count * lines_per_satellite), maxlen=0)
+            if flag == b'6' or not line[:26].strip():
+                continue
+            listed = [listed[start:start + 3] for start in range(0, 3 * count, 3)]
+            fields = line[:26].split()
+        if flag == b'6':
+            continue
+        year, month, day, hour, minute = (int(field) for field in fields[:5])
+        epoch = len(times)
+        times.append(_seconds(year, month, day, hour, minute, float(fields[5])) + offset)
+        satellites += listed
+        epochs += [epoch] * len(listed)
+        if len(times) == chunk_epochs:
+            yield _observation_chunk(times, epochs, satellites)
+            times, epochs, satellites = [], [], []
+    if times:
+        yield _observation_chunk(times, epochs, satellites)
+
+
+def _observation_chunk(times, epochs, satellites):
+    # The satellites' codes are looked up once per distinct satellite of
+    # the chunk, not once per record
+    import numpy as np
+    distinct, inverse = np.unique(np.array(satellites, dtype='S3'), return_inverse=True)
+    codes = np.array([satellite_code(satellite.decode('latin-1')) for satellite in distinct], dtype=int)
+    return np.array(times), np.array(epochs, dtype=int), codes[inverse].reshape(-1)
+
+
+def _satellite_nodes(orbits, codes, times):
+    # Positions of satellites `codes` (unique) on the node grid covering
+    # `times`: (first node time, positions[satellite, node])
+    import numpy as np
+    first = math.floor(min(times) / ORBIT_NODE_SECONDS) * ORBIT_NODE_SECONDS - ORBIT_NODE_SECONDS
+    count = math.ceil((max(times) - first) / ORBIT_NODE_SECONDS) + NODE_INTERPOLATION_POINTS
+    node_times = first + ORBIT_NODE_SECONDS * np.arange(count)
+    positions = orbits.positions(np.repeat(codes, count), np.tile(node_times, len(codes)))
+    return first, positions.reshape(len(codes), count, 3)
+
+
+def epoch_dops(orbits, receiver, times, epochs, codes):
+    """(GDOP, PDOP) of each epoch of one observed_satellites() chunk,
+    from the satellites observed above DOP_ELEVATION_MASK with one
+    receiver clock for all systems; NaN for epochs with fewer than 4
+    satellites with known orbits."""
+    import numpy as np
+    times = np.asarray(times, dtype=float)
+    epochs = np.asarray(epochs, dtype=int)
+    codes = np.asarray(codes, dtype=int)
+    known = codes >= 0
+    epochs, codes = epochs[known], codes[known]
+
+    satellites, satellite_index = np.unique(codes, return_inverse=True)
+    first_node, nodes = _satellite_nodes(orbits, satellites, times)
+    offset = (times[epochs] - first_node) / ORBIT_NODE_SECONDS
+    start = np.floor(offset).astype(int) - (NODE_INTERPOLATION_POINTS // 2 - 1)
+    weights = _lagrange_weights(offset - start, NODE_INTERPOLATION_POINTS)
+    positions = np.einsum(
+        'np,npk->nk', weights,
+        nodes[satellite_index[:, None], start[:, None] + np.arange(NODE_INTERPOLATION_POINTS)])
+
+    line_of_sight = positions - np.asarray(receiver, dtype=float)
+    line_of_sight /= np.linalg.norm(line_of_sight, axis=1)[:, None]
+    up = np.asarray(receiver, dtype=float) / np.linalg.norm(receiver)
+    used = np.isfinite(line_of_sight[:, 0]) & (line_of_sight @ up > math.sin(math.radians(DOP_ELEVATION_MASK)))
+    design = np.column_stack((-line_of_sight[used], np.ones(used.sum())))
+    epochs = epochs[used]
+
+    # Normal matrices of all epochs at once, one bincount per element
+    normal = np.zeros((len(times), 4, 4))
+    for i in range(4):
+        for j in range(i, 4):
+            normal[:, i, j] = normal[:, j, i] = np.bincount(
+                epochs, weights=design[:, i] * design[:, j], minlength=len(times))
+    solvable = np.bincount(epochs, minlength=len(times)) >= 4
+    solvable &= np.abs(np.linalg.det(normal)) > 1e-9
+    gdop = np.full(len(times), np.nan)
+    pdop = np.full(len(times), np.nan)
+    cofactor = np.linalg.inv(normal[solvable])
+    diagonal = np.diagonal(cofactor, axis1=1, axis2=2)
+    gdop[solvable] = np.sqrt(diagonal.sum(axis=1))
+    pdop[solvable] = np.sqrt(diagonal[:, :3].sum(axis=1))
+    return gdop, pdop
+
+
+def session_dop(rinex_file, orbits, chunk_epochs=DOP_CHUNK_EPOCHS):
+    """GDOP and PDOP of a RINEX observation session from `orbits`: their
+    mean and maximum over every epoch, as {'gdop_mean', 'gdop_max',
+    'pdop_mean', 'pdop_max', 'epochs', 'epochs_used'}. Raises ValueError
+    if no epoch had 4 satellites with known orbits."""
+    import numpy as np
+    totals = {'gdop': 0.0, 'pdop': 0.0}
+    maxima = {'gdop': 0.0, 'pdop': 0.0}
+    epoch_count = used_count = 0
+    with open_rinex(rinex_file) as f:
+        header, _ = read_rinex_header(f)
+        receiver = [float(value) for value in header.get('APPROX POSITION XYZ', '').split()[:3]]
+        if len(receiver) != 3 or not any(receiver):
+            raise ValueError(f'No APPROX POSITION XYZ to compute DOPs from: {rinex_file}')
+        for times, epochs, codes in observed_satellites(f, header, chunk_epochs):
+            epoch_count += len(times)
+            dops = dict(zip(('gdop', 'pdop'), epoch_dops(orbits, receiver, times, epochs, codes)))
+            solved = np.isfinite(dops['gdop'])
+            used_count += int(solved.sum())
+            for name, values in dops.items():
+                if solved.any():
+                    totals[name] += float(values[solved].sum())
+                    maxima[name] = max(maxima[name], float(values[solved].max()))
+    if not used_count:
+        raise ValueError(f'No epochs with 4 or more satellites covered by the orbit files: {rinex_file}')
+    return {
+        'gdop_mean': totals['gdop'] / used_count, 'gdop_max': maxima['gdop'],
+        'pdop_mean': totals['pdop'] / used_count, 'pdop_max': maxima['pdop'],
+        'epochs': epoch_count, 'epochs_used': used_count,
+    }
+
+
+def format_dop(mean, maximum):
+    """The journal's GDOP/PDOP value: the session mean and maximum."""
+    return f'{mean:.2f}/{maximum:.2f}'
@@ -0,0 +1,56 @@
+import tkinter as tk
+
+# Rows scrolled per mouse wheel notch
+WHEEL_ROWS = 3
+
+
+class VirtualFileList(tk.Frame):
+    """Read-only, scrollable list of file paths that only ever draws the
+    rows in view, so showing (and updating) a list of tens of thousands
+    of files costs the same as a handful. The list passed to set_items()
+    is kept by reference: after changing it in place, refresh() redraws.
+    """
+
+    def __init__(self, master, height=5, width=50):
+        super().__init__(master)
+        self.rows = height
+        self.items = []
+        self.first = 0
+        self.text = tk.Text(self, height=height, width=width, wrap='none', state='disabled')
+        self.scrollbar = tk.Scrollbar(self, orient='vertical', command=self._on_scroll)
+        self.text.grid(row=0, column=0, sticky='nsew')
+        self.scrollbar.grid(row=0, column=1, sticky='ns')
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.text.bind(sequence, self._on_wheel)
+
+    def set_items(self, items):
+        self.items = items
+        self.refresh()
+
+    def refresh(self):
+        count = len(self.items)
+        self.first = max(0, min(self.first, count - self.rows))
+        self.text.config(state='normal')
+        self.text.delete('1.0', tk.END)
+        self.text.insert('1.0', '\n'.join(self.items[self.first:self.first + self.rows]))
+        self.text.config(state='disabled')
+        if count > self.rows:
+            self.scrollbar.set(self.first / count, (self.first + self.rows) / count)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _on_scroll(self, action, amount, unit=None):
+        # Scrollbar commands: ('moveto', fraction) when dragged, or
+        # ('scroll', n, 'units' | 'pages') for its arrows and trough
+        if action == 'moveto':
+            self.first = int(float(amount) * len(self.items))
+        elif action == 'scroll':
+            self.first += int(amount) * (self.rows if unit == 'pages' else 1)
+        self.refresh()
+
+    def _on_wheel(self, event):
+        # <MouseWheel> on Windows/macOS, buttons 4/5 on X11
+        up = event.num == 4 or getattr(event, 'delta', 0) > 0
+        self.first += -WHEEL_ROWS if up else WHEEL_ROWS
+        self.refresh()
+        return 'break'
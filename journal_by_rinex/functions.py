@@ -1,19 +1,21 @@
 import os
 import re
-import pikepdf
-import georinex as gr
-import pyproj
+import threading
 from datetime import datetime as dt
-from pylatex import Document, Section, Table, Tabularx, LongTable, NoEscape,\
-    Package, Command, MultiColumn, MiniPage, MultiRow, Section, Subsection
-from pylatex.utils import escape_latex
-import numpy as np
-import geopandas as gpd
-import contextily as ctx
-from shapely.geometry import Point
-import matplotlib.pyplot as plt
-import cartopy.io.img_tiles as cimgt
-from cartopy import crs as ccrs
+from journal_by_rinex.compression import open_rinex
+from journal_by_rinex.sessionstats import DEFAULT_GAP_INTERVALS, scan_session
+from journal_by_rinex.geodesy import geodetic_from_ecef, map_sheet_nomenclature
+from journal_by_rinex.tiles import MissingTileCounter, tile_imagery, tile_source
+from journal_by_rinex.mapcache import map_key
+from journal_by_rinex.maprender import DEFAULT_MAP_WIDTH_PX, render_map
+from journal_by_rinex.docxwriter import Cell, DocxDocument
+from journal_by_rinex.pdftemplate import slot_graphics
+from journal_by_rinex.trace import span, traced
+
+# pylatex, pikepdf, matplotlib and cartopy take about a second to import,
+# so they're only imported by the functions that use them: importing this
+# module (to start the GUI, a CLI run or a worker process) stays fast.
+# benchmarks/bench_import.py checks that it does
 
 # RINEX 2 epoch lines don't have a unique leading marker character like
 # RINEX 3's '>', so they're matched by their fixed date/time/flag shape:
@@ -22,6 +24,15 @@ RINEX2_EPOCH_RE = re.compile(
     r'^\s*(\d{1,2})\s+(\d{1,2})\s+(\d{1,2})\s+(\d{1,2})\s+(\d{1,2})\s+(\d{1,2}(?:\.\d+)?)\s+(\d)'
 )
 
+# get_info() epoch scan modes: 'bounds' reads only the first epoch after
+# the header and the last one (searching backwards from the end of the
+# file), 'full' reads every epoch record of the file, which also gives
+# the session statistics (see journal_by_rinex.sessionstats)
+EPOCH_SCAN_MODES = ('bounds', 'full')
+
+# Block size for reading a RINEX file backwards in search of its last epoch
+LAST_EPOCH_BLOCK_SIZE = 64 * 1024
+
 # hyperref strips underscores from PDF form field names, so this is
 # written without any to begin with, avoiding any ambiguity about what
 # the compiled PDF's actual field name ends up being
@@ -31,92 +42,193 @@ ANTENNA_HEIGHT_RADIO_FIELD = 'antennaheighttype'
 # that build the "A" (no tripod) and "B" (tripod) choice widgets below
 ANTENNA_HEIGHT_RADIO_VALUES = ['base', 'phase', 'tripod_slant', 'tripod_base', 'tripod_phase']
 
+# Location map tile zoom level and half-size (degrees of longitude,
+# latitude) around the station
+MAP_ZOOM = 15
+MAP_EXTENT = (0.01, 0.005)
+
+# Part of every rendered map's cache key (see journal_by_rinex.mapcache):
+# bump it whenever get_map() or render_map() starts drawing differently,
+# so maps cached by older versions are no longer reused
+MAP_STYLE_VERSION = 1
+
+_PYPLOT_LOCK = threading.Lock()
+
 
 def _rinex2_year(two_digit_year):
     year = int(two_digit_year)
     return 2000 + year if year < 80 else 1900 + year
 
-def get_info(rinex_file):
+def _epoch_time(line, rinex_version):
+    """Timestamp of a RINEX observation epoch record, or None if `line`
+    isn't one. Raises ValueError if it is one but its date/time fields
+    don't form a valid timestamp."""
+    if rinex_version >= 3:
+        if not line or line[0] != '>':
+            return None
+        tokens = line.split()[1:]
+        if len(tokens) < 6:
+            # Auxiliary header-info epoch record (event flag 2-5),
+            # e.g. "> ... 4  1" with no timestamp - not a real
+            # observation epoch, skip quietly
+            return None
+        year, month, day, hour, minute, second = tokens[:6]
+    else:
+        match = RINEX2_EPOCH_RE.match(line)
+        if not match:
+            return None
+        year, month, day, hour, minute, second = match.groups()[:6]
+        year = str(_rinex2_year(year))
 
-    header = gr.rinexheader(rinex_file)
+    return dt.strptime(f'{year}-{month}-{day} {hour}:{minute}:{second.split('.')[0]}', '%Y-%m-%d %H:%M:%S')
 
-    info = {}
-    info['marker name'] = header['MARKER NAME'].strip()
-    x, y, z = map(float, header['APPROX POSITION XYZ'].split())
-    info['longitude'], info['latitude'], info['height'] = pyproj.Transformer.from_crs(
-        pyproj.CRS.from_proj4('+proj=cart'),
-        pyproj.CRS.from_proj4('+proj=longlat +ellps=WGS84'),
-    ).transform(x, y, z)
-    rec_type_vers = header['REC # / TYPE / VERS'].strip()
-    info['receiver number'] = rec_type_vers[:20].strip()
-    info['receiver type'] = rec_type_vers[20:40].strip()
-    ant_type = header['ANT # / TYPE'].strip()
-    info['antenna number'] = ant_type[:20].strip()
-    info['antenna type'] = ant_type[20:40].strip()
-    info['antenna height'], _, _ = map(float, header['ANTENNA: DELTA H/E/N'].split())
 
-    rinex_version = float(header.get('version', 3))
+def read_rinex_header(f):
+    """Parse the header of a RINEX 2.x/3.x observation file opened with
+    open_rinex(), leaving `f` positioned right after END OF HEADER so the
+    epoch scan can carry on from there without reopening the file.
 
-    times = []
+    Returns (header, line_count). Like georinex's rinexheader(), header
+    maps each label (e.g. 'MARKER NAME') to its 60-column value, with the
+    values of repeated labels concatenated, plus the format 'version'.
+    """
+    header = {}
     count = 0
-    with open(rinex_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            count += 1
-            if rinex_version >= 3:
-                if not line or line[0] != '>':
-                    continue
-                tokens = line.split()[1:]
-                if len(tokens) < 6:
-                    # Auxiliary header-info epoch record (event flag 2-5),
-                    # e.g. "> ... 4  1" with no timestamp - not a real
-                    # observation epoch, skip quietly
-                    continue
-                year, month, day, hour, minute, second = tokens[:6]
-            else:
-                match = RINEX2_EPOCH_RE.match(line)
-                if not match:
-                    continue
-                year, month, day, hour, minute, second = match.groups()[:6]
-                year = str(_rinex2_year(year))
-
+    for line in iter(f.readline, b''):
+        count += 1
+        line = line.decode('latin-1').rstrip('\r\n')
+        label = line[60:].strip()
+        if label == 'END OF HEADER':
+            break
+        value = line[:60]
+        if count == 1:
+            if label != 'RINEX VERSION / TYPE':
+                raise ValueError('Not a RINEX file: first line must be RINEX VERSION / TYPE')
+            header['version'] = float(value[:9])
+        header[label] = header[label] + value if label in header else value
+    else:
+        raise ValueError('No END OF HEADER line found in RINEX file')
+    return header, count
+
+
+def _header_value(header, label, rinex_file):
+    if label not in header:
+        raise ValueError(f'{label} missing from RINEX header: {rinex_file}')
+    return header[label]
+
+
+def _first_epoch_time(f, rinex_version, line_number):
+    """Read epoch records forward from the current position of binary
+    file `f` (whose next line is `line_number`) up to the first valid
+    timestamp, or None if there is none."""
+    for count, line in enumerate(iter(f.readline, b''), start=line_number):
+        try:
+            epoch = _epoch_time(line.decode('latin-1'), rinex_version)
+        except ValueError:
+            print(f'Warning! Invalid time format in RINEX file, line {count}')
+            continue
+        if epoch is not None:
+            return epoch
+    return None
+
+
+def _last_epoch_time(f, rinex_version, data_offset, block_size=LAST_EPOCH_BLOCK_SIZE):
+    """Find the last valid epoch timestamp of binary file `f` by reading
+    it backwards in blocks, without going before `data_offset` (the end
+    of the header). Memory use is bounded by the block size, however
+    large the file is."""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    tail = b''
+    while position > data_offset:
+        read_size = min(block_size, position - data_offset)
+        position -= read_size
+        f.seek(position)
+        lines = (f.read(read_size) + tail).split(b'\n')
+        if position > data_offset:
+            # The first line may have started in the previous block; keep
+            # it to be completed by the next read
+            tail = lines.pop(0)
+        for line in reversed(lines):
             try:
-                times.append(
-                    dt.strptime(f'{year}-{month}-{day} {hour}:{minute}:{second.split('.')[0]}', '%Y-%m-%d %H:%M:%S'))
+                epoch = _epoch_time(line.decode('latin-1'), rinex_version)
             except ValueError:
-                print(f'Warning! Invalid time format in RINEX file, line {count}')
+                print('Warning! Invalid time format in RINEX file, near the end of the file')
                 continue
+            if epoch is not None:
+                return epoch
+    return None
+
+
+def get_info(rinex_file, epoch_scan='bounds', gap_intervals=DEFAULT_GAP_INTERVALS):
+
+    if epoch_scan not in EPOCH_SCAN_MODES:
+        raise ValueError(f'Unknown epoch scan mode {epoch_scan!r}')
+
+    with open_rinex(rinex_file) as f:
+        # Header and epochs are read in a single pass over the same
+        # open file (or decompressed stream)
+        with span('rinex.header'):
+            header, header_lines = read_rinex_header(f)
+        rinex_version = header['version']
+        statistics = {}
+        if epoch_scan == 'full' or not f.seekable():
+            # Compressed files can only be read forwards, so their last
+            # epoch is found by streaming through to the end, collecting
+            # the session statistics on the way
+            with span('rinex.epochs', scan='full'):
+                start_time, end_time, statistics = scan_session(f, header, header_lines + 1, gap_intervals)
+        else:
+            # Only the first epoch after the header and the last one in
+            # the file are needed, so the (possibly hundreds of MB of)
+            # observations in between are never read
+            with span('rinex.epochs', scan='bounds'):
+                data_offset = f.tell()
+                start_time = _first_epoch_time(f, rinex_version, header_lines + 1)
+                end_time = _last_epoch_time(f, rinex_version, data_offset) if start_time is not None else None
+
+    info = {}
+    info['marker name'] = header.get('MARKER NAME', '').strip()
+    x, y, z = map(float, _header_value(header, 'APPROX POSITION XYZ', rinex_file).split()[:3])
+    info['approx position xyz'] = (x, y, z)
+    info['longitude'], info['latitude'], info['height'] = geodetic_from_ecef(x, y, z)
+    rec_type_vers = _header_value(header, 'REC # / TYPE / VERS', rinex_file).strip()
+    info['receiver number'] = rec_type_vers[:20].strip()
+    info['receiver type'] = rec_type_vers[20:40].strip()
+    ant_type = _header_value(header, 'ANT # / TYPE', rinex_file).strip()
+    info['antenna number'] = ant_type[:20].strip()
+    info['antenna type'] = ant_type[20:40].strip()
+    info['antenna height'], _, _ = map(float, _header_value(header, 'ANTENNA: DELTA H/E/N', rinex_file).split()[:3])
 
-    if not times:
+    if start_time is None or end_time is None:
         raise ValueError(f'No valid observation epochs found in RINEX file: {rinex_file}')
 
-    start_time = times[0]
-    end_time = times[-1]
-    # print('loading ... ', end='')
-    # data = gr.load(rinex_file)
-    # print('done!')
-    # start_time = data.time[0].values  # Start of seance
-    # end_time = data.time[-1].values   # End of seance
     info['start date'] = start_time.date()
     info['start time'] = start_time.time()
     info['end date'] = end_time.date()
     info['end time'] = end_time.time()
+    info.update(statistics)
 
     return info
 
 def crd2cell_100(lon, lat):
-    rows = 'A B C D E F G H I J K L M N O P Q R S T U V Z'.split()
-    col = int(lon//6+31)
-    row = int(lat//4)
-    subcell = 133 - 12 * int((lat - row * 4)//(4/12)) + int((lon - col * 6 + 186)//(6/12))
-    return '-'.join([str(rows[row]), str(col), str(subcell)])
+    return str(map_sheet_nomenclature(lon, lat, 100000)[0])
 
-def _form_field(name, value, as_form, width='5cm'):
+def _form_field(name, value, as_form, width='5cm', fields=None):
     """Render a value as plain text (default path, used for the .tex that
     gets converted to .docx), or as a fillable hyperref PDF form field
     pre-filled with that value (used for the .tex that becomes the .pdf).
+    With `fields` given, the form field is left empty and the value is
+    recorded in fields[name] instead, to be filled in later (see
+    journal_by_rinex.pdftemplate).
     """
     if not as_form:
         return value
+    from pylatex import NoEscape
+    from pylatex.utils import escape_latex
+    if fields is not None:
+        fields[name] = str(value)
+        value = ''
     escaped = escape_latex(str(value))
     return NoEscape(
         r'\TextField[name=' + name + r',width=' + width +
@@ -124,14 +236,15 @@ def _form_field(name, value, as_form, width='5cm'):
     )
 
 
-def _paired_field_row(label_a, name_a, value_a, label_b, name_b, value_b, as_form, width='3cm'):
+def _paired_field_row(label_a, name_a, value_a, label_b, name_b, value_b, as_form, width='3cm', fields=None):
     """Combine two label/value pairs onto a single table row, to keep the
     journal compact enough to fit on one page."""
     label = f'{label_a} / {label_b}'
     if not as_form:
         return [label, f'{value_a} / {value_b}']
-    field_a = _form_field(name_a, value_a, as_form, width=width)
-    field_b = _form_field(name_b, value_b, as_form, width=width)
+    from pylatex import NoEscape
+    field_a = _form_field(name_a, value_a, as_form, width=width, fields=fields)
+    field_b = _form_field(name_b, value_b, as_form, width=width, fields=fields)
     return [label, NoEscape(str(field_a) + r'\hspace{0.8cm}' + str(field_b))]
 
 
@@ -164,6 +277,7 @@ def _radio_choice_lines(name, choices, selected_value, as_form):
             f'{"[x]" if value == selected_value else "[ ]"} {label}'
             for label, value in choices
         ]
+    from pylatex import NoEscape
     # 'Off' is the reserved PDF value meaning "no button in this group is
     # selected" - used instead of omitting default=, which leaves the
     # field's own value as an unresolved, literally-visible macro name
@@ -178,6 +292,7 @@ def _radio_choice_lines(name, choices, selected_value, as_form):
     return lines
 
 
+@traced('pdf.merge_radio')
 def _merge_radio_widgets(pdf_path, field_name, values_in_order, selected_value):
     """Fix up a compiled PDF so that every /Btn field named `field_name`
     becomes one true radio group (a single field with the widgets as its
@@ -193,6 +308,7 @@ def _merge_radio_widgets(pdf_path, field_name, values_in_order, selected_value):
     has to be set explicitly here too, not just /V - otherwise nothing
     appears checked even for a correctly-selected value.
     """
+    import pikepdf
     pdf = pikepdf.open(pdf_path, allow_overwriting_input=True)
     acroform = pdf.Root.AcroForm
     fields = acroform.Fields
@@ -243,7 +359,93 @@ def _merge_radio_widgets(pdf_path, field_name, values_in_order, selected_value):
     pdf.close()
 
 
-def _build_journal_document(data, as_form, a_picture, b_picture, insert_file):
+def _station_rows(data, as_form, fields=None):
+    """Rows of the journal's station and equipment table, shared by the
+    LaTeX and .docx journals: [label, value] lists, with a plain string
+    for a heading row spanning both columns."""
+    rows = [
+        'Общая информация',
+        ['Организация', _form_field('organization', data['organization'], as_form, width='10cm', fields=fields)],
+        ['Наименование пункта', _form_field('marker_name', data['marker name'], as_form, width='10cm', fields=fields)],
+        ['Объект', _form_field('object', data['object'], as_form, width='10cm', fields=fields)],
+        ['Исполнитель (ФИО)', _form_field('operator', data['operator'], as_form, width='10cm', fields=fields)],
+        'Местоположение',
+        _paired_field_row(
+            'Широта', 'latitude', f'{data["latitude"]:.6f}',
+            'Долгота', 'longitude', f'{data["longitude"]:.6f}',
+            as_form, fields=fields),
+        _paired_field_row(
+            'Высота', 'height', f'{data["height"]:.6f}',
+            'Трапеция 1:100000', 'trapezoid', crd2cell_100(data['longitude'], data['latitude']),
+            as_form, fields=fields),
+    ]
+    for scale, nomenclature in data.get('map sheets', []):
+        rows.append([f'Трапеция 1:{scale}', _form_field(f'trapezoid_{scale}', nomenclature, as_form, width='10cm', fields=fields)])
+    for index, (label, coordinates) in enumerate(data.get('coordinate systems', [])):
+        rows.append([label, _form_field(f'coordinates_{index}', coordinates, as_form, width='10cm', fields=fields)])
+    rows += [
+        'Оборудование',
+        ['Тип и № приемника', _form_field(
+            'receiver', f'{data["receiver type"]} {data["receiver number"]}', as_form, width='10cm', fields=fields)],
+        ['Тип и № антенны', _form_field(
+            'antenna', f'{data["antenna type"]} {data["antenna number"]}', as_form, width='10cm', fields=fields)],
+        'Характеристика пункта',
+        _paired_field_row(
+            'Тип знака', 'centre_type', data['centre type'],
+            'Тип центра', 'benchmark_type', data['benchmark type'],
+            as_form, width='5cm', fields=fields),
+    ]
+    return rows
+
+
+def _session_rows(data, as_form, fields=None):
+    """Rows of the journal's session table, like _station_rows()."""
+    rows = [
+        'Параметры сеанса',
+        ['', 'Начало', 'Конец'],
+        [
+            'Дата',
+            _form_field('start_date', str(data['start date']), as_form, width='2.5cm', fields=fields),
+            _form_field('end_date', str(data['end date']), as_form, width='2.5cm', fields=fields),
+        ],
+        [
+            'Время',
+            _form_field('start_time', str(data['start time'])+'+0 UTC', as_form, width='5cm', fields=fields),
+            _form_field('end_time', str(data['end time'])+'+0 UTC', as_form, width='5cm', fields=fields),
+        ],
+    ]
+    # One value for the whole session, in both columns
+    for label, name, key in (('Высота антенны', 'antenna_height', 'antenna height'), ('GDOP', 'gdop', 'gdop'), ('PDOP', 'pdop', 'pdop')):
+        field = _form_field(name, data[key], as_form, width='2cm', fields=fields)
+        rows.append([label, field, field])
+    for index, (label, value) in enumerate(data.get('session statistics', [])):
+        field = _form_field(f'session_statistics_{index}', value, as_form, width='5cm', fields=fields)
+        rows.append([label, field, field])
+    return rows
+
+
+def _antenna_height_choices(ant_height_type, as_form):
+    """Checklist lines (or radio widgets) of the "A" (no tripod) and "B"
+    (tripod) antenna height diagrams. Both groups share one field name and
+    the same resolved selection, so all 5 options are mutually exclusive
+    across both diagrams - picking one anywhere clears any other."""
+    radio_a_lines = _radio_choice_lines(
+        ANTENNA_HEIGHT_RADIO_FIELD,
+        [('2 -- до основания', 'base'), ('3 -- до фаз. центра', 'phase')],
+        ant_height_type,
+        as_form,
+    )
+    radio_b_lines = _radio_choice_lines(
+        ANTENNA_HEIGHT_RADIO_FIELD,
+        [('1 -- наклонная', 'tripod_slant'), ('2 -- верт. до основания', 'tripod_base'), ('3 -- верт. до фаз. центра', 'tripod_phase')],
+        ant_height_type,
+        as_form,
+    )
+    return radio_a_lines, radio_b_lines
+
+
+def _build_journal_document(data, as_form, a_picture, b_picture, insert_file, fields=None):
+    from pylatex import Document, Tabularx, NoEscape, Package, Command, MultiColumn, MultiRow, Section, Subsection
     doc = Document(
         document_options=['10pt', 'a4paper', 'final'],
         documentclass='article',
@@ -281,43 +483,11 @@ def _build_journal_document(data, as_form, a_picture, b_picture, insert_file):
                     table_spec=NoEscape(r'|l|X|'),
                     width_argument=NoEscape(r'\textwidth'))) as table:
                 table.add_hline()
-                table.add_row([MultiColumn(size=2, data=NoEscape(r'\textbf{Общая информация}'), align='|c|')])
-                table.add_hline()
-                table.add_row(['Организация', _form_field('organization', data['organization'], as_form, width='10cm')])
-                table.add_hline()
-                table.add_row(['Наименование пункта', _form_field('marker_name', data['marker name'], as_form, width='10cm')])
-                table.add_hline()
-                table.add_row(['Объект', _form_field('object', data['object'], as_form, width='10cm')])
-                table.add_hline()
-                table.add_row(['Исполнитель (ФИО)', _form_field('operator', data['operator'], as_form, width='10cm')])
-                table.add_hline()
-                table.add_row([MultiColumn(size=2, data=NoEscape(r'\textbf{Местоположение}'), align='|c|')])
-                table.add_hline()
-                table.add_row(_paired_field_row(
-                    'Широта', 'latitude', f'{data["latitude"]:.6f}',
-                    'Долгота', 'longitude', f'{data["longitude"]:.6f}',
-                    as_form))
-                table.add_hline()
-                table.add_row(_paired_field_row(
-                    'Высота', 'height', f'{data["height"]:.6f}',
-                    'Трапеция 1:100000', 'trapezoid', crd2cell_100(data['longitude'], data['latitude']),
-                    as_form))
-                table.add_hline()
-                table.add_row([MultiColumn(size=2, data=NoEscape(r'\textbf{Оборудование}'), align='|c|')])
-                table.add_hline()
-                table.add_row(['Тип и № приемника', _form_field(
-                    'receiver', f'{data["receiver type"]} {data["receiver number"]}', as_form, width='10cm')])
-                table.add_hline()
-                table.add_row(['Тип и № антенны', _form_field(
-                    'antenna', f'{data["antenna type"]} {data["antenna number"]}', as_form, width='10cm')])
-                table.add_hline()
-                table.add_row([MultiColumn(size=2, data=NoEscape(r'\textbf{Характеристика пункта}'), align='|c|')])
-                table.add_hline()
-                table.add_row(_paired_field_row(
-                    'Тип знака', 'centre_type', data['centre type'],
-                    'Тип центра', 'benchmark_type', data['benchmark type'],
-                    as_form, width='5cm'))
-                table.add_hline()
+                for row in _station_rows(data, as_form, fields):
+                    if isinstance(row, str):
+                        row = [MultiColumn(size=2, data=NoEscape(r'\textbf{' + row + '}'), align='|c|')]
+                    table.add_row(row)
+                    table.add_hline()
 
         # Create a table to display the metadata
         with doc.create(Subsection(title='Информация о сеансе измерений', numbering=False)):
@@ -326,31 +496,11 @@ def _build_journal_document(data, as_form, a_picture, b_picture, insert_file):
                     table_spec=NoEscape(r"|X|X|X|"),
                     width_argument=NoEscape(r'\textwidth'))) as table:
                 table.add_hline()
-                table.add_row([MultiColumn(size=3, data='Параметры сеанса', align='|c|')])
-                table.add_hline()
-                table.add_row(['', 'Начало', 'Конец'])
-                table.add_hline()
-                table.add_row([
-                    'Дата',
-                    _form_field('start_date', str(data['start date']), as_form, width='2.5cm'),
-                    _form_field('end_date', str(data['end date']), as_form, width='2.5cm'),
-                ])
-                table.add_hline()
-                table.add_row([
-                    'Время',
-                    _form_field('start_time', str(data['start time'])+'+0 UTC', as_form, width='5cm'),
-                    _form_field('end_time', str(data['end time'])+'+0 UTC', as_form, width='5cm'),
-                ])
-                table.add_hline()
-                antenna_height_field = _form_field('antenna_height', data['antenna height'], as_form, width='2cm')
-                table.add_row(['Высота антенны', antenna_height_field, antenna_height_field])
-                table.add_hline()
-                gdop_field = _form_field('gdop', data['gdop'], as_form, width='2cm')
-                table.add_row(['GDOP', gdop_field, gdop_field])
-                table.add_hline()
-                pdop_field = _form_field('pdop', data['pdop'], as_form, width='2cm')
-                table.add_row(['PDOP', pdop_field, pdop_field])
-                table.add_hline()
+                for row in _session_rows(data, as_form, fields):
+                    if isinstance(row, str):
+                        row = [MultiColumn(size=3, data=row, align='|c|')]
+                    table.add_row(row)
+                    table.add_hline()
 
         with doc.create(Subsection(title=r'Измерение высоты и схема расположение пункта', numbering=False)):
             with doc.create(
@@ -366,22 +516,9 @@ def _build_journal_document(data, as_form, a_picture, b_picture, insert_file):
                 )
                 table.add_hline()
 
-                # Both groups share one field name and the same resolved
-                # selection, so all 5 options are mutually exclusive across
-                # both diagrams - picking one anywhere clears any other.
-                ant_height_type = data['antenna height type']
-                radio_a_lines = _radio_choice_lines(
-                    ANTENNA_HEIGHT_RADIO_FIELD,
-                    [('2 -- до основания', 'base'), ('3 -- до фаз. центра', 'phase')],
-                    ant_height_type,
-                    as_form,
-                )
-                radio_b_lines = _radio_choice_lines(
-                    ANTENNA_HEIGHT_RADIO_FIELD,
-                    [('1 -- наклонная', 'tripod_slant'), ('2 -- верт. до основания', 'tripod_base'), ('3 -- верт. до фаз. центра', 'tripod_phase')],
-                    ant_height_type,
-                    as_form,
-                )
+                # (a template's radio group is left unset, see journal_generator())
+                radio_a_lines, radio_b_lines = _antenna_height_choices(
+                    data['antenna height type'] if fields is None else None, as_form)
 
                 table.add_row([
                     # rows: caption + picture + choices, for both A and B
@@ -406,10 +543,54 @@ def _build_journal_document(data, as_form, a_picture, b_picture, insert_file):
     return doc
 
 
-def journal_generator(data, filename):
+def _build_journal_docx(data, a_pic_path, b_pic_path, location_map_path):
+    """The .docx version of the plain journal: the same headings, tables,
+    checklist lines and pictures as _build_journal_document(data, False,
+    ...), written directly as WordprocessingML."""
+    doc = DocxDocument()
+    doc.heading('ЖУРНАЛ СПУТНИКОВЫХ НАБЛЮДЕНИЙ', 1)
+
+    doc.heading('Информация о пункте и оборудовании', 2)
+    doc.table([0.3, 0.7], [
+        [Cell(row, span=2, bold=True, center=True)] if isinstance(row, str) else row
+        for row in _station_rows(data, False)
+    ])
+
+    doc.heading('Информация о сеансе измерений', 2)
+    doc.table([1 / 3] * 3, [
+        [Cell(row, span=3, center=True)] if isinstance(row, str) else row
+        for row in _session_rows(data, False)
+    ])
+
+    doc.heading('Измерение высоты и схема расположение пункта', 2)
+    radio_a_lines, radio_b_lines = _antenna_height_choices(data['antenna height type'], False)
+    right_column = [
+        'A. Без штатива',
+        [doc.image('antenna_a', a_pic_path + '.png', 0.2)],
+        *radio_a_lines,
+        'B. На штативе',
+        [doc.image('antenna_b', b_pic_path + '.png', 0.2)],
+        *radio_b_lines,
+    ]
+    map_cell = Cell([doc.image('map', location_map_path, 0.6)], vmerge='restart')
+    doc.table([0.6, 0.4], [
+        ['Схема расположения пункта', 'Зарисовка постановки антенны'],
+        *[
+            [map_cell if index == 0 else Cell(vmerge='continue'), Cell(content)]
+            for index, content in enumerate(right_column)
+        ],
+    ])
+
+    doc.paragraph('Подпись', align='right', space_before=480)
+    return doc
+
 
-    ant_height_type = data['antenna height type']
+def _include_graphics(path, width):
+    return r'\includegraphics[width=' + width + r'\textwidth]{' + path.replace('\\', '/') + '}'
 
+
+def _antenna_picture_paths(ant_height_type):
+    # (A, B) antenna height diagrams, without their .png extension
     abs_path = os.path.abspath(
         os.path.join(
             os.path.dirname(__file__), 'images'))
@@ -423,49 +604,161 @@ def journal_generator(data, filename):
     else:
         a_pic_path = os.path.join(abs_path, 'default')
         b_pic_path = os.path.join(abs_path, ant_height_type)
-
-    a_picture = r'\includegraphics[width=0.2\textwidth]{' + a_pic_path.replace("\\", "/") + '}'
-    b_picture = r'\includegraphics[width=0.2\textwidth]{' + b_pic_path.replace("\\", "/") + '}'
-
-    location_map = get_map(data['longitude'], data['latitude'], data['marker name'])
-    location_map_path = os.path.join(os.path.dirname(filename), f'{data['marker name']}.png')
-    location_map.savefig(location_map_path, bbox_inches='tight')
-    plt.close(location_map)
-    insert_file = r'\includegraphics[width=0.6\textwidth]{'+location_map_path.replace('\\', '/')+'}'
+    return a_pic_path, b_pic_path
+
+
+def journal_map(data, filename, tiles=None, map_cache=None, map_renderer='fast', map_width=DEFAULT_MAP_WIDTH_PX):
+    """Draw the location map of the journal `filename` (or copy it from
+    `map_cache`) next to it; returns its path. The first stage of
+    journal_generator(), and the one waiting on tile downloads."""
+    if tiles is None:
+        tiles = tile_source()
+    # Absolute, since the PDF may be compiled in another directory (see
+    # journal_by_rinex.latexbuild)
+    location_map_path = os.path.join(os.path.dirname(os.path.abspath(filename)), f'{data['marker name']}.png')
+    # Stations revisited in later sessions (or several files of the same
+    # session) get the very same map, so it is only drawn once
+    style = [MAP_STYLE_VERSION, map_renderer, map_width if map_renderer == 'fast' else None]
+    key = map_key(data['longitude'], data['latitude'], data['marker name'], MAP_ZOOM, MAP_EXTENT, style)
+    with span('map.cache'):
+        cached = map_cache is not None and map_cache.get(tiles.key, key, location_map_path)
+    if not cached:
+        tiles = MissingTileCounter(tiles)
+        if map_renderer == 'fast':
+            # Exactly the pixels the page shows, without a matplotlib figure
+            with span('map.render'):
+                render_map(
+                    data['longitude'], data['latitude'], data['marker name'], tiles,
+                    MAP_ZOOM, MAP_EXTENT, map_width,
+                ).save(location_map_path)
+        else:
+            import matplotlib.pyplot as plt
+            # pyplot's figures are global state, so threads draw one at a time
+            with _PYPLOT_LOCK:
+                location_map = get_map(data['longitude'], data['latitude'], data['marker name'], tiles)
+                # (cartopy only fetches the tiles once the figure is drawn)
+                with span('map.savefig'):
+                    location_map.savefig(location_map_path, bbox_inches='tight')
+                plt.close(location_map)
+        # A map with blank tiles (not downloaded, e.g. while offline) is
+        # drawn again next time rather than reused for weeks
+        if map_cache is not None and not tiles.missing:
+            map_cache.put(tiles.key, key, location_map_path)
+    return location_map_path
+
+
+def journal_pdf(data, filename, location_map_path, latex=None, templates=None):
+    """Write the journal's PDF, `filename`.pdf: filled in from a form
+    template if `templates` is given, otherwise compiled (see
+    journal_generator())."""
+    a_pic_path, b_pic_path = _antenna_picture_paths(data['antenna height type'])
 
     # PDF: fillable form fields for the values the user typed in via the
     # GUI/config, so they can be corrected by hand later without
     # regenerating. Compiled first, then its intermediate .tex/.aux/.log
     # are cleaned up so they don't clash with the plain .tex below.
-    form_doc = _build_journal_document(data, True, a_picture, b_picture, insert_file)
-    form_doc.generate_pdf(filename, clean_tex=True)
-    _merge_radio_widgets(
-        filename + '.pdf', ANTENNA_HEIGHT_RADIO_FIELD,
-        ANTENNA_HEIGHT_RADIO_VALUES, data['antenna height type'],
-    )
+    if templates is not None:
+        import pikepdf
+        try:
+            with span('pdf.template_fill'):
+                _fill_journal_template(data, filename, templates, {
+                    'map': location_map_path,
+                    'antenna_a': a_pic_path + '.png',
+                    'antenna_b': b_pic_path + '.png',
+                })
+            return
+        except (ValueError, pikepdf.PdfError) as e:
+            print(f'Warning! Could not fill the journal form template, compiling the journal instead: {e}')
+    form_doc = _build_journal_document(
+        data, True, _include_graphics(a_pic_path, '0.2'), _include_graphics(b_pic_path, '0.2'),
+        _include_graphics(location_map_path, '0.6'))
+
+    def merge_radio_widgets(pdf_path):
+        _merge_radio_widgets(
+            pdf_path, ANTENNA_HEIGHT_RADIO_FIELD,
+            ANTENNA_HEIGHT_RADIO_VALUES, data['antenna height type'],
+        )
+
+    if latex is not None:
+        # (a journal_by_rinex.latexbuild.JournalBatch only compiles
+        # it, and fixes up its radio group, when flushed)
+        latex.compile(form_doc, filename, finalize=merge_radio_widgets)
+    else:
+        with span('latex.compile'):
+            form_doc.generate_pdf(filename, clean_tex=True)
+        merge_radio_widgets(filename + '.pdf')
+
+
+def journal_text(data, filename, location_map_path, docx=False):
+    """Write the journal's plain `filename`.tex and, with `docx` set, its
+    native `filename`.docx (see journal_generator())."""
+    a_pic_path, b_pic_path = _antenna_picture_paths(data['antenna height type'])
 
     # .tex: plain text, byte-for-byte what this function produced before
     # form fields existed - this is what gets converted to .docx, and
     # hyperref form fields would silently lose their values in that
     # conversion, so this version must never contain any.
-    plain_doc = _build_journal_document(data, False, a_picture, b_picture, insert_file)
-    plain_doc.generate_tex(filename)
+    with span('tex'):
+        plain_doc = _build_journal_document(
+            data, False, _include_graphics(a_pic_path, '0.2'), _include_graphics(b_pic_path, '0.2'),
+            _include_graphics(location_map_path, '0.6'))
+        plain_doc.generate_tex(filename)
+
+    # .docx: the same plain journal, without converting the .tex
+    if docx:
+        with span('docx.native'):
+            _build_journal_docx(data, a_pic_path, b_pic_path, location_map_path).save(filename + '.docx')
+
+
+def journal_generator(data, filename, tiles=None, map_cache=None, map_renderer='fast', map_width=DEFAULT_MAP_WIDTH_PX, latex=None, templates=None, docx=False):
+    """Write the journal `filename`: its location map, its PDF and its
+    plain .tex (and .docx), one stage after the other (journal_map(),
+    journal_pdf() and journal_text())."""
+    location_map_path = journal_map(data, filename, tiles, map_cache, map_renderer, map_width)
+    journal_pdf(data, filename, location_map_path, latex, templates)
+    journal_text(data, filename, location_map_path, docx)
+
+
+def _fill_journal_template(data, filename, templates, images):
+    """Write the journal PDF by filling in a precompiled form template
+    (see journal_by_rinex.pdftemplate): the same document as the compiled
+    path, with empty fields, no radio choice and placeholder images of the
+    same pixel sizes, so one template serves every journal with the same
+    layout."""
+    fields = {}
+    placeholders = {slot: templates.placeholder(path) for slot, path in images.items()}
+    template_doc = _build_journal_document(
+        data, True,
+        slot_graphics('antenna_a', placeholders['antenna_a'], '0.2'),
+        slot_graphics('antenna_b', placeholders['antenna_b'], '0.2'),
+        slot_graphics('map', placeholders['map'], '0.6'),
+        fields=fields,
+    )
+    template_path = templates.template(template_doc, lambda pdf_path: _merge_radio_widgets(
+        pdf_path, ANTENNA_HEIGHT_RADIO_FIELD, ANTENNA_HEIGHT_RADIO_VALUES, None))
+    templates.fill(
+        template_path, filename + '.pdf', fields,
+        ANTENNA_HEIGHT_RADIO_FIELD, ANTENNA_HEIGHT_RADIO_VALUES, data['antenna height type'], images,
+    )
+
 
-def get_map(longitude, latitude, marker_name):
-    ''' Get map of ties scheme '''
+@traced('map.figure')
+def get_map(longitude, latitude, marker_name, tiles=None):
+    ''' Get map of ties scheme. Tiles come from `tiles` (see
+    journal_by_rinex.tiles.tile_source()), by default the same imagery as
+    cimgt.QuadtreeTiles() through the on-disk tile cache '''
+
+    import matplotlib.pyplot as plt
+    from cartopy import crs as ccrs
 
     fig = plt.figure(figsize=(15, 15))
       
-    extent = [longitude - 0.01, longitude + 0.01, latitude - 0.005, latitude + 0.005]
-    # request = cimgt.OSM()
-    # request = cimgt.Stamen('terrain-background')
-    request = cimgt.QuadtreeTiles()
+    extent = [longitude - MAP_EXTENT[0], longitude + MAP_EXTENT[0], latitude - MAP_EXTENT[1], latitude + MAP_EXTENT[1]]
+    request = tile_imagery(tiles if tiles is not None else tile_source())
     ax = plt.axes(projection=request.crs)
     ax.set_extent(extent)
 
-    zoom = 15
-
-    ax.add_image(request, zoom)
+    ax.add_image(request, MAP_ZOOM)
 
     ax.plot(longitude, latitude, '-^w', markersize=20, mfc='r', transform=ccrs.PlateCarree())
    
@@ -0,0 +1,206 @@
+from functools import lru_cache
+
+# numpy and pyproj are imported where they're used, so that importing this
+# module (and so starting the GUI or CLI) doesn't load them
+
+# The ECEF -> geodetic conversion get_info() has always used
+ECEF_CRS = '+proj=cart'
+GEODETIC_CRS = '+proj=longlat +ellps=WGS84'
+
+# Source CRS of every projection to a configured coordinate system
+WGS84_CRS = 'EPSG:4326'
+
+# Coordinate systems with a zone picked per station from its longitude:
+# WGS 84 / UTM (EPSG:326zz north, 327zz south) and Pulkovo 1942 (SK-42) /
+# Gauss-Kruger 6-degree zones (EPSG:284zz, zones 4-32)
+ZONED_SYSTEMS = ('utm', 'gauss_kruger')
+GAUSS_KRUGER_ZONES = range(4, 33)
+
+# Rows of the 1:1 000 000 map sheets, 4 degrees of latitude each from
+# the equator
+SHEET_ROWS = 'A B C D E F G H I J K L M N O P Q R S T U V Z'.split()
+
+ROMAN_NUMERALS = [
+    'I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X', 'XI', 'XII',
+    'XIII', 'XIV', 'XV', 'XVI', 'XVII', 'XVIII', 'XIX', 'XX', 'XXI', 'XXII', 'XXIII', 'XXIV',
+    'XXV', 'XXVI', 'XXVII', 'XXVIII', 'XXIX', 'XXX', 'XXXI', 'XXXII', 'XXXIII', 'XXXIV', 'XXXV', 'XXXVI',
+]
+
+# Map sheet scales with a nomenclature, mapped to how many times the
+# 1:1 000 000 sheet is divided along each side for that scale and how
+# each sheet is labelled within its parent sheet
+MAP_SHEET_SCALES = {
+    1000000: (1, None),
+    500000: (2, 'А Б В Г'.split()),
+    200000: (6, ROMAN_NUMERALS),
+    100000: (12, None),
+    50000: (24, 'А Б В Г'.split()),
+    25000: (48, 'а б в г'.split()),
+    10000: (96, '1 2 3 4'.split()),
+}
+
+
+@lru_cache(maxsize=None)
+def _transformer(source, target):
+    # Building a Transformer costs milliseconds (it looks the CRSs and
+    # the datum transformation up in the PROJ database), so each pair is
+    # only ever built once per process
+    import pyproj
+    return pyproj.Transformer.from_crs(source, target, always_xy=True)
+
+
+@lru_cache(maxsize=None)
+def _crs(crs):
+    import pyproj
+    return pyproj.CRS.from_user_input(crs)
+
+
+def geodetic_from_ecef(x, y, z):
+    """WGS 84 (longitude, latitude, height) of ECEF positions; accepts
+    scalars or arrays of any number of stations at once."""
+    return _transformer(ECEF_CRS, GEODETIC_CRS).transform(x, y, z)
+
+
+def parse_coordinate_systems(systems):
+    """Validate the coordinate_systems config list. Each entry is either
+    'utm' or 'gauss_kruger' (zone chosen per station), a CRS understood
+    by pyproj (e.g. 'EPSG:7683'), or a mapping with a 'crs' and an
+    optional 'name' to show in the journal. Returns a list of mappings."""
+    if not isinstance(systems, list):
+        raise ValueError('coordinate_systems must be a list.')
+    parsed = []
+    for system in systems:
+        if isinstance(system, str):
+            system = {'crs': system}
+        if not isinstance(system, dict) or not isinstance(system.get('crs'), str):
+            raise ValueError(f'Invalid coordinate system {system!r}: expected a CRS string or a mapping with a "crs" key.')
+        if system['crs'] not in ZONED_SYSTEMS:
+            from pyproj.exceptions import CRSError
+            try:
+                _crs(system['crs'])
+            except CRSError as e:
+                raise ValueError(f'Unknown coordinate system {system["crs"]!r}: {e}')
+        parsed.append({key: str(value) for key, value in system.items() if key in ('crs', 'name')})
+    return parsed
+
+
+def _zone_crs(system, zone, north):
+    if system == 'utm':
+        return f'EPSG:{(32600 if north else 32700) + zone}', f'UTM {zone}{"N" if north else "S"}'
+    if zone not in GAUSS_KRUGER_ZONES:
+        raise ValueError(f'No Pulkovo 1942 Gauss-Kruger zone {zone} (only zones 4-32 are defined)')
+    return f'EPSG:{28400 + zone}', f'СК-42, зона {zone}'
+
+
+def project(longitude, latitude, system):
+    """Coordinates of WGS 84 positions in one configured coordinate system
+    (see parse_coordinate_systems()). Returns (labels, first, second)
+    arrays: easting/northing for projected systems, longitude/latitude
+    for geographic ones. Each distinct target CRS is transformed in a
+    single call, so zoned systems cost one call per zone in the batch."""
+    import numpy as np
+    longitude = np.atleast_1d(np.asarray(longitude, dtype=float))
+    latitude = np.atleast_1d(np.asarray(latitude, dtype=float))
+    labels = np.empty(longitude.shape, dtype=object)
+    first = np.empty(longitude.shape)
+    second = np.empty(longitude.shape)
+
+    if system['crs'] in ZONED_SYSTEMS:
+        if system['crs'] == 'utm':
+            zones = (np.floor((longitude + 180) / 6).astype(int) % 60) + 1
+        else:
+            zones = np.floor(np.mod(longitude, 360) / 6).astype(int) + 1
+        groups = {}
+        for index, key in enumerate(zip(zones.tolist(), (latitude >= 0).tolist())):
+            groups.setdefault(key, []).append(index)
+        targets = [(_zone_crs(system['crs'], *key), indices) for key, indices in groups.items()]
+    else:
+        crs = system['crs']
+        targets = [((crs, system.get('name') or _crs(crs).name), slice(None))]
+
+    for (crs, label), indices in targets:
+        first[indices], second[indices] = _transformer(WGS84_CRS, crs).transform(
+            longitude[indices], latitude[indices])
+        labels[indices] = system.get('name') or label
+    return labels, first, second
+
+
+def is_geographic(system):
+    return system['crs'] not in ZONED_SYSTEMS and _crs(system['crs']).is_geographic
+
+
+def coordinate_rows(longitude, latitude, systems):
+    """(label, coordinates) journal rows of every position in each of the
+    configured coordinate systems, as one list of rows per position."""
+    import numpy as np
+    longitude = np.atleast_1d(np.asarray(longitude, dtype=float))
+    rows = [[] for _ in range(len(longitude))]
+    for system in systems:
+        geographic = is_geographic(system)
+        for station_rows, label, first, second in zip(rows, *project(longitude, latitude, system)):
+            if geographic:
+                station_rows.append((label, f'B {second:.6f} / L {first:.6f}'))
+            else:
+                station_rows.append((label, f'N {second:.3f} / E {first:.3f}'))
+    return rows
+
+
+def parse_map_sheet_scales(scales):
+    """Validate the map_sheet_scales config list (e.g. [1000000, 10000])."""
+    if not isinstance(scales, list) or not all(scale in MAP_SHEET_SCALES for scale in scales):
+        raise ValueError(f'map_sheet_scales must be a list of scales out of: {", ".join(map(str, MAP_SHEET_SCALES))}')
+    return [int(scale) for scale in scales]
+
+
+def map_sheet_rows(longitude, latitude, scales):
+    """(scale, nomenclature) journal rows of every position for each of the
+    configured map sheet scales, as one list of rows per position."""
+    import numpy as np
+    rows = [[] for _ in np.atleast_1d(longitude)]
+    for scale in scales:
+        for station_rows, nomenclature in zip(rows, map_sheet_nomenclature(longitude, latitude, scale)):
+            station_rows.append((scale, str(nomenclature)))
+    return rows
+
+def map_sheet_nomenclature(longitude, latitude, scale=100000):
+    """Topographic map sheet nomenclature (e.g. 'N-37-133-А-а-1' at
+    1:10 000) of the sheets containing the given positions, for any
+    scale in MAP_SHEET_SCALES. Returns an array of strings."""
+    import numpy as np
+    if scale not in MAP_SHEET_SCALES:
+        raise ValueError(f'No map sheet nomenclature for scale 1:{scale}')
+    longitude = np.atleast_1d(np.asarray(longitude, dtype=float))
+    latitude = np.atleast_1d(np.asarray(latitude, dtype=float))
+
+    row = latitude // 4
+    col = (longitude // 6).astype(int) + 31
+    letters = np.asarray(SHEET_ROWS)[np.abs(row).astype(int) - (row < 0)]
+    # Offsets from the south-west corner of the 1:1 000 000 sheet
+    south = latitude - row * 4
+    west = longitude - col * 6 + 186
+
+    def cell(divisions):
+        # Row (counted from the north) and column of the sheet containing
+        # each position when the 1:1 000 000 sheet is divided `divisions`
+        # times along each side
+        return divisions - 1 - (south // (4 / divisions)).astype(int), (west // (6 / divisions)).astype(int)
+
+    names = [f'{letter}-{c}' for letter, c in zip(letters, col.tolist())]
+    if scale == 1000000:
+        return np.asarray(names)
+
+    divisions, labels = MAP_SHEET_SCALES[scale]
+    if divisions < 12:
+        y, x = cell(divisions)
+        sheets = (y * divisions + x).tolist()
+        return np.asarray([f'{name}-{labels[s]}' for name, s in zip(names, sheets)])
+
+    # 1:100 000 sheets are numbered 1-144; larger scales are successive
+    # quarters of those
+    y, x = cell(12)
+    parts = [(y * 12 + x + 1).tolist()]
+    for quarter_divisions, quarter_labels in MAP_SHEET_SCALES.values():
+        if 12 < quarter_divisions <= divisions:
+            y, x = cell(quarter_divisions)
+            parts.append([quarter_labels[q] for q in ((y % 2) * 2 + x % 2).tolist()])
+    return np.asarray(['-'.join([name, *map(str, sheet)]) for name, *sheet in zip(names, *parts)])
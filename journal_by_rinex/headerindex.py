@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+import contextlib
+from datetime import datetime
+from functools import lru_cache
+from journal_by_rinex.tiles import user_cache_dir
+from journal_by_rinex.functions import EPOCH_SCAN_MODES, get_info
+from journal_by_rinex.sessionstats import DEFAULT_GAP_INTERVALS, STATISTICS_KEYS
+
+# Bumped whenever the table's layout or what get_info() returns changes,
+# so the old entries are dropped rather than misread
+HEADER_INDEX_VERSION = 2
+
+# get_info() keys stored in the columns of the same name (spaces as
+# underscores); the rest are stored as below. So are STATISTICS_KEYS,
+# NULL unless every epoch was read, with the gap_intervals they depend on
+INFO_COLUMNS = (
+    'marker name', 'longitude', 'latitude', 'height', 'receiver number', 'receiver type',
+    'antenna number', 'antenna type', 'antenna height',
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    epoch_scan TEXT NOT NULL,
+    marker_name TEXT NOT NULL,
+    x REAL, y REAL, z REAL,
+    longitude REAL, latitude REAL, height REAL,
+    receiver_number TEXT, receiver_type TEXT,
+    antenna_number TEXT, antenna_type TEXT, antenna_height REAL,
+    first_epoch TEXT NOT NULL,
+    last_epoch TEXT NOT NULL,
+    epochs INTEGER, interval REAL, gaps INTEGER, gap_time REAL, longest_gap REAL,
+    completeness REAL, satellites_min INTEGER, satellites_mean REAL, satellites_max INTEGER,
+    gap_intervals REAL
+);
+CREATE INDEX IF NOT EXISTS files_marker_epoch ON files (marker_name, first_epoch);
+CREATE INDEX IF NOT EXISTS files_epoch ON files (first_epoch);
+'''
+
+
+def default_header_index_path():
+    return os.path.join(user_cache_dir(), 'headers.sqlite')
+
+
+def _column(key):
+    return key.replace(' ', '_')
+
+
+class HeaderIndex:
+    """SQLite index of what get_info() returned for each RINEX file,
+    keyed by its absolute path and checked against its size and
+    modification time, so unchanged files are never parsed again. A
+    file scanned with epoch_scan 'bounds' is read again when 'full' is
+    asked for, or when its session statistics are and were computed
+    with another gap_intervals. Safe to share between threads, and
+    between the processes of a batch (each opens its own connection)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # A connection must not be used across fork(), so every process
+        # opens its own
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            if connection.execute('PRAGMA user_version').fetchone()[0] != HEADER_INDEX_VERSION:
+                connection.execute('DROP TABLE IF EXISTS files')
+                connection.execute(f'PRAGMA user_version = {HEADER_INDEX_VERSION}')
+            connection.executescript(SCHEMA)
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    @staticmethod
+    def _info(row, gap_intervals=DEFAULT_GAP_INTERVALS):
+        info = {key: row[_column(key)] for key in INFO_COLUMNS}
+        info['approx position xyz'] = (row['x'], row['y'], row['z'])
+        start, end = datetime.fromisoformat(row['first_epoch']), datetime.fromisoformat(row['last_epoch'])
+        info['start date'], info['start time'] = start.date(), start.time()
+        info['end date'], info['end time'] = end.date(), end.time()
+        if row['epochs'] is not None and row['gap_intervals'] == gap_intervals:
+            info.update({key: row[_column(key)] for key in STATISTICS_KEYS})
+        return info
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            cursor = self._connect().execute(sql, parameters)
+            cursor.row_factory = sqlite3.Row
+            return cursor.fetchall()
+
+    def lookup(self, rinex_file, epoch_scan='bounds', stat=None, gap_intervals=DEFAULT_GAP_INTERVALS):
+        """The indexed get_info() of rinex_file, or None if it isn't
+        indexed or has changed since."""
+        path = os.path.abspath(rinex_file)
+        stat = stat or os.stat(path)
+        rows = self._query('SELECT * FROM files WHERE path = ? AND size = ? AND mtime_ns = ?',
+                           (path, stat.st_size, stat.st_mtime_ns))
+        if not rows or (epoch_scan == 'full' and (rows[0]['epoch_scan'] != 'full'
+                                                  or rows[0]['gap_intervals'] != gap_intervals)):
+            return None
+        return self._info(rows[0], gap_intervals)
+
+    def store(self, rinex_file, epoch_scan, info, stat=None, gap_intervals=DEFAULT_GAP_INTERVALS):
+        path = os.path.abspath(rinex_file)
+        stat = stat or os.stat(path)
+        start = datetime.combine(info['start date'], info['start time'])
+        end = datetime.combine(info['end date'], info['end time'])
+        values = {
+            'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'epoch_scan': epoch_scan,
+            **{_column(key): info[key] for key in INFO_COLUMNS},
+            'x': info['approx position xyz'][0], 'y': info['approx position xyz'][1], 'z': info['approx position xyz'][2],
+            'first_epoch': start.isoformat(), 'last_epoch': end.isoformat(),
+            **{_column(key): info.get(key) for key in STATISTICS_KEYS},
+            'gap_intervals': gap_intervals if 'epochs' in info else None,
+        }
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    f'INSERT OR REPLACE INTO files ({", ".join(values)}) VALUES ({", ".join("?" * len(values))})',
+                    tuple(values.values()),
+                )
+
+    def get_info(self, rinex_file, epoch_scan='bounds', gap_intervals=DEFAULT_GAP_INTERVALS):
+        """get_info(), answered from the index for unchanged files."""
+        stat = os.stat(rinex_file)
+        info = self.lookup(rinex_file, epoch_scan, stat, gap_intervals)
+        if info is not None:
+            self.hits += 1
+            return info
+        self.misses += 1
+        info = get_info(rinex_file, epoch_scan=epoch_scan, gap_intervals=gap_intervals)
+        self.store(rinex_file, epoch_scan, info, stat, gap_intervals)
+        return info
+
+    def sessions(self, marker_name=None, start=None, end=None):
+        """(path, info) of the indexed sessions of `marker_name` (any
+        marker if None) overlapping start..end (datetimes; either may be
+        None for an open range), in order of their start. Files that
+        have changed or been removed since they were indexed are left
+        out. Each session keeps the statistics it was indexed with,
+        whatever gap_intervals they were computed for."""
+        conditions, parameters = [], []
+        if marker_name is not None:
+            conditions.append('marker_name = ?')
+            parameters.append(marker_name)
+        if end is not None:
+            conditions.append('first_epoch < ?')
+            parameters.append(end.isoformat())
+        if start is not None:
+            conditions.append('last_epoch >= ?')
+            parameters.append(start.isoformat())
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        sessions = []
+        for row in self._query(f'SELECT * FROM files {where} ORDER BY first_epoch, path', parameters):
+            try:
+                stat = os.stat(row['path'])
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == (row['size'], row['mtime_ns']):
+                sessions.append((row['path'], self._info(row, row['gap_intervals'])))
+        return sessions
+
+    def prune(self):
+        """Drop the entries of files that no longer exist; returns how
+        many were dropped."""
+        missing = [(path,) for path, in self._query('SELECT path FROM files') if not os.path.exists(path)]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany('DELETE FROM files WHERE path = ?', missing)
+        return len(missing)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+@lru_cache(maxsize=None)
+def header_index(path=None):
+    """Header index at `path` (by default in the user cache folder),
+    opened once per process."""
+    return HeaderIndex(path or default_header_index_path())
+
+
+def header_index_from_settings(settings):
+    """The header index for the given settings, or None unless enabled
+    with header_index: true."""
+    if not settings.get('header_index', False):
+        return None
+    return header_index(settings.get('header_index_path'))
+
+
+def _datetime_argument(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'not an ISO date/time: {value!r}')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='journal_by_rinex_index',
+        description='Scan RINEX files into the header index, or query the indexed sessions. '
+                    'Prints one JSON object per file to stdout.',
+    )
+    parser.add_argument('--index', metavar='PATH', help='Index file (default: in the user cache folder)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    scan = commands.add_parser('scan', help='Index RINEX files and/or folders (scanned recursively)')
+    scan.add_argument('paths', nargs='+')
+    scan.add_argument('--epoch-scan', choices=EPOCH_SCAN_MODES, default='bounds')
+    scan.add_argument('--prune', action='store_true', help='Also drop the entries of files that no longer exist')
+    query = commands.add_parser('sessions', help='List indexed sessions, e.g. of one marker in one month')
+    query.add_argument('--marker', help='MARKER NAME')
+    query.add_argument('--from', dest='start', type=_datetime_argument, help='Sessions ending at or after (ISO date/time)')
+    query.add_argument('--to', dest='end', type=_datetime_argument, help='Sessions starting before (ISO date/time)')
+    return parser
+
+
+def _record(path, info):
+    record = {'file': path}
+    record.update({key: info[key] for key in INFO_COLUMNS})
+    record['start'] = datetime.combine(info['start date'], info['start time']).isoformat()
+    record['end'] = datetime.combine(info['end date'], info['end time']).isoformat()
+    record.update({key: info[key] for key in STATISTICS_KEYS if key in info})
+    return record
+
+
+def main(argv=None):
+    from journal_by_rinex.batch import collect_input_files
+
+    args = build_parser().parse_args(argv)
+    out = sys.stdout
+    index = header_index(args.index)
+    failed = False
+    if args.command == 'scan':
+        if args.prune:
+            index.prune()
+        for file in collect_input_files(args.paths):
+            try:
+                # Parser warnings go to stderr, so stdout stays
+                # parseable as JSON lines
+                with contextlib.redirect_stdout(sys.stderr):
+                    record = _record(file, index.get_info(file, args.epoch_scan))
+            except Exception as e:
+                record, failed = {'file': file, 'error': str(e)}, True
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        out.write(json.dumps({'event': 'summary', **index.stats()}) + '\n')
+    else:
+        for path, info in index.sessions(args.marker, args.start, args.end):
+            out.write(json.dumps(_record(path, info), ensure_ascii=False) + '\n')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
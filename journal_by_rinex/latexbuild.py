@@ -0,0 +1,303 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import subprocess
+import threading
+import time
+from functools import lru_cache
+from journal_by_rinex.trace import span
+
+# How the journal PDFs are compiled: 'precompiled' dumps each distinct
+# preamble into a LaTeX format once and starts every compile from it,
+# 'standard' runs pylatex's generate_pdf() (latexmk or pdflatex from
+# scratch) for every journal
+LATEX_COMPILE_MODES = ('precompiled', 'standard')
+
+LATEX_COMPILER = 'pdflatex'
+
+# Compiles are repeated (up to this many runs in all) while LaTeX asks
+# for a rerun, e.g. for longtable's column widths
+MAX_LATEX_RUNS = 3
+LATEX_RERUN_MARKERS = (b'Rerun to get', b'Rerun LaTeX', b'Label(s) may have changed')
+
+BEGIN_DOCUMENT = '\\begin{document}'
+END_DOCUMENT = '\\end{document}'
+
+# hyperref form field commands whose field names JournalBatch makes
+# unique to each page of a combined document
+FORM_FIELD_COMMANDS = ('\\TextField[name=', '\\ChoiceMenu[radio,name=')
+
+
+def default_latex_build_dir():
+    return os.path.join(tempfile.gettempdir(), 'journal_by_rinex-latex')
+
+
+def _worker_id():
+    # The process and thread compiling: each compiles in a directory of
+    # its own, since a batch pipeline runs several compiles per process
+    # at once on threads
+    return f'{os.getpid()}-{threading.get_ident()}'
+
+
+@lru_cache(maxsize=None)
+def _compiler_version(compiler):
+    # Part of every format's key: a format only loads into the exact
+    # engine build that dumped it
+    output = subprocess.check_output([compiler, '--version'], stderr=subprocess.STDOUT)
+    return output.splitlines()[0].decode(errors='replace')
+
+
+class LatexBuilder:
+    """Compiles pylatex Documents to PDF in a reusable build directory.
+
+    In 'precompiled' mode each distinct preamble (everything before
+    \\begin{document}, which is the same for nearly every journal) is
+    dumped into a format under <build_dir>/formats once, keyed by its
+    hash and the engine version, and every compile then only typesets
+    the document body. Each process (and thread) compiles in its own
+    <build_dir>/<pid>-<thread> directory under a fixed job name, so the
+    .aux file of the previous journal is still there and a rerun for
+    table widths is rarely needed. If the format can't be built, journals are
+    compiled the standard way instead."""
+
+    def __init__(self, mode='precompiled', build_dir=None):
+        self.mode = mode
+        self.build_dir = build_dir or default_latex_build_dir()
+        self.compiles = 0
+        self.compile_seconds = 0.0
+        self.reruns = 0
+        self.format_builds = 0
+        self.format_seconds = 0.0
+        self.batched_journals = 0
+        # The counters are updated from the threads of a pipeline batch
+        self._lock = threading.Lock()
+        self._failed_formats = set()
+
+    def compile(self, doc, filename, finalize=None):
+        """Write `doc` as `filename`.pdf, like doc.generate_pdf(filename,
+        clean_tex=True), then call finalize(pdf_path) if given."""
+        start = time.perf_counter()
+        try:
+            with span('latex.compile', mode=self.mode):
+                if self.mode != 'precompiled' or not self._compile_precompiled(doc.dumps(), filename):
+                    doc.generate_pdf(filename, clean_tex=True)
+        finally:
+            with self._lock:
+                self.compiles += 1
+                self.compile_seconds += time.perf_counter() - start
+        if finalize is not None:
+            finalize(filename + '.pdf')
+
+    def compile_source(self, source, filename):
+        """Write the LaTeX document `source` as `filename`.pdf."""
+        start = time.perf_counter()
+        try:
+            with span('latex.compile', mode=self.mode):
+                if self.mode != 'precompiled' or not self._compile_precompiled(source, filename):
+                    self._run([], 'journal', source, filename)
+        finally:
+            with self._lock:
+                self.compiles += 1
+                self.compile_seconds += time.perf_counter() - start
+
+    def _compile_precompiled(self, source, filename):
+        # False if there's no format for this source's preamble
+        preamble, _, body = source.partition(BEGIN_DOCUMENT)
+        format_path = self._format(preamble) if body else None
+        if format_path is None:
+            return False
+        self._run([f'-fmt={format_path}'], os.path.basename(format_path), BEGIN_DOCUMENT + body, filename)
+        return True
+
+    def _format(self, preamble):
+        """Path (without the .fmt extension) of the format for this
+        preamble, dumping it first if needed; None if it can't be."""
+        try:
+            version = _compiler_version(LATEX_COMPILER)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        key = hashlib.sha256(f'{version}\n{preamble}'.encode('utf-8')).hexdigest()[:16]
+        format_dir = os.path.join(self.build_dir, 'formats')
+        format_path = os.path.join(format_dir, f'journal-{key}')
+        if os.path.isfile(format_path + '.fmt'):
+            return format_path
+        if key in self._failed_formats:
+            return None
+
+        start = time.perf_counter()
+        os.makedirs(format_dir, exist_ok=True)
+        # Dumped under a per-process (and thread) job name and then
+        # renamed, so processes building the same format at once don't
+        # clash
+        job_name = f'journal-{key}-{_worker_id()}'
+        with open(os.path.join(format_dir, job_name + '.tex'), 'w', encoding='utf-8') as f:
+            f.write(preamble)
+            f.write('\\dump\n')
+        try:
+            subprocess.check_output(
+                [LATEX_COMPILER, '-ini', '--interaction=nonstopmode', f'-jobname={job_name}',
+                 f'&{LATEX_COMPILER}', job_name + '.tex'],
+                stderr=subprocess.STDOUT, cwd=format_dir,
+            )
+            os.replace(os.path.join(format_dir, job_name + '.fmt'), format_path + '.fmt')
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f'Warning! Could not precompile the LaTeX preamble, compiling journals the standard way: {e}')
+            self._failed_formats.add(key)
+            return None
+        finally:
+            for ext in ('tex', 'log'):
+                try:
+                    os.remove(os.path.join(format_dir, f'{job_name}.{ext}'))
+                except OSError:
+                    pass
+        with self._lock:
+            self.format_builds += 1
+            self.format_seconds += time.perf_counter() - start
+        return format_path
+
+    def _run(self, options, job_name, source, filename):
+        work_dir = os.path.join(self.build_dir, _worker_id())
+        os.makedirs(work_dir, exist_ok=True)
+        with open(os.path.join(work_dir, job_name + '.tex'), 'w', encoding='utf-8') as f:
+            f.write(source)
+
+        command = [
+            LATEX_COMPILER, *options, '--interaction=nonstopmode',
+            f'-jobname={job_name}', job_name + '.tex',
+        ]
+        for run in range(MAX_LATEX_RUNS):
+            if run:
+                with self._lock:
+                    self.reruns += 1
+            try:
+                output = subprocess.check_output(command, stderr=subprocess.STDOUT, cwd=work_dir)
+            except subprocess.CalledProcessError as e:
+                print(e.output.decode(errors='replace'))
+                raise
+            if not any(marker in output for marker in LATEX_RERUN_MARKERS):
+                break
+        shutil.copyfile(os.path.join(work_dir, job_name + '.pdf'), os.path.abspath(filename) + '.pdf')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'compiles': self.compiles,
+                'compile_seconds': self.compile_seconds,
+                'reruns': self.reruns,
+                'format_builds': self.format_builds,
+                'format_seconds': self.format_seconds,
+                'batched_journals': self.batched_journals,
+            }
+
+
+class JournalBatch:
+    """Compiles several single-page journals in one LaTeX run.
+
+    compile() only queues a journal; flush() typesets the queued journals
+    with the same preamble as consecutive pages of one document (each
+    page's form field names prefixed with its page number, since field
+    names are document-wide), then splits the PDF into one file per
+    journal with pikepdf, renames the fields back and calls each
+    journal's finalize(pdf_path). If the combined compile fails, or a
+    journal doesn't fit on one page, those journals are compiled one by
+    one instead so each gets its own result."""
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.pending = []
+
+    def compile(self, doc, filename, finalize=None):
+        self.pending.append((doc.dumps(), filename, finalize))
+
+    def flush(self):
+        """Compile everything queued; returns {filename: error message}
+        for the journals that failed."""
+        import pikepdf
+        pending, self.pending = self.pending, []
+        groups = []
+        for source, filename, finalize in pending:
+            preamble, _, body = source.partition(BEGIN_DOCUMENT)
+            if groups and groups[-1][0] == preamble:
+                groups[-1][1].append((source, filename, finalize))
+            else:
+                groups.append((preamble, [(source, filename, finalize)]))
+
+        errors = {}
+        for preamble, journals in groups:
+            if len(journals) > 1:
+                try:
+                    self._compile_combined(preamble, journals)
+                    continue
+                except (ValueError, subprocess.CalledProcessError, pikepdf.PdfError) as e:
+                    print(f'Warning! Combined compile of {len(journals)} journals failed, compiling them one by one: {e}')
+            for source, filename, finalize in journals:
+                try:
+                    self.builder.compile_source(source, filename)
+                    if finalize is not None:
+                        finalize(filename + '.pdf')
+                except Exception as e:
+                    errors[filename] = str(e)
+        return errors
+
+    @staticmethod
+    def _page_prefix(index):
+        # Fixed width, so no page's prefix is the start of another's
+        return f'j{index:04d}'
+
+    def _compile_combined(self, preamble, journals):
+        import pikepdf
+        pages = []
+        for index, (source, _, _) in enumerate(journals):
+            page = source.partition(BEGIN_DOCUMENT)[2].rpartition(END_DOCUMENT)[0]
+            for command in FORM_FIELD_COMMANDS:
+                page = page.replace(command, command + self._page_prefix(index))
+            pages.append(page)
+        combined_path = os.path.join(self.builder.build_dir, f'journals-{_worker_id()}')
+        os.makedirs(self.builder.build_dir, exist_ok=True)
+        self.builder.compile_source(
+            preamble + BEGIN_DOCUMENT + '\n\\clearpage\n'.join(pages) + END_DOCUMENT + '\n', combined_path)
+
+        with pikepdf.open(combined_path + '.pdf') as combined:
+            if len(combined.pages) != len(journals):
+                raise ValueError(f'{len(journals)} journals took {len(combined.pages)} pages')
+            for index, (_, filename, _) in enumerate(journals):
+                self._write_page(combined, index, filename + '.pdf')
+        os.remove(combined_path + '.pdf')
+        with self.builder._lock:
+            self.builder.batched_journals += len(journals)
+
+        for _, filename, finalize in journals:
+            if finalize is not None:
+                finalize(filename + '.pdf')
+
+    def _write_page(self, combined, index, pdf_path):
+        import pikepdf
+        prefix = self._page_prefix(index)
+        pdf = pikepdf.new()
+        pdf.pages.append(combined.pages[index])
+        # Everything of the combined form but its fields (e.g. its
+        # default appearance and fonts)
+        acroform = pdf.copy_foreign(combined.make_indirect(pikepdf.Dictionary({
+            key: value for key, value in combined.Root.AcroForm.items() if key != '/Fields'
+        })))
+        fields = pikepdf.Array()
+        for annotation in pdf.pages[0].get('/Annots', []):
+            name = str(annotation.get('/T', ''))
+            if '/FT' in annotation and name.startswith(prefix):
+                annotation.T = pikepdf.String(name[len(prefix):])
+                fields.append(annotation)
+        acroform.Fields = fields
+        pdf.Root.AcroForm = acroform
+        pdf.save(pdf_path)
+        pdf.close()
+
+
+@lru_cache(maxsize=None)
+def latex_builder(mode='precompiled', build_dir=None):
+    """LaTeX builder for the given settings, built once per process."""
+    return LatexBuilder(mode, build_dir)
+
+
+def latex_builder_from_settings(settings):
+    return latex_builder(settings.get('latex_compile') or 'precompiled', settings.get('latex_build_dir'))
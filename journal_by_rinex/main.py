@@ -1,68 +1,48 @@
 #!/usr/bin/env python3
 
 import os
-import fnmatch
-import glob
-import random
+import queue
+import threading
+import time
 import tkinter as tk
 from datetime import datetime
 from importlib.metadata import version, PackageNotFoundError
 from tkinter import filedialog, messagebox, ttk
-import pypandoc
 import yaml
-from journal_by_rinex.functions import get_info, journal_generator
-
-RINEX_OBS_PATTERNS = ('*.??o', '*.??O')
+from journal_by_rinex.filelist import VirtualFileList
+from journal_by_rinex.batch import (
+    MEASUREMENT_OPTIONS, SAVE_MODES, DEFAULT_DOP_MIN, DEFAULT_DOP_MAX,
+    scan_rinex_files, read_config_file, parse_dop_range, validate_file_rules,
+    BATCH_OPTION_DEFAULTS, file_matches_rule, convert_tex_to_docx, batch_options_from_config,
+    run_batch, write_processed_config,
+)
 
 try:
     APP_VERSION = version("journal_by_rinex")
 except PackageNotFoundError:
     APP_VERSION = "dev"
 
-MEASUREMENT_OPTIONS = [
-    "No tripod, to base",
-    "No tripod, to phase center",
-    "Tripod, slant",
-    "Tripod, to base",
-    "Tripod, to phase center",
-    "Not specified",
-]
-
-SAVE_MODES = ('custom', 'source')
-
-# Default randomization range for GDOP/PDOP
-DEFAULT_DOP_MIN = '1.5'
-DEFAULT_DOP_MAX = '2.0'
-
 # Default config file(s), loaded automatically on startup if present
 DEFAULT_CONFIG_FILES = ('config.yaml', 'config.yml')
 
-# Maps config/metadata field names to the corresponding file_info key
-FIELD_TO_INFO_KEY = {
-    'organization': 'organization',
-    'object': 'object',
-    'operator': 'operator',
-    'geodetic_mark_type': 'centre type',
-    'benchmark_type': 'benchmark type',
-    'gdop': 'gdop',
-    'pdop': 'pdop',
-}
-
-ANTENNA_HEIGHT_TYPES = {
-    'No tripod, to base': 'base',
-    'No tripod, to phase center': 'phase',
-    'Tripod, slant': 'tripod_slant',
-    'Tripod, to base': 'tripod_base',
-    'Tripod, to phase center': 'tripod_phase',
-    'Not specified': None,
-}
+# How often the window picks up the progress of a running batch, and
+# the files found so far by a running folder scan, in ms
+PROGRESS_POLL_MS = 100
 
 class FileProcessorApp:
     def __init__(self, root):
         self.root = root
         self.root.title("GNSS Observation Journal from RINEX Data")
         self.files = []
+        # The same files as a set, for constant-time duplicate checks
+        self._file_set = set()
         self.save_path = ""
+        # Background thread of the running batch, if any
+        self._worker = None
+        # Whether a folder search is still adding files
+        self._scanning = False
+        # Whether the window closes once the running batch has stopped
+        self._closing = False
 
         # Text parameter variables
         self.organization = tk.StringVar(value='Enter organization name')
@@ -91,6 +71,10 @@ class FileProcessorApp:
         # Per-file metadata overrides loaded from config file_rules (see apply_config)
         self.file_rules = []
 
+        # Settings without GUI controls, only set via config files (e.g.
+        # parallel workers, random seed - see BATCH_OPTION_DEFAULTS)
+        self.batch_options = dict(BATCH_OPTION_DEFAULTS)
+
         # When enabled, a YAML config with the resolved parameters of every
         # processed file is saved after processing (see save_processed_config)
         self.save_yaml = tk.BooleanVar(value=False)
@@ -168,8 +152,9 @@ class FileProcessorApp:
         # Selected files list
         self.files_list_label = tk.Label(self.root, text="Selected files:")
         self.files_list_label.grid(row=11, column=0, columnspan=1, pady=(10, 0))
-        self.files_list_text = tk.Text(self.root, height=5, width=50, state='disabled')
-        self.files_list_text.grid(row=12, column=0, columnspan=2, pady=5)
+        self.files_list_view = VirtualFileList(self.root, height=5, width=50)
+        self.files_list_view.grid(row=12, column=0, columnspan=2, pady=5)
+        self.files_list_view.set_items(self.files)
 
         # Save path display
         self.save_path_label = tk.Label(self.root, text="Save path:")
@@ -191,13 +176,18 @@ class FileProcessorApp:
         self.process_button = tk.Button(self.root, text="Process files", command=self.process_files)
         self.process_button.grid(row=15, column=0, columnspan=1, pady=10)
 
+        # Cancel button, only enabled while a batch is running
+        self.cancel_button = tk.Button(self.root, text="Cancel", command=self.cancel_processing, state='disabled')
+        self.cancel_button.grid(row=15, column=1, pady=5)
+
         # Reset button
         self.reset_button = tk.Button(self.root, text="Reset", command=self.reset)
-        self.reset_button.grid(row=15, column=1, pady=5)
+        self.reset_button.grid(row=15, column=2, pady=5)
 
         # Close button
-        self.close_button = tk.Button(self.root, text="Close", command=self.root.destroy)
-        self.close_button.grid(row=15, column=2, columnspan=2, pady=5)
+        self.close_button = tk.Button(self.root, text="Close", command=self.close)
+        self.close_button.grid(row=15, column=3, pady=5)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
 
         # Version label at the bottom of the window
         version_label = tk.Label(
@@ -269,30 +259,73 @@ class FileProcessorApp:
     def add_files(self):
         # Open the file selection dialog
         new_files = filedialog.askopenfilenames(title="Select files", filetypes=(("All files", "*.*"),))
-        for file in new_files:
-            if file not in self.files:
-                self.files.append(file)
+        self._add_to_files(new_files)
         self.update_files_list()
 
+    def _add_to_files(self, files):
+        # Returns how many of `files` were new
+        added = 0
+        for file in files:
+            if file not in self._file_set:
+                self._file_set.add(file)
+                self.files.append(file)
+                added += 1
+        return added
+
+    def _set_files(self, files):
+        self.files = list(files)
+        self._file_set = set(self.files)
+        self.files_list_view.set_items(self.files)
+
     def add_folder_recursive(self):
-        # Recursively search for RINEX files (*.??o / *.??O) in the selected folder
+        # Recursively search the selected folder for RINEX files (*.??o,
+        # Hatanaka *.??d / *.crx, and any of those as .gz/.Z/.zip; see
+        # scan_rinex_files()) on a background thread; the files found are
+        # added to the list as they come in
         folder = filedialog.askdirectory(title="Select folder to search for RINEX files")
         if not folder:
             return
 
-        found_files = []
-        for dirpath, _, filenames in os.walk(folder):
-            for filename in filenames:
-                if any(fnmatch.fnmatch(filename, pattern) for pattern in RINEX_OBS_PATTERNS):
-                    found_files.append(os.path.join(dirpath, filename))
+        self._scanning = True
+        self.add_folder_button.config(state='disabled')
+        scan_queue = queue.Queue()
+        threading.Thread(target=self._scan_worker, args=(folder, scan_queue), daemon=True).start()
+        self._poll_scan(scan_queue, 0, 0)
 
-        new_files = [f for f in found_files if f not in self.files]
-        self.files.extend(new_files)
+    @staticmethod
+    def _scan_worker(folder, scan_queue):
+        # Runs on the scan thread: posts each folder's files, then None
+        for files in scan_rinex_files(folder):
+            scan_queue.put(files)
+        scan_queue.put(None)
+
+    def _poll_scan(self, scan_queue, found, added):
+        done = False
+        while not done:
+            try:
+                files = scan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if files is None:
+                done = True
+            else:
+                found += len(files)
+                added += self._add_to_files(sorted(files))
         self.update_files_list()
+        if not done:
+            # (the progress line shows the batch's progress while one runs)
+            if self._worker is None:
+                self.progress_label.config(text=f"Searching... {found} file(s) found")
+            self.root.after(PROGRESS_POLL_MS, self._poll_scan, scan_queue, found, added)
+            return
 
+        self._scanning = False
+        if self._worker is None:
+            self.progress_label.config(text="")
+            self.add_folder_button.config(state='normal')
         messagebox.showinfo(
             "Search complete",
-            f"Files found: {len(found_files)}\nNew files added: {len(new_files)}"
+            f"Files found: {found}\nNew files added: {added}"
         )
 
     def select_save_path(self):
@@ -341,8 +374,7 @@ class FileProcessorApp:
 
     @staticmethod
     def read_config_file(config_file):
-        with open(config_file, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f) or {}
+        return read_config_file(config_file)
 
     def apply_config(self, config):
         string_var_map = {
@@ -397,39 +429,31 @@ class FileProcessorApp:
 
         file_rules = config.get('file_rules')
         if file_rules is not None:
-            if isinstance(file_rules, list) and all(
-                isinstance(rule, dict) and 'pattern' in rule for rule in file_rules
-            ):
-                self.file_rules = file_rules
-            else:
-                messagebox.showwarning(
-                    "Invalid config value",
-                    "file_rules must be a list of mappings, each with a 'pattern' key."
-                )
+            try:
+                self.file_rules = validate_file_rules(file_rules)
+            except ValueError as e:
+                messagebox.showwarning("Invalid config value", str(e))
         self.update_file_rules_label()
 
+        try:
+            self.batch_options.update(batch_options_from_config(config))
+        except ValueError as e:
+            messagebox.showwarning("Invalid config value", str(e))
+
     def update_file_rules_label(self):
         self.file_rules_label.config(text=f"Per-file rules: {len(self.file_rules)} loaded")
 
     @staticmethod
     def parse_dop_range(min_str, max_str, label):
         try:
-            lo = float(min_str)
-            hi = float(max_str)
-        except ValueError:
-            messagebox.showerror("Invalid range", f"{label} min/max must be numbers.")
+            return parse_dop_range(min_str, max_str, label)
+        except ValueError as e:
+            messagebox.showerror("Invalid range", str(e))
             return None
-        if lo > hi:
-            lo, hi = hi, lo
-        return lo, hi
 
     @staticmethod
     def file_matches_rule(file_path, pattern):
-        # Match against the file's basename, or its full path (with forward
-        # slashes) for patterns that include a directory part.
-        basename = os.path.basename(file_path)
-        normalized_path = os.path.abspath(file_path).replace(os.sep, '/')
-        return fnmatch.fnmatch(basename, pattern) or fnmatch.fnmatch(normalized_path, pattern)
+        return file_matches_rule(file_path, pattern)
 
     def save_config(self):
         # Save the current form values to a YAML config file for later reuse
@@ -460,6 +484,10 @@ class FileProcessorApp:
         }
         if self.save_mode.get() == 'custom' and self.save_path:
             config['save_path'] = self.save_path
+        config.update({
+            key: value for key, value in self.batch_options.items()
+            if value != BATCH_OPTION_DEFAULTS[key]
+        })
         if self.file_rules:
             config['file_rules'] = self.file_rules
 
@@ -487,19 +515,8 @@ class FileProcessorApp:
         if not config_file:
             return
 
-        config = {
-            'file_rules': [
-                {
-                    'pattern': glob.escape(os.path.abspath(file)).replace(os.sep, '/'),
-                    **metadata,
-                }
-                for file, metadata in processed_records
-            ]
-        }
-
         try:
-            with open(config_file, 'w', encoding='utf-8') as f:
-                yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+            write_processed_config(config_file, processed_records)
         except OSError as e:
             messagebox.showerror("Config Error", f"Could not save processed files config: {e}")
             return
@@ -512,12 +529,10 @@ class FileProcessorApp:
         )
 
     def update_files_list(self):
-        # Refresh the file list in the interface
-        self.files_list_text.config(state='normal')
-        self.files_list_text.delete(1.0, tk.END)
-        for file in self.files:
-            self.files_list_text.insert(tk.END, file + "\n")
-        self.files_list_text.config(state='disabled')
+        # Refresh the file list in the interface (only the rows in view
+        # are drawn, however long the list is)
+        self.files_list_label.config(text=f"Selected files ({len(self.files)}):" if self.files else "Selected files:")
+        self.files_list_view.refresh()
 
     def update_save_path(self):
         # Refresh the save path field in the interface
@@ -527,14 +542,7 @@ class FileProcessorApp:
         self.save_path_text.config(state='disabled')
 
     def convert_tex_to_docx(self, tex_file_path, output_dir):
-        # Define the output .docx file path
-        docx_file_path = os.path.join(output_dir, os.path.splitext(os.path.basename(tex_file_path))[0]+'.docx')
-
-        try:
-            # Convert .tex to .docx using pypandoc
-            pypandoc.convert_file(tex_file_path, 'docx', outputfile=docx_file_path)
-        except Exception as e:
-            print(f"Error converting {tex_file_path} to docx: {e}")
+        convert_tex_to_docx(tex_file_path, output_dir)
 
     def process_files(self):
         if not self.files:
@@ -568,93 +576,178 @@ class FileProcessorApp:
             'measurement_type': self.measurement_type.get(),
         }
 
-        processed_records = []
-
-        failed_files = []
+        settings = {
+            'base_metadata': base_metadata,
+            'gdop_range': gdop_range,
+            'pdop_range': pdop_range,
+            'file_rules': self.file_rules,
+            'save_mode': self.save_mode.get(),
+            'save_path': self.save_path,
+            **self.batch_options,
+        }
 
         total_files = len(self.files)
         self.progress_bar['maximum'] = total_files
         self.progress_var.set(0)
-        self.process_button.config(state='disabled')
+        # Files added now would not be part of this batch
+        for button in (self.process_button, self.reset_button, self.add_files_button, self.add_folder_button):
+            button.config(state='disabled')
+        self.cancel_button.config(state='normal')
+        self.progress_label.config(text=f"Processing {total_files} file(s)...")
+
+        # The batch runs on a background thread, so the window stays
+        # responsive during long compiles and downloads; it only ever
+        # touches Tk through this queue, which _poll_progress() drains
+        self._events = queue.Queue()
+        self._cancel = threading.Event()
+        self._batch_start = time.perf_counter()
+        self._done_files = 0
+        self._total_files = total_files
+        self._batch_files = set(self.files)
+        self._worker = threading.Thread(
+            target=self._run_batch_worker, args=(list(self.files), settings), daemon=True,
+        )
+        self._worker.start()
+        self.root.after(PROGRESS_POLL_MS, self._poll_progress)
 
-        for index, file in enumerate(self.files, start=1):
-            self.progress_label.config(text=f"Processing {index}/{total_files}: {os.path.basename(file)}")
-            self.root.update_idletasks()
+    def _run_batch_worker(self, files, settings):
+        # Background thread: never touches Tk, only posts events
+        def on_result(file, file_metadata, error, seconds):
+            self._events.put(('result', file, error))
+
+        try:
+            summary = run_batch(files, settings, on_result=on_result, cancel=self._cancel)
+        except Exception as e:
+            self._events.put(('error', e))
+        else:
+            self._events.put(('done', summary))
+
+    def _poll_progress(self):
+        while True:
             try:
-                file_info = get_info(file)
-
-                # Start from the global form values, draw fresh random
-                # GDOP/PDOP for this file if enabled, then let any matching
-                # file_rules override individual fields for this specific file
-                file_metadata = dict(base_metadata)
-                if gdop_range is not None:
-                    file_metadata['gdop'] = f'{random.uniform(*gdop_range):.2f}'
-                if pdop_range is not None:
-                    file_metadata['pdop'] = f'{random.uniform(*pdop_range):.2f}'
-                for rule in self.file_rules:
-                    if self.file_matches_rule(file, rule['pattern']):
-                        file_metadata.update({k: v for k, v in rule.items() if k != 'pattern'})
-
-                measurement_type = file_metadata['measurement_type']
-                if measurement_type not in ANTENNA_HEIGHT_TYPES:
-                    raise ValueError(f"Unknown measurement_type {measurement_type!r}")
-                file_info['antenna height type'] = ANTENNA_HEIGHT_TYPES[measurement_type]
-
-                for field_key, info_key in FIELD_TO_INFO_KEY.items():
-                    file_info[info_key] = file_metadata.get(field_key, '')
-
-                if self.save_mode.get() == "source":
-                    output_dir = os.path.dirname(os.path.abspath(file))
+                event = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == 'result':
+                _, file, error = event
+                self._done_files += 1
+                if error is not None:
+                    print(f'Error processing {file}: {error}')
+                self.progress_var.set(self._done_files)
+                if self._cancel.is_set():
+                    self.progress_label.config(
+                        text=f"Cancelling after the current stage... ({self._done_files}/{self._total_files} processed)")
                 else:
-                    output_dir = self.save_path
-
-                marker_name = file_info['marker name'].strip()
-                if not marker_name:
-                    # MARKER NAME is blank in the RINEX header; fall back to
-                    # the source file's own name so output isn't silently
-                    # lost/broken, and keep file_info consistent so the map
-                    # image and the journal itself use the same name
-                    marker_name = os.path.splitext(os.path.basename(file))[0]
-                    print(f'Warning! Empty MARKER NAME in {file}, using source filename "{marker_name}" instead.')
-                file_info['marker name'] = marker_name
-
-                save_file = os.path.join(output_dir, marker_name)
-                journal_generator(file_info, save_file)
-                self.convert_tex_to_docx(save_file + '.tex', output_dir)
-
-                processed_records.append((file, file_metadata))
-            except Exception as e:
-                print(f'Error processing {file}: {e}')
-                failed_files.append((file, str(e)))
-
-            self.progress_var.set(index)
-            self.root.update_idletasks()
-
+                    self.progress_label.config(
+                        text=f"Processed {self._done_files}/{self._total_files}: {os.path.basename(file)}"
+                             f"{self._throughput_text()}")
+            elif event[0] == 'error':
+                self._finish_processing()
+                if self._closing:
+                    return
+                messagebox.showerror("Processing Error", f"Batch processing failed: {event[1]}")
+                return
+            else:
+                self._finish_processing()
+                if not self._closing:
+                    self._show_summary(event[1])
+                return
+        self.root.after(PROGRESS_POLL_MS, self._poll_progress)
+
+    def _throughput_text(self):
+        elapsed = time.perf_counter() - self._batch_start
+        if elapsed <= 0 or not self._done_files:
+            return ""
+        rate = self._done_files / elapsed
+        remaining = round((self._total_files - self._done_files) / rate)
+        return f" — {rate:.2f} files/s, ETA {remaining // 60}:{remaining % 60:02d}"
+
+    def cancel_processing(self):
+        # Picked up by the batch between stages (see run_batch())
+        self._cancel.set()
+        self.cancel_button.config(state='disabled')
+        self.progress_label.config(text="Cancelling after the current stage...")
+
+    def _finish_processing(self):
+        self._worker = None
         self.progress_label.config(text="")
         self.process_button.config(state='normal')
+        self.reset_button.config(state='normal')
+        self.add_files_button.config(state='normal')
+        if not self._scanning:
+            self.add_folder_button.config(state='normal')
+        self.cancel_button.config(state='disabled')
+
+    def _show_summary(self, summary):
+        processed_records = summary['processed']
+        failed_files = summary['failed']
+        cancelled_files = summary['cancelled']
+        duplicates = ""
+        if summary['duplicates']:
+            duplicates = f"\n{len(summary['duplicates'])} duplicate file(s) were processed only once:\n" + "\n".join(
+                f"- {duplicate} (same as {first_copy})" for duplicate, first_copy in summary['duplicates']
+            )
 
-        if failed_files:
+        if cancelled_files:
+            messagebox.showinfo(
+                "Processing cancelled",
+                f"Processed {len(processed_records)} file(s) successfully, "
+                f"{len(failed_files)} failed and {len(cancelled_files)} were not processed." + duplicates
+            )
+        elif failed_files:
             failure_list = "\n".join(f"- {os.path.basename(f)}: {err}" for f, err in failed_files)
             messagebox.showwarning(
                 "Processing complete with errors",
                 f"Processed {len(processed_records)} file(s) successfully.\n"
-                f"{len(failed_files)} file(s) failed:\n{failure_list}"
+                f"{len(failed_files)} file(s) failed:\n{failure_list}" + duplicates
             )
         else:
-            messagebox.showinfo("Processing complete", "Files were successfully processed and saved.")
+            skipped = summary['build'].get('skipped', 0)
+            messagebox.showinfo(
+                "Processing complete",
+                "Files were successfully processed and saved."
+                + (f"\n{skipped} journal(s) were already up to date and not rebuilt." if skipped else "")
+                + duplicates
+            )
 
         if self.save_yaml.get() and processed_records:
             self.save_processed_config(processed_records)
 
-        self.files.clear()
+        # Files a folder search added while the batch ran weren't part of
+        # it, so they stay in the list, as do the files that still need
+        # processing after a cancel
+        added_later = [file for file in self.files if file not in self._batch_files]
+        if cancelled_files:
+            self._set_files(cancelled_files + added_later)
+        else:
+            self._set_files(added_later)
+            self.save_path = ""
+            self.update_save_path()
         self.update_files_list()
-        self.save_path = ""
-        self.update_save_path()
         self.progress_var.set(0)
 
+    def close(self):
+        if self._worker is None:
+            self.root.destroy()
+        elif not self._closing:
+            # Destroying Tk under a running batch would kill it mid-file
+            # (and its LaTeX and worker processes with it), so the batch is
+            # cancelled and the window closes once it has stopped
+            self._closing = True
+            if not self._cancel.is_set():
+                self.cancel_processing()
+            self.progress_label.config(text="Closing after the current stage...")
+            self.root.after(PROGRESS_POLL_MS, self._close_when_stopped)
+
+    def _close_when_stopped(self):
+        if self._worker is not None and self._worker.is_alive():
+            self.root.after(PROGRESS_POLL_MS, self._close_when_stopped)
+        else:
+            self.root.destroy()
+
     def reset(self):
         # Reset the file list and save path
-        self.files = []
+        self._set_files([])
         self.save_path = ""
         self.update_files_list()
         self.update_save_path()
@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+from functools import lru_cache
+from importlib.metadata import version, PackageNotFoundError
+
+# Kept in every output folder, one small JSON entry per source file
+MANIFEST_DIR = '.journal_by_rinex'
+
+# Bumped whenever the entries' layout changes, so older entries are
+# simply treated as stale
+MANIFEST_VERSION = 1
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@lru_cache(maxsize=None)
+def package_fingerprint():
+    """The installed version plus a digest of the package's code and
+    template assets (the antenna images), computed once per process: a
+    journal built by another version, or from edited code or images in
+    a development checkout, is out of date."""
+    try:
+        package_version = version('journal_by_rinex')
+    except PackageNotFoundError:
+        package_version = 'dev'
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(PACKAGE_DIR):
+        dirnames[:] = sorted(name for name in dirnames if name != '__pycache__')
+        for filename in sorted(filenames):
+            if filename.endswith(('.py', '.png')):
+                path = os.path.join(dirpath, filename)
+                digest.update(os.path.relpath(path, PACKAGE_DIR).encode('utf-8') + b'\0')
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return f'{package_version}:{digest.hexdigest()[:16]}'
+
+
+def build_key(file, file_metadata, options):
+    """Everything a journal is built from: the source RINEX file (its
+    path, size and modification time, rather than hashing its content),
+    the resolved file_metadata, the settings that change the output and
+    the package itself."""
+    stat = os.stat(file)
+    key = json.dumps({
+        'source': [os.path.abspath(file).replace(os.sep, '/'), stat.st_size, stat.st_mtime_ns],
+        'metadata': file_metadata,
+        'options': options,
+        'package': package_fingerprint(),
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class BuildManifest:
+    """What was last built from each source file, stored in each output
+    folder as <output_dir>/.journal_by_rinex/<source hash>.json: the
+    build_key() it was built with and the size and modification time of
+    every output written. A journal is current while its key matches and
+    its outputs are still the ones recorded, so deleting, editing or
+    overwriting one (e.g. by another source with the same marker name)
+    rebuilds it. One file per source means worker processes never
+    rewrite each other's entries."""
+
+    def __init__(self):
+        self.skipped = 0
+        self.built = 0
+
+    @staticmethod
+    def _path(output_dir, file):
+        source = os.path.abspath(file).replace(os.sep, '/')
+        name = hashlib.sha256(source.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(output_dir, MANIFEST_DIR, f'{name}.json')
+
+    @staticmethod
+    def _outputs(output_dir, names):
+        # {name: [size, mtime] or None if it's missing}
+        outputs = {}
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(output_dir, name))
+            except OSError:
+                outputs[name] = None
+            else:
+                outputs[name] = [stat.st_size, stat.st_mtime_ns]
+        return outputs
+
+    def _read(self, output_dir, file):
+        try:
+            with open(self._path(output_dir, file), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if isinstance(entry, dict) and entry.get('version') == MANIFEST_VERSION else None
+
+    def _write(self, output_dir, file, entry):
+        path = self._path(output_dir, file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name first, so a concurrent reader
+        # never sees a partial entry
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def is_current(self, output_dir, file, key):
+        """True (and counted as skipped) if the outputs last built from
+        `file` with this key are all still in place, unchanged."""
+        entry = self._read(output_dir, file)
+        if entry is None or entry.get('key') != key:
+            return False
+        outputs = entry.get('outputs') or {}
+        if not outputs or None in outputs.values() or self._outputs(output_dir, outputs) != outputs:
+            return False
+        self.skipped += 1
+        return True
+
+    def record(self, output_dir, file, key, names, built=True):
+        """Note that `file` was just built with this key into the
+        outputs `names` (file names in output_dir); built=False for
+        outputs copied from another source's build, which aren't counted."""
+        self._write(output_dir, file, {
+            'version': MANIFEST_VERSION,
+            'source': os.path.abspath(file),
+            'key': key,
+            'outputs': self._outputs(output_dir, names),
+        })
+        if built:
+            self.built += 1
+
+    def outputs(self, output_dir, file):
+        """Names of the outputs last built from `file` into output_dir."""
+        entry = self._read(output_dir, file)
+        return list(entry['outputs']) if entry is not None else []
+
+    def refresh(self, output_dir, file):
+        """Re-read the recorded outputs' sizes and times after they were
+        rewritten, e.g. once a JournalBatch compiled the PDF."""
+        entry = self._read(output_dir, file)
+        if entry is not None:
+            entry['outputs'] = self._outputs(output_dir, entry['outputs'])
+            self._write(output_dir, file, entry)
+
+    def forget(self, output_dir, file):
+        try:
+            os.remove(self._path(output_dir, file))
+        except OSError:
+            pass
+
+    def stats(self):
+        return {'skipped': self.skipped, 'built': self.built}
+
+
+@lru_cache(maxsize=None)
+def build_manifest():
+    """The build manifest of this process."""
+    return BuildManifest()
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from functools import lru_cache
+from journal_by_rinex.tiles import user_cache_dir
+
+DEFAULT_MAP_CACHE_MAX_MB = 500
+DEFAULT_MAP_CACHE_MAX_AGE_DAYS = 30
+
+# Station coordinates are rounded to this many decimal degrees (about
+# 0.1 m) for the cache key, far below what the rendered map can show
+MAP_CACHE_PRECISION = 6
+
+
+def default_map_cache_dir():
+    return os.path.join(user_cache_dir(), 'maps')
+
+
+def map_key(longitude, latitude, marker_name, zoom, extent, style):
+    """Content address of a rendered location map: everything that
+    changes what get_map() draws, apart from the tile provider (which
+    MapCache keeps in its own subdirectory)."""
+    key = json.dumps([
+        round(float(longitude), MAP_CACHE_PRECISION),
+        round(float(latitude), MAP_CACHE_PRECISION),
+        marker_name, zoom, list(extent), style,
+    ], ensure_ascii=False)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class MapCache:
+    """Rendered location maps stored as <directory>/<provider>/<key>.png.
+    Maps unused for longer than max_age_seconds (if not None) are dropped,
+    and once the cache grows past max_bytes the least recently used ones
+    go first. clear() drops every map, or just those drawn from one
+    provider."""
+
+    def __init__(self, directory, max_bytes, max_age_seconds):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._evict()
+
+    def _path(self, provider, key):
+        return os.path.join(self.directory, provider, f'{key}.png')
+
+    def get(self, provider, key, destination):
+        """Copy the cached map to `destination`; returns False on a miss."""
+        path = self._path(provider, key)
+        try:
+            shutil.copyfile(path, destination)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        try:
+            # Mark as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return True
+
+    def put(self, provider, key, source):
+        path = self._path(provider, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Copied under a temporary name first, so a concurrent reader
+        # never sees a partially written map
+        temp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, path)
+        self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def _evict(self):
+        if self.max_age_seconds is None:
+            oldest_allowed = float('-inf')
+        else:
+            oldest_allowed = time.time() - self.max_age_seconds
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+        for path, mtime, size in entries:
+            if self._size <= self.max_bytes and mtime >= oldest_allowed:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            self.evictions += 1
+
+    def clear(self, provider=None):
+        shutil.rmtree(self.directory if provider is None else os.path.join(self.directory, provider), ignore_errors=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+@lru_cache(maxsize=None)
+def map_cache(cache_dir=None, max_mb=DEFAULT_MAP_CACHE_MAX_MB, max_age_days=DEFAULT_MAP_CACHE_MAX_AGE_DAYS):
+    """Map cache for the given settings, built once per process; None if
+    disabled with max_mb = 0. max_age_days = 0 keeps maps however long
+    they go unused."""
+    if not max_mb:
+        return None
+    return MapCache(
+        cache_dir or default_map_cache_dir(), max_mb * 1024 * 1024,
+        max_age_days * 24 * 3600 if max_age_days else None,
+    )
+
+
+def map_cache_from_settings(settings):
+    return map_cache(
+        settings.get('map_cache_dir'),
+        settings.get('map_cache_max_mb', DEFAULT_MAP_CACHE_MAX_MB),
+        settings.get('map_cache_max_age_days', DEFAULT_MAP_CACHE_MAX_AGE_DAYS),
+    )
@@ -0,0 +1,103 @@
+import io
+import math
+import os
+import importlib.util
+from journal_by_rinex.tiles import MISSING_TILE_COLOR
+
+# Location map renderers: 'fast' stitches the tiles into the output image
+# directly, 'cartopy' draws get_map()'s matplotlib figure
+MAP_RENDERERS = ('fast', 'cartopy')
+
+# Width of the fast renderer's map in pixels: 0.6\textwidth of the
+# journal page at 300 dpi
+DEFAULT_MAP_WIDTH_PX = 1200
+
+TILE_SIZE = 256
+
+# The cartopy map is about 837 pt wide (the 15-inch figure's axes), so
+# marker and label sizes given in points there are scaled by
+# width / CARTOPY_MAP_WIDTH_PT to look the same on the fast map
+CARTOPY_MAP_WIDTH_PT = 837
+MARKER_SIZE_PT = 20
+MARKER_EDGE_PT = 1.5
+LABEL_OFFSET_PT = 20
+LABEL_FONT_PT = 14
+LABEL_PAD = 0.3
+
+# Bundled with matplotlib (in its mpl-data), and covers Cyrillic marker names
+LABEL_FONT_FILE = os.path.join('mpl-data', 'fonts', 'ttf', 'DejaVuSans.ttf')
+
+
+def _mercator_pixel(longitude, latitude, zoom):
+    """Global Web Mercator pixel coordinates at a zoom level."""
+    world = TILE_SIZE * (1 << zoom)
+    x = (longitude + 180) / 360 * world
+    phi = math.radians(latitude)
+    y = (1 - math.log(math.tan(phi) + 1 / math.cos(phi)) / math.pi) / 2 * world
+    return x, y
+
+
+def _label_font(size):
+    from PIL import ImageFont
+    # Located without importing matplotlib, which the fast renderer
+    # doesn't otherwise need
+    spec = importlib.util.find_spec('matplotlib')
+    try:
+        if spec is None or spec.origin is None:
+            raise OSError('matplotlib not found')
+        return ImageFont.truetype(os.path.join(os.path.dirname(spec.origin), LABEL_FONT_FILE), size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def render_map(longitude, latitude, marker_name, tiles, zoom, extent, width=DEFAULT_MAP_WIDTH_PX):
+    """Location map as a PIL image `width` pixels wide: the tiles of
+    `tiles` covering longitude +- extent[0], latitude +- extent[1] at
+    `zoom`, stitched and resampled once, with get_map()'s marker and
+    label drawn on top. The height follows from the extent."""
+    from PIL import Image, ImageDraw
+    west, north = _mercator_pixel(longitude - extent[0], latitude + extent[1], zoom)
+    east, south = _mercator_pixel(longitude + extent[0], latitude - extent[1], zoom)
+    height = max(round(width * (south - north) / (east - west)), 1)
+
+    first_x, first_y = int(west // TILE_SIZE), int(north // TILE_SIZE)
+    last_x, last_y = int(east // TILE_SIZE), int(south // TILE_SIZE)
+    mosaic = Image.new('RGB', ((last_x - first_x + 1) * TILE_SIZE, (last_y - first_y + 1) * TILE_SIZE), MISSING_TILE_COLOR)
+    for x in range(first_x, last_x + 1):
+        for y in range(first_y, last_y + 1):
+            data = tiles.get_tile(zoom, x, y)
+            if data is None:
+                continue
+            tile = Image.open(io.BytesIO(data)).convert('RGB')
+            if tile.size != (TILE_SIZE, TILE_SIZE):
+                tile = tile.resize((TILE_SIZE, TILE_SIZE), Image.LANCZOS)
+            mosaic.paste(tile, ((x - first_x) * TILE_SIZE, (y - first_y) * TILE_SIZE))
+
+    left, top = first_x * TILE_SIZE, first_y * TILE_SIZE
+    image = mosaic.resize(
+        (width, height), Image.LANCZOS,
+        box=(west - left, north - top, east - left, south - top),
+    )
+
+    point = width / CARTOPY_MAP_WIDTH_PT
+    draw = ImageDraw.Draw(image)
+    station_x, station_y = _mercator_pixel(longitude, latitude, zoom)
+    mx = (station_x - west) * width / (east - west)
+    my = (station_y - north) * height / (south - north)
+
+    half = MARKER_SIZE_PT * point / 2
+    draw.polygon(
+        [(mx, my - half), (mx - half, my + half), (mx + half, my + half)],
+        fill='red', outline='white', width=max(round(MARKER_EDGE_PT * point), 1),
+    )
+
+    font = _label_font(max(round(LABEL_FONT_PT * point), 1))
+    text_x = mx + LABEL_OFFSET_PT * point
+    text_y = my - LABEL_OFFSET_PT * point
+    left, top, right, bottom = draw.textbbox((text_x, text_y), marker_name, font=font, anchor='ls')
+    pad = LABEL_PAD * font.size
+    draw.rounded_rectangle(
+        (left - pad, top - pad, right + pad, bottom + pad), radius=pad, fill='white',
+    )
+    draw.text((text_x, text_y), marker_name, font=font, fill='black', anchor='ls')
+    return image
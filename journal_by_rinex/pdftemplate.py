@@ -0,0 +1,352 @@
+import os
+import json
+import zlib
+import hashlib
+import threading
+import time
+from functools import lru_cache
+
+# How the journal PDFs are produced: 'template' compiles each distinct
+# layout once into an empty form and fills copies of it, 'latex'
+# compiles every journal, the default (see FormTemplates for why)
+PDF_MODES = ('template', 'latex')
+
+# Key pdfTeX writes into the image XObject of each of a template's image
+# slots (see slot_graphics()), with the slot's name as its value
+SLOT_KEY = '/JournalBySlot'
+
+# Filled text fields get appearance streams drawn with this font, added
+# to the template's /DR: DejaVu Serif as shipped with matplotlib (which
+# cartopy requires), subset to the characters of FIELD_FONT_ENCODING,
+# which covers Cyrillic; other characters are drawn as '?'
+FIELD_FONT_NAME = '/JournalBySerif'
+FIELD_FONT_FILE = os.path.join('mpl-data', 'fonts', 'ttf', 'DejaVuSerif.ttf')
+FIELD_FONT_ENCODING = 'cp1251'
+# Space between a field's border and its text, in points
+FIELD_PADDING = 2
+
+
+def slot_graphics(slot, path, width):
+    """LaTeX for the placeholder image `path` of the image slot `slot`,
+    sized like _include_graphics() sizes it (`width` of \\textwidth), but
+    embedded with pdfTeX's own \\pdfximage, so the slot's name is in its
+    image XObject."""
+    return (
+        r'\mbox{\pdfximage width ' + width + r'\textwidth attr{' + SLOT_KEY + ' /' + slot + '}{'
+        + path.replace('\\', '/') + r'}\pdfrefximage\pdflastximage}'
+    )
+
+
+@lru_cache(maxsize=None)
+def _field_font_program():
+    """(TrueType font file, widths of the codes 32 to 255 in glyph space
+    units, font descriptor metrics) of the text field font."""
+    import importlib.util
+    matplotlib = importlib.util.find_spec('matplotlib')
+    path = os.path.join(matplotlib.submodule_search_locations[0], FIELD_FONT_FILE) if matplotlib else None
+    if path is None or not os.path.isfile(path):
+        raise ValueError('No font for the form field appearances: matplotlib (with its DejaVu fonts) is missing')
+    import io
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+    font = TTFont(path)
+    cmap = font.getBestCmap()
+    scale = 1000 / font['head'].unitsPerEm
+    characters = [bytes([code]).decode(FIELD_FONT_ENCODING, errors='ignore') for code in range(32, 256)]
+    widths = [
+        round(font['hmtx'][cmap[ord(character)]][0] * scale) if character and ord(character) in cmap else 0
+        for character in characters
+    ]
+    metrics = {
+        'FontBBox': [round(font['head'].xMin * scale), round(font['head'].yMin * scale),
+                     round(font['head'].xMax * scale), round(font['head'].yMax * scale)],
+        'ItalicAngle': font['post'].italicAngle,
+        'Ascent': round(font['hhea'].ascent * scale),
+        'Descent': round(font['hhea'].descent * scale),
+        'CapHeight': round(font['glyf'][cmap[ord('H')]].yMax * scale),
+        'StemV': 80,
+    }
+    options = subset.Options()
+    options.hinting = False
+    options.layout_features = []
+    options.drop_tables += ['FFTM']
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=[ord(character) for character in characters if character and ord(character) in cmap])
+    subsetter.subset(font)
+    program = io.BytesIO()
+    font.save(program)
+    return program.getvalue(), widths, metrics
+
+
+def _add_field_font(pdf):
+    """Add the text field font to the AcroForm /DR of template `pdf`."""
+    import pikepdf
+    program, widths, metrics = _field_font_program()
+    font_file = pikepdf.Stream(pdf, program)
+    font_file.Length1 = len(program)
+    descriptor = pikepdf.Dictionary(
+        Type=pikepdf.Name.FontDescriptor, FontName=pikepdf.Name('/DejaVuSerif'),
+        Flags=34, FontFile2=font_file, **metrics,  # nonsymbolic, serif
+    )
+    # Codes 128 to 255 are those of FIELD_FONT_ENCODING, by their glyph
+    # names, which viewers look up in the font's Unicode cmap
+    differences = [128]
+    for code in range(128, 256):
+        character = bytes([code]).decode(FIELD_FONT_ENCODING, errors='ignore')
+        differences.append(pikepdf.Name(f'/uni{ord(character):04X}' if character else '/.notdef'))
+    font = pdf.make_indirect(pikepdf.Dictionary(
+        Type=pikepdf.Name.Font, Subtype=pikepdf.Name.TrueType, BaseFont=pikepdf.Name('/DejaVuSerif'),
+        FirstChar=32, LastChar=255, Widths=widths, FontDescriptor=pdf.make_indirect(descriptor),
+        Encoding=pikepdf.Dictionary(BaseEncoding=pikepdf.Name.WinAnsiEncoding, Differences=differences),
+    ))
+    acroform = pdf.Root.AcroForm
+    if '/DR' not in acroform:
+        acroform.DR = pikepdf.Dictionary()
+    if '/Font' not in acroform.DR:
+        acroform.DR.Font = pikepdf.Dictionary()
+    acroform.DR.Font[FIELD_FONT_NAME] = font
+
+
+def _color_operator(components, stroke=False):
+    # The colour operator for a /MK colour array or /DA colour operands
+    operator = {1: 'g', 3: 'rg', 4: 'k'}.get(len(components))
+    if operator is None:
+        return ''
+    return ' '.join(f'{float(c):g}' for c in components) + ' ' + (operator.upper() if stroke else operator)
+
+
+def _field_appearance(pdf, acroform, field, widget, value):
+    """The normal appearance stream of text field `field`'s `widget` showing
+    `value`: its /MK background and border, and the value in the field
+    font at the /DA size and colour (fitted to the field if that size is
+    0), aligned by /Q. The field's /DA is switched to the field font."""
+    import pikepdf
+    font = acroform.DR.Font[FIELD_FONT_NAME]
+    first_char = int(font.FirstChar)
+    widths = [float(width) for width in font.Widths]
+    ascent, descent = float(font.FontDescriptor.Ascent), float(font.FontDescriptor.Descent)
+
+    tokens = str(widget.get('/DA', field.get('/DA', acroform.get('/DA', '')))).split()
+    size = 0.0
+    color = '0 g'
+    for index, token in enumerate(tokens):
+        if token == 'Tf' and index >= 2:
+            size = float(tokens[index - 1])
+            tokens[index - 2] = FIELD_FONT_NAME
+        elif token in ('g', 'rg', 'k'):
+            color = _color_operator(tokens[index - {'g': 1, 'rg': 3, 'k': 4}[token]:index])
+    if 'Tf' not in tokens:
+        tokens = [FIELD_FONT_NAME, '0', 'Tf', *tokens]
+
+    llx, lly, urx, ury = (float(coordinate) for coordinate in widget.Rect)
+    width, height = abs(urx - llx), abs(ury - lly)
+    text = value.encode(FIELD_FONT_ENCODING, errors='replace')
+    text_width = sum(widths[code - first_char] for code in text if first_char <= code < first_char + len(widths))
+    if size == 0:
+        size = max((height - 2 * FIELD_PADDING) * 1000 / (ascent - descent), 1)
+        if text_width:
+            size = min(size, (width - 2 * FIELD_PADDING) * 1000 / text_width)
+    text_width *= size / 1000
+    alignment = int(field.get('/Q', acroform.get('/Q', 0)))
+    x = {1: (width - text_width) / 2, 2: width - FIELD_PADDING - text_width}.get(alignment, FIELD_PADDING)
+    y = (height - (ascent - descent) * size / 1000) / 2 - descent * size / 1000
+
+    (widget if '/DA' in widget else field).DA = pikepdf.String(' '.join(tokens))
+    content = []
+    characteristics = widget.get('/MK', {})
+    if '/BG' in characteristics and len(characteristics.BG):
+        content.append(f'{_color_operator(characteristics.BG)} 0 0 {width:g} {height:g} re f')
+    if '/BC' in characteristics and len(characteristics.BC):
+        border = float(widget.get('/BS', {}).get('/W', 1))
+        content.append(f'{_color_operator(characteristics.BC, stroke=True)} {border:g} w '
+                       f'{border / 2:g} {border / 2:g} {width - border:g} {height - border:g} re S')
+    content.append('/Tx BMC q')
+    content.append(f'{FIELD_PADDING / 2:g} {FIELD_PADDING / 2:g} {width - FIELD_PADDING:g} '
+                   f'{height - FIELD_PADDING:g} re W n')
+    content.append(f'BT {FIELD_FONT_NAME} {size:.2f} Tf {color} {x:.2f} {y:.2f} Td')
+    content = ('\n'.join(content) + ' ').encode('ascii') + pikepdf.String(text).unparse() + b' Tj ET Q EMC'
+    appearance = pikepdf.Stream(pdf, content)
+    appearance.Type = pikepdf.Name.XObject
+    appearance.Subtype = pikepdf.Name.Form
+    appearance.BBox = [0, 0, width, height]
+    appearance.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary({FIELD_FONT_NAME: font}))
+    return appearance
+
+
+def _image_xobject(pdf, path):
+    """Image XObject of a PNG/JPEG file, embedded like pdfTeX does:
+    Flate-compressed RGB, with the alpha channel (if any) as its /SMask."""
+    from PIL import Image
+    import pikepdf
+    image = Image.open(path)
+    has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    xobject = pikepdf.Stream(pdf, zlib.compress(image.convert('RGB').tobytes()))
+    xobject.Type = pikepdf.Name.XObject
+    xobject.Subtype = pikepdf.Name.Image
+    xobject.Width, xobject.Height = image.size
+    xobject.ColorSpace = pikepdf.Name.DeviceRGB
+    xobject.BitsPerComponent = 8
+    xobject.Filter = pikepdf.Name.FlateDecode
+    if has_alpha:
+        smask = pikepdf.Stream(pdf, zlib.compress(image.getchannel('A').tobytes()))
+        smask.Type = pikepdf.Name.XObject
+        smask.Subtype = pikepdf.Name.Image
+        smask.Width, smask.Height = image.size
+        smask.ColorSpace = pikepdf.Name.DeviceGray
+        smask.BitsPerComponent = 8
+        smask.Filter = pikepdf.Name.FlateDecode
+        xobject.SMask = smask
+    return xobject
+
+
+def _image_slots(pdf):
+    """{slot: (page index, XObject name)} of the placeholder images, by
+    the slot names slot_graphics() put in them."""
+    import pikepdf
+    slots = {}
+    for page_index, page in enumerate(pdf.pages):
+        for name, xobject in page.Resources.get('/XObject', {}).items():
+            if xobject.get('/Subtype') == pikepdf.Name.Image and SLOT_KEY in xobject:
+                slots[str(xobject[SLOT_KEY])[1:]] = (page_index, name)
+    return slots
+
+
+class FormTemplates:
+    """Journal PDFs made by filling a precompiled copy of their form.
+
+    The form is laid out identically for every journal with the same
+    rows and image proportions; only the field values, the radio choice
+    and the images differ. So each distinct layout is compiled once,
+    with empty fields and blank placeholder images (tagged with their
+    slot's name, see slot_graphics()), into
+    <directory>/journal-<hash of its LaTeX source>.pdf, and every journal
+    is then written by setting the AcroForm values and radio state of
+    that template and swapping its image XObjects, in milliseconds.
+
+    Each filled text field gets an appearance stream of its value (see
+    _field_appearance()), so it shows in viewers, printers and flattening
+    tools that don't draw form fields themselves. It is set in the field
+    font added to the template (FIELD_FONT_NAME) rather than in the
+    journal's own font, as a compiled form's fields are, which is why
+    pdf_mode: template has to be asked for."""
+
+    def __init__(self, latex, directory):
+        self.latex = latex
+        self.directory = directory
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.fills = 0
+        self.fill_seconds = 0.0
+        # The counters are updated from the threads of a pipeline batch
+        self._lock = threading.Lock()
+
+    def placeholder(self, image_path):
+        """Path of the placeholder for the image file `image_path`: a
+        blank image of the same pixel size, so the layout is the same."""
+        from PIL import Image
+        with Image.open(image_path) as image:
+            size = image.size
+        path = os.path.join(self.directory, 'placeholders', f'{size[0]}x{size[1]}.png')
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.png'
+            Image.new('RGB', size, 'white').save(temp_path)
+            os.replace(temp_path, path)
+        return path
+
+    def template(self, doc, finalize=None):
+        """Path of the compiled template for pylatex Document `doc`,
+        compiling it (and then calling finalize(pdf_path), e.g. to fix up
+        its radio groups) if it isn't there yet."""
+        import pikepdf
+        key = hashlib.sha256(doc.dumps().encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(self.directory, f'journal-{key}.pdf')
+        if os.path.isfile(path):
+            return path
+
+        start = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        # Compiled under a per-process (and thread) name and then
+        # renamed, so processes building the same template at once don't
+        # clash
+        temp_base = os.path.join(self.directory, f'journal-{key}-{os.getpid()}-{threading.get_ident()}')
+        self.latex.compile(doc, temp_base)
+        if finalize is not None:
+            finalize(temp_base + '.pdf')
+        with pikepdf.open(temp_base + '.pdf', allow_overwriting_input=True) as pdf:
+            slots = _image_slots(pdf)
+            _add_field_font(pdf)
+            pdf.save()
+        with open(temp_base + '.json', 'w') as f:
+            json.dump({slot: [page, str(name)] for slot, (page, name) in slots.items()}, f)
+        os.replace(temp_base + '.json', path[:-len('.pdf')] + '.json')
+        os.replace(temp_base + '.pdf', path)
+        with self._lock:
+            self.builds += 1
+            self.build_seconds += time.perf_counter() - start
+        return path
+
+    def fill(self, template_path, output_path, fields, radio_field, radio_values, selected_value, images):
+        """Write `output_path` from a template: text fields set from
+        `fields` ({name: value}), the `radio_field` group's kids (one per
+        `radio_values` entry, in order) set to `selected_value`, and each
+        placeholder image slot replaced by the image file in `images`."""
+        import pikepdf
+        start = time.perf_counter()
+        with open(template_path[:-len('.pdf')] + '.json') as f:
+            slots = json.load(f)
+
+        # hyperref drops underscores from field names
+        values = {name.replace('_', ''): str(value) for name, value in fields.items()}
+
+        with pikepdf.open(template_path) as pdf:
+            acroform = pdf.Root.AcroForm
+            if FIELD_FONT_NAME not in acroform.get('/DR', {}).get('/Font', {}):
+                raise ValueError(f'No field font in form template {template_path}')
+            for field in acroform.Fields:
+                name = str(field.get('/T', ''))
+                if name == radio_field and '/Kids' in field:
+                    selected_state = pikepdf.Name('/Off')
+                    for widget, value in zip(field.Kids, radio_values):
+                        on_key = next((k for k in widget.AP.N.keys() if k != '/Off'), None)
+                        if value == selected_value and on_key is not None:
+                            selected_state = pikepdf.Name(on_key)
+                            widget.AS = selected_state
+                        else:
+                            widget.AS = pikepdf.Name('/Off')
+                    field.V = selected_state
+                elif field.get('/FT') == pikepdf.Name('/Tx') and name.replace('_', '') in values:
+                    value = pikepdf.String(values[name.replace('_', '')])
+                    field.V = value
+                    field.DV = value
+                    for widget in field.get('/Kids', [field]):
+                        widget.AP = pikepdf.Dictionary(
+                            N=_field_appearance(pdf, acroform, field, widget, values[name.replace('_', '')]))
+
+            for slot, image_path in images.items():
+                if slot not in slots:
+                    raise ValueError(f'No {slot} image in form template {template_path}')
+                page_index, name = slots[slot]
+                pdf.pages[page_index].Resources.XObject[name] = _image_xobject(pdf, image_path)
+
+            pdf.save(output_path)
+        with self._lock:
+            self.fills += 1
+            self.fill_seconds += time.perf_counter() - start
+
+    def stats(self):
+        with self._lock:
+            return {
+                'builds': self.builds,
+                'build_seconds': self.build_seconds,
+                'fills': self.fills,
+                'fill_seconds': self.fill_seconds,
+            }
+
+
+@lru_cache(maxsize=None)
+def form_templates(latex):
+    """Form templates compiled with LatexBuilder `latex`, kept in its
+    build directory; built once per process."""
+    return FormTemplates(latex, os.path.join(latex.build_dir, 'templates'))
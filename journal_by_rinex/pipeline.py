@@ -0,0 +1,100 @@
+import queue
+import threading
+
+# Items waiting between two stages, at most. A stage that gets ahead of
+# the next one waits for room, and so in turn does the one before it, so
+# however long the batch only a few items are ever in flight
+DEFAULT_PIPELINE_QUEUE_SIZE = 4
+
+# Put on a stage's queue once per worker when there is nothing more
+_END = object()
+
+
+async def _run(items, stages, queue_size, finished, stop, emit):
+    # (only imported once a pipeline runs, as it adds to the startup time)
+    import asyncio
+    loop = asyncio.get_running_loop()
+    # The queue in front of each stage
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+
+    async def feed():
+        for item in items:
+            if stop():
+                break
+            await queues[0].put(item)
+        for _ in range(stages[0][3]):
+            await queues[0].put(_END)
+
+    async def work(position):
+        _, function, executor, _ = stages[position]
+        while True:
+            item = await queues[position].get()
+            if item is _END:
+                return
+            if stop():
+                # Dropped, but still taken off the queue so the stages
+                # before never wait for room that won't come
+                continue
+            item = await loop.run_in_executor(executor, function, item)
+            if position + 1 == len(stages) or finished(item):
+                emit(item)
+            else:
+                await queues[position + 1].put(item)
+
+    async def stage(position):
+        await asyncio.gather(*(work(position) for _ in range(stages[position][3])))
+        if position + 1 < len(stages):
+            for _ in range(stages[position + 1][3]):
+                await queues[position + 1].put(_END)
+
+    await asyncio.gather(feed(), *(stage(position) for position in range(len(stages))))
+
+
+def run_pipeline(items, stages, queue_size=DEFAULT_PIPELINE_QUEUE_SIZE, finished=None, stop=None):
+    """Run every item through `stages`, a list of (name, function,
+    executor, workers): function(item) returns the item for the next
+    stage and runs on `executor` (a concurrent.futures executor, so a
+    process pool for CPU work and threads for waiting on the network or
+    subprocesses), for up to `workers` items of that stage at once. The
+    stages are connected by asyncio queues of `queue_size` items, so they
+    all work at the same time on different items while the memory in use
+    stays flat.
+
+    Yields the items in the order they come out of the last stage, or out
+    of an earlier one for which finished(item) is true. Once stop()
+    returns true, no more items are started on: those in a stage's
+    function at the time finish it (and are yielded if it was their
+    last), the others are dropped."""
+    finished = finished or (lambda item: False)
+    # (True, error or None) once the loop is done, (False, item) before
+    results = queue.Queue()
+    abandoned = threading.Event()
+
+    def stopped():
+        return abandoned.is_set() or (stop is not None and stop())
+
+    def run():
+        import asyncio
+        try:
+            asyncio.run(_run(iter(items), stages, max(queue_size, 1), finished, stopped,
+                             lambda item: results.put((False, item))))
+        except BaseException as e:
+            results.put((True, e))
+        else:
+            results.put((True, None))
+
+    # The event loop runs on its own thread, so the caller can consume
+    # the results (and e.g. report progress) while it goes on
+    thread = threading.Thread(target=run, name='journal_by_rinex-pipeline', daemon=True)
+    thread.start()
+    try:
+        while True:
+            done, result = results.get()
+            if done:
+                if result is not None:
+                    raise result
+                return
+            yield result
+    finally:
+        abandoned.set()
+        thread.join()
@@ -0,0 +1,82 @@
+import os
+import re
+import fnmatch
+from functools import lru_cache
+
+# A glob.escape()d character ('[*]', '[?]' or '[[]'), as written by
+# processed_config() for the exact-path rules of a processed batch
+_ESCAPED_CHAR = re.compile(r'\[([*?[])\]')
+_GLOB_MAGIC = re.compile(r'[*?[]')
+
+
+def literal_pattern(pattern):
+    """The exact name a pattern matches if it has no wildcards (once its
+    glob.escape()d characters are unescaped), else None."""
+    if _GLOB_MAGIC.search(_ESCAPED_CHAR.sub('', pattern)):
+        return None
+    return _ESCAPED_CHAR.sub(r'\1', pattern)
+
+
+class FileRuleIndex:
+    """Compiled file_rules patterns, answering which rules match a file
+    with the same result as testing file_matches_rule() against every
+    rule in turn, but without doing so.
+
+    A rule matches a file by its basename or its absolute path (with
+    forward slashes). Patterns without wildcards, like the exact-path
+    rules processed_config() writes, go into a dict and cost one lookup
+    per file whatever their number. The remaining globs are compiled to
+    regular expressions: those containing a '/' can only ever match the
+    path, the others are tried on both. Each group is first tried as one
+    combined expression, so a file matching none of them (the usual
+    case) is ruled out in a single regex search."""
+
+    def __init__(self, patterns):
+        self.literals = {}
+        basename_globs, path_globs = [], []
+        for index, pattern in enumerate(patterns):
+            pattern = os.path.normcase(str(pattern))
+            literal = literal_pattern(pattern)
+            if literal is not None:
+                self.literals.setdefault(literal, []).append(index)
+            elif '/' in pattern:
+                path_globs.append((index, fnmatch.translate(pattern)))
+            else:
+                basename_globs.append((index, fnmatch.translate(pattern)))
+        self.basename_globs = self._compile(basename_globs)
+        self.path_globs = self._compile(basename_globs + path_globs)
+
+    @staticmethod
+    def _compile(globs):
+        # (combined expression or None, [(rule index, expression)])
+        if not globs:
+            return None, []
+        combined = re.compile('|'.join(f'(?:{regex})' for _, regex in globs))
+        return combined, [(index, re.compile(regex)) for index, regex in globs]
+
+    @staticmethod
+    def _glob_matches(globs, name, matches):
+        combined, compiled = globs
+        if combined is not None and combined.match(name):
+            matches.update(index for index, regex in compiled if regex.match(name))
+
+    def matches(self, file_path):
+        """Indexes of the rules matching `file_path`, in rule order."""
+        basename = os.path.normcase(os.path.basename(file_path))
+        normalized_path = os.path.normcase(os.path.abspath(file_path).replace(os.sep, '/'))
+        matches = set(self.literals.get(basename, ()))
+        matches.update(self.literals.get(normalized_path, ()))
+        self._glob_matches(self.basename_globs, basename, matches)
+        self._glob_matches(self.path_globs, normalized_path, matches)
+        return sorted(matches)
+
+
+@lru_cache(maxsize=8)
+def _file_rule_index(patterns):
+    return FileRuleIndex(patterns)
+
+
+def file_rule_index(file_rules):
+    """The FileRuleIndex of a file_rules list, compiled once per process
+    for each distinct set of patterns."""
+    return _file_rule_index(tuple(str(rule['pattern']) for rule in file_rules))
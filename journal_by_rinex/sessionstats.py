@@ -0,0 +1,263 @@
+import re
+import math
+import mmap
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+# A gap is a pause between consecutive epochs longer than this many
+# sampling intervals (plus half an interval of jitter), so 1 counts any
+# missing epoch
+DEFAULT_GAP_INTERVALS = 1
+
+# Distinct epoch spacings counted one by one. A session only ever has a
+# handful besides its sampling interval, one per gap length; any more
+# are only kept as a count, total and maximum, so memory stays the same
+# however long (or broken up) the file is
+MAX_DISTINCT_SPACINGS = 512
+
+# get_info() keys of the statistics, present once every epoch record
+# has been read (epoch_scan 'full', or any compressed file)
+STATISTICS_KEYS = (
+    'epochs', 'interval', 'gaps', 'gap time', 'longest gap', 'completeness',
+    'satellites min', 'satellites mean', 'satellites max',
+)
+
+# The bytes version of functions.RINEX2_EPOCH_RE
+RINEX2_EPOCH_RE = re.compile(
+    rb'^\s*(\d{1,2})\s+(\d{1,2})\s+(\d{1,2})\s+(\d{1,2})\s+(\d{1,2})\s+(\d{1,2}(?:\.\d+)?)\s+(\d)'
+)
+
+# Epoch times are kept as seconds since this day, not datetimes
+EPOCH_ORIGIN = datetime(1980, 1, 6)
+_ORIGIN_ORDINAL = EPOCH_ORIGIN.toordinal()
+
+
+@lru_cache(maxsize=None)
+def _day_seconds(year, month, day):
+    # One date() per day of observations, not per epoch
+    return (date(year, month, day).toordinal() - _ORIGIN_ORDINAL) * 86400
+
+
+def _epoch_seconds(year, month, day, hour, minute, second):
+    """(whole, exact) seconds since EPOCH_ORIGIN of an epoch's date/time
+    fields (bytes); raises ValueError for fields strptime() would reject."""
+    year, month, day, hour, minute = int(year), int(month), int(day), int(hour), int(minute)
+    second = float(second)
+    if year < 100:
+        year += 2000 if year < 80 else 1900
+    if not (0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 62):
+        raise ValueError('epoch time out of range')
+    whole = _day_seconds(year, month, day) + hour * 3600 + minute * 60
+    return whole + int(second), whole + second
+
+
+def _datetime(whole_seconds):
+    return EPOCH_ORIGIN + timedelta(seconds=whole_seconds)
+
+
+class SessionStatistics:
+    """Statistics of a session's observation epochs, collected one epoch
+    at a time with add() in constant memory: the number of epochs, the
+    sampling interval (the most common spacing between epochs), gaps,
+    completeness and the number of satellites tracked per epoch."""
+
+    def __init__(self):
+        self.epochs = 0
+        self.first = self.last = None
+        self.satellites_min = self.satellites_max = self.satellites_total = 0
+        # Spacing between consecutive epochs in milliseconds -> count,
+        # and (count, total, longest) of those past the limit
+        self.spacings = {}
+        self.other_spacings = [0, 0, 0]
+
+    def add(self, seconds, satellites):
+        last = self.last
+        if last is None:
+            self.first = seconds
+            self.satellites_min = satellites
+        else:
+            spacing = round((seconds - last) * 1000)
+            if spacing > 0:
+                spacings = self.spacings
+                if spacing in spacings:
+                    spacings[spacing] += 1
+                elif len(spacings) < MAX_DISTINCT_SPACINGS:
+                    spacings[spacing] = 1
+                else:
+                    other = self.other_spacings
+                    other[0] += 1
+                    other[1] += spacing
+                    other[2] = max(other[2], spacing)
+            if satellites < self.satellites_min:
+                self.satellites_min = satellites
+        self.last = seconds
+        self.epochs += 1
+        self.satellites_total += satellites
+        if satellites > self.satellites_max:
+            self.satellites_max = satellites
+
+    def result(self, gap_intervals=DEFAULT_GAP_INTERVALS):
+        """The statistics as {STATISTICS_KEYS: value}, seconds as floats
+        and completeness in percent; {} if no epochs were added. Gap times
+        are the time missing, the spacing less one interval."""
+        if not self.epochs:
+            return {}
+        interval = max(self.spacings, key=self.spacings.get) if self.spacings else 0
+        threshold = (gap_intervals + 0.5) * interval
+        gaps = gap_time = longest = 0
+        for spacing, count in self.spacings.items():
+            if spacing > threshold:
+                gaps += count
+                gap_time += (spacing - interval) * count
+                longest = max(longest, spacing)
+        count, total, other_longest = self.other_spacings
+        if count and other_longest > threshold:
+            # (only ever gaps in practice, the sampling interval being
+            # among the first spacings seen)
+            gaps += count
+            gap_time += total - interval * count
+            longest = max(longest, other_longest)
+        if interval:
+            expected = round((self.last - self.first) * 1000 / interval) + 1
+            completeness = min(100.0, 100.0 * self.epochs / expected)
+        else:
+            completeness = 100.0
+        return {
+            'epochs': self.epochs,
+            'interval': interval / 1000,
+            'gaps': gaps,
+            'gap time': gap_time / 1000,
+            'longest gap': max(longest - interval, 0) / 1000,
+            'completeness': completeness,
+            'satellites min': self.satellites_min,
+            'satellites mean': self.satellites_total / self.epochs,
+            'satellites max': self.satellites_max,
+        }
+
+
+class _Scan:
+    # First and last epoch times (of any epoch record with a timestamp,
+    # as the 'bounds' scan finds them) and statistics of the observation
+    # epochs (flags 0 and 1)
+    def __init__(self):
+        self.first = self.last = None
+        self.statistics = SessionStatistics()
+
+    def epoch(self, fields, flag, satellites, line_number):
+        try:
+            whole, exact = _epoch_seconds(*fields)
+            satellites = int(satellites)
+        except ValueError:
+            print(f'Warning! Invalid time format in RINEX file, line {line_number()}')
+            return
+        if self.first is None:
+            self.first = whole
+        self.last = whole
+        if flag in (b'0', b'1'):
+            self.statistics.add(exact, satellites)
+
+
+def _scan_rinex3_mapped(mapped, start, line_number, scan):
+    # Epoch records are the only lines starting with '>', so the search
+    # jumps from one to the next without looking at the observations in
+    # between
+    position = start
+    size = len(mapped)
+    while position < size:
+        if mapped[position] != 0x3e:
+            position = mapped.find(b'\n>', position)
+            if position < 0:
+                break
+            position += 1
+        end = mapped.find(b'\n', position)
+        if end < 0:
+            end = size
+        tokens = mapped[position + 1:end].split()
+        if len(tokens) >= 8:
+            # (only ever counted for a warning)
+            at = position
+            scan.epoch(tokens[:6], tokens[6], tokens[7], lambda: line_number + mapped[start:at].count(b'\n'))
+        position = end + 1
+
+
+def _scan_rinex3_lines(lines, line_number, scan):
+    for number, line in enumerate(lines, start=line_number):
+        if line[:1] == b'>':
+            tokens = line[1:].split()
+            if len(tokens) >= 8:
+                scan.epoch(tokens[:6], tokens[6], tokens[7], lambda: number)
+
+
+def _scan_rinex2_lines(lines, line_number, scan, observation_types):
+    # RINEX 2 epoch lines have no marker character, so the observation
+    # lines after each epoch line (its count of satellites, times the
+    # lines per satellite) are skipped rather than matched. Only the first
+    # of them is checked, in case the observations are missing; anything
+    # else not looking like an epoch line is passed over until one does
+    lines_per_satellite = max(math.ceil(observation_types / 5), 1)
+    skip = observations = 0
+    for number, line in enumerate(lines, start=line_number):
+        if skip:
+            skip -= 1
+            continue
+        match = RINEX2_EPOCH_RE.match(line)
+        if not match:
+            if observations:
+                skip = observations - 1
+                observations = 0
+            continue
+        flag = match.group(7)
+        count = int(line[29:32]) if line[29:32].strip().isdigit() else 0
+        if flag in (b'2', b'3', b'4', b'5'):
+            skip, observations = count, 0
+        else:
+            skip, observations = (count - 1) // 12 if count else 0, count * lines_per_satellite
+        scan.epoch(match.groups()[:6], flag, count, lambda: number)
+
+
+def scan_session(f, header, line_number, gap_intervals=DEFAULT_GAP_INTERVALS):
+    """Read every epoch record from the current position of binary file
+    `f` (whose next line is `line_number`) in one pass, without a
+    datetime per epoch. Plain RINEX 3 files are memory-mapped and searched
+    for their epoch records only.
+
+    Returns (first time, last time, statistics): datetimes (None if there
+    are no epochs) and SessionStatistics.result()."""
+    scan = _Scan()
+    if header['version'] >= 3:
+        mapped = None
+        if f.seekable():
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError):
+                # (not a real file, or an empty one)
+                pass
+        if mapped is not None:
+            with mapped:
+                _scan_rinex3_mapped(mapped, f.tell(), line_number, scan)
+        else:
+            _scan_rinex3_lines(f, line_number, scan)
+    else:
+        observation_types = int(header.get('# / TYPES OF OBSERV', '')[:6].strip() or 0)
+        _scan_rinex2_lines(f, line_number, scan, observation_types)
+    if scan.first is None:
+        return None, None, {}
+    return _datetime(scan.first), _datetime(scan.last), scan.statistics.result(gap_intervals)
+
+
+def session_statistics_rows(info):
+    """(label, value) journal rows of the session statistics in `info`
+    (get_info() keys), empty if it has none."""
+    if 'epochs' not in info:
+        return []
+    gaps = str(info['gaps'])
+    if info['gaps']:
+        gaps += f' ({info["gap time"]:g} с, наибольший {info["longest gap"]:g} с)'
+    return [
+        ('Число эпох', str(info['epochs'])),
+        ('Интервал записи, с', f'{info["interval"]:g}'),
+        ('Полнота данных, %', f'{info["completeness"]:.1f}'),
+        ('Перерывы', gaps),
+        ('Спутники (мин/сред/макс)',
+         f'{info["satellites min"]}/{info["satellites mean"]:.1f}/{info["satellites max"]}'),
+    ]
@@ -0,0 +1,307 @@
+import io
+import os
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+from journal_by_rinex.trace import span
+
+# Named tile providers; anything else given as tile_provider is used as a
+# URL template with {z}/{x}/{y} or {quadkey} placeholders. 'quadtree' is
+# the imagery cimgt.QuadtreeTiles() has always fetched for the maps
+TILE_PROVIDERS = {
+    'quadtree': 'http://ecn.dynamic.t1.tiles.virtualearth.net/comp/CompositionHandler/{quadkey}?mkt=en-gb&it=A,G,L&shading=hill&n=z',
+    'osm': 'https://tile.openstreetmap.org/{z}/{x}/{y}.png',
+}
+
+DEFAULT_TILE_CACHE_MAX_MB = 500
+
+# Image file extensions looked up, in order, in an offline XYZ directory
+XYZ_TILE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+TILE_DOWNLOAD_TIMEOUT = 30
+
+# Shown in place of a tile that couldn't be fetched, like cartopy does
+MISSING_TILE_COLOR = (250, 250, 250)
+
+USER_AGENT = 'journal_by_rinex'
+
+
+def user_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'journal_by_rinex')
+
+
+def default_tile_cache_dir():
+    return os.path.join(user_cache_dir(), 'tiles')
+
+
+def _path_key(kind, path):
+    # Directory-name-safe identifier of a local tile source
+    return f'{kind}-' + hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:12]
+
+
+def quadkey(z, x, y):
+    """Bing-style quadkey of Web Mercator tile x, y at zoom level z."""
+    return ''.join(
+        str(((x >> bit) & 1) | (((y >> bit) & 1) << 1))
+        for bit in range(z - 1, -1, -1)
+    )
+
+
+class TileCache:
+    """Size-bounded on-disk tile cache, laid out as
+    <directory>/<provider>/<z>/<x>/<y>. A tile's modification time is its
+    last use, so once the cache grows past max_bytes the least recently
+    used tiles are deleted first. Several processes may share one cache
+    directory; each keeps its own counters."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = sum(size for _, _, size in self._entries())
+
+    def _path(self, provider, z, x, y):
+        return os.path.join(self.directory, provider, str(z), str(x), str(y))
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, provider, z, x, y):
+        path = self._path(provider, z, x, y)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            # Mark as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, provider, z, x, y, data):
+        path = self._path(provider, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name first, so a concurrent reader
+        # never sees a partially written tile
+        temp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self._size += len(data)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class HttpTileSource:
+    """Tiles downloaded from a provider's URL template, through an
+    optional TileCache. Like the other tile sources, `key` identifies
+    where its tiles come from."""
+
+    def __init__(self, url_template, provider, cache=None):
+        self.url_template = url_template
+        self.provider = provider
+        self.key = provider
+        self.cache = cache
+
+    def get_tile(self, z, x, y):
+        if self.cache is not None:
+            data = self.cache.get(self.provider, z, x, y)
+            if data is not None:
+                return data
+        from urllib.request import Request, urlopen
+        from urllib.error import URLError
+        url = self.url_template.format(z=z, x=x, y=y, quadkey=quadkey(z, x, y))
+        try:
+            with span('tile.download'), urlopen(Request(url, headers={'User-Agent': USER_AGENT}), timeout=TILE_DOWNLOAD_TIMEOUT) as response:
+                data = response.read()
+        except (URLError, OSError) as e:
+            print(f'Warning! Could not download map tile {z}/{x}/{y}: {e}')
+            return None
+        if self.cache is not None:
+            self.cache.put(self.provider, z, x, y, data)
+        return data
+
+    def stats(self):
+        return self.cache.stats() if self.cache is not None else {}
+
+
+class XYZDirectorySource:
+    """Offline tiles from a local <directory>/<z>/<x>/<y>.<ext> tree."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.key = _path_key('xyz', directory)
+        self.hits = 0
+        self.misses = 0
+
+    def get_tile(self, z, x, y):
+        for extension in XYZ_TILE_EXTENSIONS:
+            path = os.path.join(self.directory, str(z), str(x), f'{y}{extension}')
+            if os.path.isfile(path):
+                self.hits += 1
+                with open(path, 'rb') as f:
+                    return f.read()
+        self.misses += 1
+        return None
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class MBTilesSource:
+    """Offline tiles from a local MBTiles (SQLite) file."""
+
+    def __init__(self, path):
+        if not os.path.isfile(path):
+            raise ValueError(f'MBTiles file not found: {path}')
+        self.connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self.key = _path_key('mbtiles', path)
+        self.hits = 0
+        self.misses = 0
+
+    def get_tile(self, z, x, y):
+        # MBTiles numbers tile rows from the south (TMS), XYZ from the north
+        row = self.connection.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+            (z, x, (1 << z) - 1 - y),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class MissingTileCounter:
+    """A tile source passing every request on to `source`, counting the
+    tiles it didn't have, so that whoever draws a map from it can tell
+    whether the map came out complete. One per map: the sources
+    themselves are shared by every map of the process."""
+
+    def __init__(self, source):
+        self.source = source
+        self.key = source.key
+        self.missing = 0
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+    def get_tile(self, z, x, y):
+        data = self.source.get_tile(z, x, y)
+        if data is None:
+            self.missing += 1
+        return data
+
+
+def tile_url_template(provider):
+    """URL template of a tile_provider setting; raises ValueError if it's
+    neither a known provider nor a usable template."""
+    url_template = TILE_PROVIDERS.get(provider, provider)
+    if '{quadkey}' not in url_template and not all(key in url_template for key in ('{z}', '{x}', '{y}')):
+        raise ValueError(
+            f'Unknown tile_provider {provider!r}: expected one of {", ".join(TILE_PROVIDERS)} '
+            'or a URL template with {z}, {x} and {y} (or {quadkey})')
+    return url_template
+
+
+def _provider_key(provider):
+    # Cache directory name for a provider: its name, or a short hash of
+    # a custom URL template
+    if provider in TILE_PROVIDERS:
+        return provider
+    return 'url-' + hashlib.sha1(provider.encode('utf-8')).hexdigest()[:12]
+
+
+@lru_cache(maxsize=None)
+def tile_source(provider='quadtree', cache_dir=None, cache_max_mb=DEFAULT_TILE_CACHE_MAX_MB, offline=None):
+    """Tile source for the location maps, built once per process for each
+    combination of settings. With `offline` set to an .mbtiles file or an
+    XYZ tile directory, tiles are only ever read from there; otherwise
+    they're downloaded from `provider` through the on-disk cache (disabled
+    with cache_max_mb = 0)."""
+    if offline:
+        if os.path.isdir(offline):
+            return XYZDirectorySource(offline)
+        return MBTilesSource(offline)
+    url_template = tile_url_template(provider)
+    cache = None
+    if cache_max_mb:
+        cache = TileCache(cache_dir or default_tile_cache_dir(), cache_max_mb * 1024 * 1024)
+    return HttpTileSource(url_template, _provider_key(provider), cache)
+
+
+def tile_source_from_settings(settings):
+    return tile_source(
+        settings.get('tile_provider') or 'quadtree',
+        settings.get('tile_cache_dir'),
+        settings.get('tile_cache_max_mb', DEFAULT_TILE_CACHE_MAX_MB),
+        settings.get('tile_offline'),
+    )
+
+
+@lru_cache(maxsize=None)
+def _tile_imagery_class():
+    # cartopy is only imported (and subclassed) once a map is actually
+    # drawn with it
+    from PIL import Image
+    import cartopy.io.img_tiles as cimgt
+
+    class TileImagery(cimgt.GoogleWTS):
+        def __init__(self, source):
+            super().__init__(desired_tile_form='RGB')
+            self.source = source
+
+        def _image_url(self, tile):
+            x, y, z = tile
+            return getattr(self.source, 'url_template', '').format(z=z, x=x, y=y, quadkey=quadkey(z, x, y))
+
+        def get_image(self, tile):
+            x, y, z = tile
+            data = self.source.get_tile(z, x, y)
+            if data is None:
+                img = Image.new('RGB', (256, 256), MISSING_TILE_COLOR)
+            else:
+                img = Image.open(io.BytesIO(data)).convert('RGB')
+            return img, self.tileextent(tile), 'lower'
+
+    return TileImagery
+
+
+def tile_imagery(source):
+    """Cartopy Web Mercator imagery whose tiles come from a tile source
+    (see tile_source()) instead of being downloaded by cartopy itself."""
+    return _tile_imagery_class()(source)
@@ -0,0 +1,165 @@
+import os
+import json
+import math
+import time
+import threading
+import functools
+import contextlib
+
+# Environment variable that turns tracing on (with the trace file's
+# path) when the trace setting isn't given
+TRACE_ENV_VAR = 'JOURNAL_BY_RINEX_TRACE'
+
+# Returned by span() while tracing is off: entering and leaving it does
+# nothing, so the instrumented stages cost one function call more
+_NO_SPAN = contextlib.nullcontext()
+
+
+class _Tracer:
+    # This process's tracing state: whether it's on, the file each thread
+    # is processing (recorded with every span) and the spans recorded
+    # since the last drain()
+    def __init__(self):
+        self.enabled = False
+        self.local = threading.local()
+        self.spans = []
+
+    @property
+    def file(self):
+        return getattr(self.local, 'file', None)
+
+    @file.setter
+    def file(self, file):
+        self.local.file = file
+
+
+_tracer = _Tracer()
+
+
+class _Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        _tracer.spans.append({
+            'name': self.name,
+            'file': _tracer.file,
+            'pid': os.getpid(),
+            'thread': threading.get_ident(),
+            'start': self.wall_start,
+            'seconds': seconds,
+            'args': self.args,
+        })
+        return False
+
+
+def span(name, **args):
+    """Context manager timing one stage, e.g. `with span('map.render'):`.
+    Recorded (with `args`) only while tracing is enabled in this
+    process."""
+    if not _tracer.enabled:
+        return _NO_SPAN
+    return _Span(name, args)
+
+
+def traced(name):
+    """Decorator recording every call of the function as a `name` span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable(enabled=True):
+    """Turn span recording in this process on or off."""
+    _tracer.enabled = enabled
+
+
+@contextlib.contextmanager
+def traced_file(file, name='file'):
+    """Record the spans inside (on this thread) as belonging to `file`,
+    within a `name` span of their own."""
+    previous, _tracer.file = _tracer.file, file
+    try:
+        with span(name):
+            yield
+    finally:
+        _tracer.file = previous
+
+
+def drain():
+    """The spans recorded in this process since the last drain()."""
+    spans, _tracer.spans = _tracer.spans, []
+    return spans
+
+
+def trace_path_from_settings(settings):
+    """Where the batch's trace goes: settings['trace'], else the
+    JOURNAL_BY_RINEX_TRACE environment variable; None if tracing is
+    off."""
+    return settings.get('trace') or os.environ.get(TRACE_ENV_VAR) or None
+
+
+def write_trace(path, spans):
+    """Write the spans to `path`: one JSON object per line if it ends in
+    .jsonl, otherwise a Chrome trace (for chrome://tracing or Perfetto)."""
+    spans = sorted(spans, key=lambda s: s['start'])
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for record in spans:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        else:
+            origin = spans[0]['start'] if spans else 0.0
+            events = [
+                {
+                    'name': record['name'],
+                    'cat': 'journal_by_rinex',
+                    'ph': 'X',
+                    'ts': round((record['start'] - origin) * 1e6, 1),
+                    'dur': round(record['seconds'] * 1e6, 1),
+                    'pid': record['pid'],
+                    'tid': record['thread'],
+                    'args': {'file': record['file'], **record['args']},
+                }
+                for record in spans
+            ]
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def _percentile(values, fraction):
+    # Nearest-rank percentile of sorted values
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def stage_summary(spans):
+    """{stage name: {count, p50, p95, max, total}} of the spans' seconds."""
+    durations = {}
+    for record in spans:
+        durations.setdefault(record['name'], []).append(record['seconds'])
+    summary = {}
+    for name, values in sorted(durations.items()):
+        values.sort()
+        summary[name] = {
+            'count': len(values),
+            'p50': _percentile(values, 0.5),
+            'p95': _percentile(values, 0.95),
+            'max': values[-1],
+            'total': sum(values),
+        }
+    return summary
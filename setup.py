@@ -16,19 +16,22 @@ setup(
     include_package_data=True,
     install_requires=[
         "tk",             # Tkinter for GUI
-        "georinex",       # For RINEX file processing
         "pyproj",         # For geodetic transformations
         "pylatex",        # For PDF generation
-        "pypandoc",       # For DOCX generation
-        "geopandas",      # For geospatial data processing
-        "contextily",     # For basemaps
         "cartopy",        # For geospatial data visualization
         "pyyaml",         # For YAML config file support
         "pikepdf",        # For fixing up PDF radio button field groups
+        "pillow",         # For the fast map renderer, tiles and form template images
     ],
+    extras_require={
+        "bench": ["georinex"],  # For benchmarks/bench_header.py
+        "pandoc": ["pypandoc"],  # For docx_writer: pandoc
+    },
     entry_points={
         'console_scripts': [
-            'journal_by_rinex=journal_by_rinex.main:run_app'  # Command to run the application
+            'journal_by_rinex=journal_by_rinex.main:run_app',  # Command to run the application
+            'journal_by_rinex_batch=journal_by_rinex.cli:main',  # Headless batch processing (no GUI)
+            'journal_by_rinex_index=journal_by_rinex.headerindex:main',  # Header index scan and session queries
         ]
     },
     classifiers=[
@@ -0,0 +1,263 @@
+import io
+import random
+
+import pytest
+
+from journal_by_rinex.compression import _crinex_lines, _unlzw, open_rinex
+
+
+class _CodeWriter:
+    """Unix compress codes packed LSB first, like ncompress writes them."""
+
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+        self.count = 0
+
+    def write(self, code, n_bits):
+        self.value |= code << self.length
+        self.length += n_bits
+        self.count += 1
+
+    def pad_group(self, n_bits):
+        # ncompress finishes the current group of 8 codes whenever the
+        # code width changes or the table is cleared
+        while self.count % 8:
+            self.write(0, n_bits)
+
+    def getvalue(self):
+        return self.value.to_bytes((self.length + 7) // 8, 'little')
+
+
+def lzw_compress(data, max_bits=16, clear_every=None):
+    """(.Z file of `data`, code widths used), compressed like ncompress in
+    block mode, with a CLEAR code after every `clear_every` codes."""
+    max_max_code = 1 << max_bits
+    writer = _CodeWriter()
+    widths = set()
+    table = {bytes([i]): i for i in range(256)}
+    free_ent, n_bits = 257, 9
+
+    def max_code():
+        return max_max_code if n_bits >= max_bits else (1 << n_bits) - 1
+
+    def output(code, clear=False):
+        nonlocal n_bits
+        writer.write(code, n_bits)
+        widths.add(n_bits)
+        if clear or free_ent > max_code():
+            writer.pad_group(n_bits)
+            n_bits = 9 if clear else n_bits + 1
+
+    codes = 0
+    current = data[:1]
+    for byte in data[1:]:
+        string = current + bytes([byte])
+        if string in table:
+            current = string
+            continue
+        output(table[current])
+        current = bytes([byte])
+        if free_ent < max_max_code:
+            table[string] = free_ent
+            free_ent += 1
+        codes += 1
+        if clear_every and codes % clear_every == 0:
+            table = {bytes([i]): i for i in range(256)}
+            free_ent = 257
+            output(256, clear=True)
+    if current:
+        output(table[current])
+    return b'\x1f\x9d' + bytes([0x80 | max_bits]) + writer.getvalue(), widths
+
+
+def sample_text(size, seed=0):
+    # Compressible, but with enough variety to fill a 16-bit table
+    rng = random.Random(seed)
+    words = [bytes(rng.choices(b'abcdefghijklmnopqrstuvwxyz0123456789', k=rng.randint(2, 9))) for _ in range(4000)]
+    text = bytearray()
+    while len(text) < size:
+        text += rng.choice(words) + rng.choice([b' ', b'  ', b'\n'])
+    return bytes(text[:size])
+
+
+def unlzw(compressed, read_size=1024):
+    return b''.join(_unlzw(io.BytesIO(compressed), read_size))
+
+
+@pytest.mark.parametrize('max_bits', range(9, 17))
+def test_unlzw_decodes_every_code_width(max_bits):
+    data = sample_text(200_000)
+    compressed, widths = lzw_compress(data, max_bits)
+    assert widths == set(range(9, max_bits + 1))
+    assert unlzw(compressed) == data
+
+
+@pytest.fixture(scope='module')
+def cleared_stream():
+    data = sample_text(600_000, seed=1)
+    compressed, widths = lzw_compress(data, 16, clear_every=50_000)
+    assert 16 in widths
+    return data, compressed
+
+
+@pytest.mark.parametrize('read_size', [1, 7, 64 * 1024])
+def test_unlzw_after_block_clear(cleared_stream, read_size):
+    data, compressed = cleared_stream
+    assert unlzw(compressed, read_size) == data
+
+
+def test_unlzw_round_trips_ncompress_output():
+    ncompress = pytest.importorskip('ncompress')
+    # Text, then noise: compress clears its table once the noise makes
+    # the compression ratio drop
+    data = sample_text(600_000, seed=2) + random.Random(3).randbytes(300_000) + sample_text(100_000, seed=4)
+    assert unlzw(ncompress.compress(data)) == data
+    assert unlzw(ncompress.compress(b'')) == b''
+    assert unlzw(ncompress.compress(b'x')) == b'x'
+
+
+def test_unlzw_rejects_bad_headers():
+    with pytest.raises(ValueError, match='Not a Unix compress'):
+        unlzw(b'\x1f\x8b\x08')
+    with pytest.raises(ValueError, match='code width'):
+        unlzw(b'\x1f\x9d\x91')
+
+
+def rinex_2(epochs):
+    """RINEX 2.11 text with 7 observation types (2 lines per satellite).
+    `epochs` are (minute, flag, satellites or event header lines)."""
+    lines = [
+        '     2.11           OBSERVATION DATA    G (GPS)             RINEX VERSION / TYPE',
+        'SYNT                                                        MARKER NAME',
+        '     7    C1    L1    L2    P2    S1    S2    D1            # / TYPES OF OBSERV',
+        '    30.000                                                  INTERVAL',
+        '                                                            END OF HEADER',
+    ]
+    for minute, flag, items in epochs:
+        epoch = f' 24  3  1  0{minute:3d}  0.0000000  {flag}{len(items):3d}'
+        if flag > 1:
+            lines += [epoch, *items]
+            continue
+        for start in range(0, len(items), 12):
+            lines.append((epoch if start == 0 else ' ' * 32) + ''.join(items[start:start + 12]))
+        for index, satellite in enumerate(items):
+            values = [f'{20_000_000 + 1000 * index + minute + obs:14.3f} {obs % 10}' for obs in range(7)]
+            lines += [''.join(values[:5]), ''.join(values[5:])]
+    return '\n'.join(lines) + '\n'
+
+
+def rinex_3(epochs):
+    lines = [
+        '     3.04           OBSERVATION DATA    G                   RINEX VERSION / TYPE',
+        'SYNT                                                        MARKER NAME',
+        'G    4 C1C L1C D1C S1C                                      SYS / # / OBS TYPES',
+        '                                                            END OF HEADER',
+    ]
+    for minute, flag, items in epochs:
+        lines.append(f'> 2024 03 01 00 {minute:02d}  0.0000000  {flag}{len(items):3d}')
+        if flag > 1:
+            lines += items
+            continue
+        for index, satellite in enumerate(items):
+            lines.append(satellite + ''.join(f'{20_000_000 + 1000 * index + minute + obs:14.3f} {obs % 10}' for obs in range(4)))
+    return '\n'.join(lines) + '\n'
+
+
+SATELLITES = [f'G{prn:02d}' for prn in range(1, 15)]
+EPOCHS = [
+    (0, 0, SATELLITES[:3]),
+    (1, 0, SATELLITES[:3]),
+    # Satellites set and rise, and more than fit on one RINEX 2 line
+    (2, 0, SATELLITES[1:]),
+    (3, 4, ['event comment line 1                                        COMMENT',
+            'event comment line 2                                        COMMENT']),
+    (4, 0, [SATELLITES[5], SATELLITES[0]]),
+    (5, 1, [SATELLITES[5], SATELLITES[0]]),
+    (6, 2, []),
+    (7, 0, SATELLITES[:1]),
+]
+
+
+def expected_lines(text, rinex_2_format):
+    """What _crinex_lines() gives for `text`: the header, then every epoch
+    record with blank observations."""
+    lines = text.splitlines(keepends=True)
+    end = next(index for index, line in enumerate(lines) if 'END OF HEADER' in line) + 1
+    expected = lines[:end]
+    count_end = 32 if rinex_2_format else 35
+    position = end
+    while position < len(lines):
+        line = lines[position]
+        flag, count = int(line[count_end - 4]), int(line[count_end - 3:count_end])
+        if flag > 1:
+            expected += [line[:count_end] + '\n', *lines[position + 1:position + 1 + count]]
+            position += 1 + count
+        elif rinex_2_format:
+            epoch_lines = max((count + 11) // 12, 1)
+            expected += lines[position:position + epoch_lines] + ['\n'] * (2 * count)
+            position += epoch_lines + 2 * count
+        else:
+            expected.append(line)
+            expected += [data_line[:3] + '\n' for data_line in lines[position + 1:position + 1 + count]]
+            position += 1 + count
+    return [line.encode('ascii') for line in expected]
+
+
+def decode(compact):
+    f = io.BytesIO(compact.encode('ascii'))
+    return list(_crinex_lines(f.readline(), f))
+
+
+@pytest.mark.parametrize('make_rinex, rinex_2_format', [(rinex_2, True), (rinex_3, False)])
+def test_crinex_lines_match_rnx2crx_output(make_rinex, rinex_2_format):
+    hatanaka = pytest.importorskip('hatanaka')
+    text = make_rinex(EPOCHS)
+    assert decode(hatanaka.rnx2crx(text)) == expected_lines(text, rinex_2_format)
+
+
+def test_crinex_1_epoch_differences():
+    # Written by hand: after the first epoch line only the characters that
+    # change are given ('&' blanks one). The event record does not take
+    # part in the differences.
+    compact = '\n'.join([
+        '1.0                 COMPACT RINEX FORMAT                    CRINEX VERS   / TYPE',
+        'RNX2CRX ver.4.1.0                       01-Mar-24 00:00     CRINEX PROG / DATE',
+        '     2.11           OBSERVATION DATA    G (GPS)             RINEX VERSION / TYPE',
+        '     2    C1    L1                                          # / TYPES OF OBSERV',
+        '                                                            END OF HEADER',
+        '&24  3  1  0  0  0.0000000  0  2G01G02',
+        '',
+        '3&20000000000 3&100000000',
+        '3&20000001000 3&100001000',
+        # Minute 3, one satellite: G05
+        ' ' * 14 + '3' + ' ' * 16 + '1  5&&&',
+        '',
+        '1 1',
+        '&24  3  1  0  4  0.0000000  4  1',
+        'a comment                                                   COMMENT',
+        ' ' * 14 + '5',
+        '',
+        '1 1',
+    ]) + '\n'
+    assert decode(compact) == [
+        b'     2.11           OBSERVATION DATA    G (GPS)             RINEX VERSION / TYPE\n',
+        b'     2    C1    L1                                          # / TYPES OF OBSERV\n',
+        b'                                                            END OF HEADER\n',
+        b' 24  3  1  0  0  0.0000000  0  2G01G02\n', b'\n', b'\n',
+        b' 24  3  1  0  3  0.0000000  0  1G05\n', b'\n',
+        b' 24  3  1  0  4  0.0000000  4  1\n',
+        b'a comment                                                   COMMENT\n',
+        b' 24  3  1  0  5  0.0000000  0  1G05\n', b'\n',
+    ]
+
+
+def test_open_rinex_decodes_compressed_compact_rinex(tmp_path):
+    hatanaka = pytest.importorskip('hatanaka')
+    ncompress = pytest.importorskip('ncompress')
+    text = rinex_3(EPOCHS)
+    path = tmp_path / 'SITE00RUS_R_20240610000_01D_30S_MO.crx.Z'
+    path.write_bytes(ncompress.compress(hatanaka.rnx2crx(text).encode('ascii')))
+    with open_rinex(path) as f:
+        assert not f.seekable()
+        assert list(f) == expected_lines(text, False)
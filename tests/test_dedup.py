@@ -0,0 +1,149 @@
+import os
+
+import pytest
+
+from journal_by_rinex import dedup
+from journal_by_rinex.batch import build_options, find_duplicates, reuse_outputs
+from journal_by_rinex.dedup import content_fingerprints
+from journal_by_rinex.manifest import build_key, build_manifest
+from journal_by_rinex.rules import file_rule_index
+
+
+@pytest.fixture
+def hash_calls(monkeypatch):
+    """Files hashed by quick_hash() and full_hash()."""
+    calls = {'quick': [], 'full': []}
+    quick_hash, full_hash = dedup.quick_hash, dedup.full_hash
+
+    def counted_quick_hash(path, size):
+        calls['quick'].append(os.path.basename(path))
+        return quick_hash(path, size)
+
+    def counted_full_hash(path):
+        calls['full'].append(os.path.basename(path))
+        return full_hash(path)
+
+    monkeypatch.setattr(dedup, 'quick_hash', counted_quick_hash)
+    monkeypatch.setattr(dedup, 'full_hash', counted_full_hash)
+    return calls
+
+
+def write_files(folder, contents):
+    paths = []
+    for name, content in contents.items():
+        path = folder / name
+        path.write_bytes(content)
+        paths.append(str(path))
+    return paths
+
+
+def test_sizes_alone_tell_unique_files_apart(tmp_path, hash_calls):
+    paths = write_files(tmp_path, {'a': b'1', 'b': b'22', 'c': b'333'})
+    assert content_fingerprints(paths) == {paths[0]: '1', paths[1]: '2', paths[2]: '3'}
+    assert hash_calls == {'quick': [], 'full': []}
+
+
+def test_identical_files_are_confirmed_by_full_hash(tmp_path, hash_calls):
+    header = b'RINEX header\n'.ljust(dedup.QUICK_HASH_BLOCK, b' ')
+    paths = write_files(tmp_path, {
+        'raw': header + b'epochs' * 100,
+        'backup': header + b'epochs' * 100,
+        # Same size, different start: told apart by the quick hash
+        'other': b'X' + header[1:] + b'epochs' * 100,
+    })
+    fingerprints = content_fingerprints(paths)
+    assert fingerprints[paths[0]] == fingerprints[paths[1]] != fingerprints[paths[2]]
+    assert sorted(hash_calls['quick']) == ['backup', 'other', 'raw']
+    assert sorted(hash_calls['full']) == ['backup', 'raw']
+
+
+def test_quick_hash_collision_falls_back_to_full_hash(tmp_path, hash_calls):
+    # Same size, first and last blocks: only the middle differs, which
+    # quick_hash() doesn't read
+    block = bytes(range(256)) * (dedup.QUICK_HASH_BLOCK // 256)
+    paths = write_files(tmp_path, {
+        'a': block + b'middle 1' + block,
+        'b': block + b'middle 2' + block,
+        'c': block + b'middle 1' + block,
+    })
+    assert len({dedup.quick_hash(path, os.path.getsize(path)) for path in paths}) == 1
+    hash_calls['quick'].clear()
+
+    fingerprints = content_fingerprints(paths)
+    assert sorted(hash_calls['full']) == ['a', 'b', 'c']
+    assert fingerprints[paths[0]] == fingerprints[paths[2]] != fingerprints[paths[1]]
+    assert fingerprints[paths[0]].split(':')[:2] == fingerprints[paths[1]].split(':')[:2]
+
+
+def test_small_files_are_hashed_whole(tmp_path):
+    paths = write_files(tmp_path, {'a': b'ab', 'b': b'ba'})
+    assert dedup.quick_hash(paths[0], 2) == dedup.full_hash(paths[0])
+    assert content_fingerprints(paths)[paths[0]] != content_fingerprints(paths)[paths[1]]
+
+
+def test_unreadable_files_are_left_out(tmp_path):
+    paths = write_files(tmp_path, {'a': b'1'})
+    missing = str(tmp_path / 'missing')
+    assert content_fingerprints([*paths, missing]) == {paths[0]: '1'}
+
+
+def test_duplicates_need_the_same_content_and_rules(tmp_path):
+    for folder in ('raw', 'backup', 'delivery', 'other'):
+        (tmp_path / folder).mkdir()
+    files = [
+        *write_files(tmp_path / 'raw', {'SITE0610.24o': b'observations', 'SITE0620.24o': b'more observations'}),
+        *write_files(tmp_path / 'backup', {'SITE0610.24o': b'observations', 'SITE0620.24o': b'more observations'}),
+        *write_files(tmp_path / 'delivery', {'SITE0610.24o': b'observations'}),
+        *write_files(tmp_path / 'other', {'SITE0610.24o': b'observations'}),
+    ]
+    file_rules = [{'pattern': '*/other/*', 'object': 'Other'}]
+    settings = {'file_rules': file_rules, 'file_rule_index': file_rule_index(file_rules)}
+    # The copy under other/ gets different metadata, so its own journal
+    assert find_duplicates(files, settings) == {2: 0, 3: 1, 4: 0}
+
+
+def journal_settings(save_mode, save_path=''):
+    return {'save_mode': save_mode, 'save_path': save_path, 'file_rules': [], 'pdf_mode': 'latex'}
+
+
+@pytest.fixture
+def copies(tmp_path):
+    """Two copies of a file, and the outputs built from the first."""
+    for folder in ('raw', 'backup'):
+        (tmp_path / folder).mkdir()
+    file, duplicate = (str(tmp_path / folder / 'SITE0610.24o') for folder in ('raw', 'backup'))
+    for path in (file, duplicate):
+        with open(path, 'w') as f:
+            f.write('observations\n')
+    names = ['SITE.pdf', 'SITE.docx']
+    for name in names:
+        with open(tmp_path / 'raw' / name, 'w') as f:
+            f.write(f'{name} of raw')
+    return file, duplicate, names
+
+
+def test_reuse_outputs_copies_to_source_folders(tmp_path, copies):
+    file, duplicate, names = copies
+    settings = journal_settings('source')
+    metadata = {'object': 'Объект 42'}
+    manifest = build_manifest()
+    manifest.record(str(tmp_path / 'raw'), file, build_key(file, metadata, build_options(file, settings)), names)
+    built = manifest.built
+
+    reuse_outputs(file, duplicate, metadata, settings)
+    for name in names:
+        assert (tmp_path / 'backup' / name).read_text() == f'{name} of raw'
+    # The copy is up to date for the next run, without counting as built
+    key = build_key(duplicate, metadata, build_options(duplicate, settings))
+    assert manifest.is_current(str(tmp_path / 'backup'), duplicate, key)
+    assert manifest.outputs(str(tmp_path / 'backup'), duplicate) == names
+    assert manifest.built == built
+
+
+def test_reuse_outputs_in_a_shared_folder_copies_nothing(tmp_path, copies):
+    file, duplicate, names = copies
+    settings = journal_settings('custom', str(tmp_path / 'raw'))
+    reuse_outputs(file, duplicate, {}, settings)
+    assert sorted(os.listdir(tmp_path / 'raw')) == sorted([*names, 'SITE0610.24o'])
+    assert sorted(os.listdir(tmp_path / 'backup')) == ['SITE0610.24o']
+    assert build_manifest().outputs(str(tmp_path / 'raw'), duplicate) == []
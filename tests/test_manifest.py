@@ -0,0 +1,125 @@
+import json
+import os
+
+import pytest
+
+from journal_by_rinex import manifest
+from journal_by_rinex.manifest import MANIFEST_DIR, BuildManifest, build_key
+
+METADATA = {'operator': 'Иванов И. И.', 'object': 'Объект 42'}
+OPTIONS = {'pdf_mode': 'latex', 'docx_writer': 'pandoc'}
+OUTPUTS = ['SITE.pdf', 'SITE.docx', 'SITE.tex']
+
+
+@pytest.fixture
+def built(tmp_path):
+    """(manifest, output folder, source file, key) for a journal just
+    built into tmp_path/out."""
+    source = tmp_path / 'SITE0610.24o'
+    source.write_text('header\n')
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    for name in OUTPUTS:
+        (output_dir / name).write_text(name)
+    key = build_key(str(source), METADATA, OPTIONS)
+    build = BuildManifest()
+    build.record(str(output_dir), str(source), key, OUTPUTS)
+    return build, str(output_dir), str(source), key
+
+
+def test_journal_is_current_until_something_changes(built):
+    build, output_dir, source, key = built
+    assert build.is_current(output_dir, source, key)
+    assert build.is_current(output_dir, source, build_key(source, dict(METADATA), dict(OPTIONS)))
+    assert build.stats() == {'skipped': 2, 'built': 1}
+    assert build.outputs(output_dir, source) == OUTPUTS
+    assert os.listdir(os.path.join(output_dir, MANIFEST_DIR)) == [os.path.basename(build._path(output_dir, source))]
+
+
+def test_source_change_makes_journal_stale(built):
+    build, output_dir, source, key = built
+    # Same size, only its modification time changes
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert not build.is_current(output_dir, source, build_key(source, METADATA, OPTIONS))
+
+    with open(source, 'a') as f:
+        f.write('more\n')
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert not build.is_current(output_dir, source, build_key(source, METADATA, OPTIONS))
+    assert build.stats()['skipped'] == 0
+
+
+@pytest.mark.parametrize('metadata, options', [
+    (dict(METADATA, object='Объект 43'), OPTIONS),
+    (dict(METADATA, gdop='1.7'), OPTIONS),
+    (METADATA, dict(OPTIONS, pdf_mode='template')),
+])
+def test_metadata_or_options_change_makes_journal_stale(built, metadata, options):
+    build, output_dir, source, key = built
+    assert build_key(source, metadata, options) != key
+    assert not build.is_current(output_dir, source, build_key(source, metadata, options))
+
+
+def test_package_change_makes_journal_stale(built, monkeypatch):
+    build, output_dir, source, key = built
+    monkeypatch.setattr(manifest, 'package_fingerprint', lambda: 'other')
+    assert not build.is_current(output_dir, source, build_key(source, METADATA, OPTIONS))
+
+
+@pytest.mark.parametrize('change', ['edit', 'touch', 'delete'])
+def test_output_change_makes_journal_stale(built, change):
+    build, output_dir, source, key = built
+    path = os.path.join(output_dir, 'SITE.docx')
+    if change == 'edit':
+        with open(path, 'a') as f:
+            f.write('overwritten by another journal')
+    elif change == 'touch':
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    else:
+        os.remove(path)
+    assert not build.is_current(output_dir, source, key)
+
+    # Until it is rebuilt
+    if change == 'delete':
+        with open(path, 'w') as f:
+            f.write('SITE.docx')
+    build.record(output_dir, source, key, OUTPUTS)
+    assert build.is_current(output_dir, source, key)
+
+
+def test_refresh_after_outputs_are_rewritten(built):
+    build, output_dir, source, key = built
+    path = os.path.join(output_dir, 'SITE.pdf')
+    with open(path, 'w') as f:
+        f.write('compiled later by a JournalBatch')
+    assert not build.is_current(output_dir, source, key)
+    build.refresh(output_dir, source)
+    assert build.is_current(output_dir, source, key)
+
+
+def test_missing_or_foreign_entries_are_stale(built):
+    build, output_dir, source, key = built
+    path = build._path(output_dir, source)
+    with open(path) as f:
+        entry = json.load(f)
+
+    with open(path, 'w') as f:
+        json.dump(dict(entry, version=manifest.MANIFEST_VERSION + 1), f)
+    assert not build.is_current(output_dir, source, key)
+
+    with open(path, 'w') as f:
+        f.write('{"version": 1, "key": ')
+    assert not build.is_current(output_dir, source, key)
+    assert build.outputs(output_dir, source) == []
+
+    build.forget(output_dir, source)
+    assert not os.path.exists(path)
+    assert not build.is_current(output_dir, source, key)
+    # Another source's entry in the same folder doesn't count for it
+    other = os.path.join(os.path.dirname(source), 'OTHR0610.24o')
+    with open(other, 'w') as f:
+        f.write('header\n')
+    build.record(output_dir, other, key, OUTPUTS)
+    assert not build.is_current(output_dir, source, key)
@@ -0,0 +1,154 @@
+import json
+import os
+import shutil
+
+import pytest
+
+pikepdf = pytest.importorskip('pikepdf')
+Image = pytest.importorskip('PIL.Image')
+
+from journal_by_rinex import functions, pdftemplate
+from journal_by_rinex.latexbuild import LatexBuilder
+from journal_by_rinex.pdftemplate import FIELD_FONT_ENCODING, FIELD_FONT_NAME, SLOT_KEY, FormTemplates
+
+JOURNAL_DATA = {
+    'antenna height type': 'tripod_base', 'marker name': 'SITE', 'organization': 'ООО "Ромашка", отдел №1',
+    'object': 'Объект 42', 'operator': 'Иванов И. И.', 'latitude': 55.7, 'longitude': 37.6, 'height': 150.1234,
+    'receiver type': 'TRIMBLE R10', 'receiver number': '123', 'antenna type': 'TRM57971.00', 'antenna number': '77',
+    'centre type': 'Тип 1', 'benchmark type': 'Тип 2', 'start date': '2024-01-01', 'end date': '2024-01-02',
+    'start time': '00:00:00', 'end time': '23:59:30', 'antenna height': 1.5, 'gdop': '1.7', 'pdop': '1.6',
+    'map sheets': [(10000, 'N-37-1-А-а-1')], 'coordinate systems': [('UTM 37N', 'N 1 / E 2')],
+}
+
+
+class BlankTiles:
+    key = 'blank'
+
+    def get_tile(self, z, x, y):
+        return None
+
+
+def pdf_contents(path):
+    """(text field values, radio states, image pixels by position) of a
+    journal PDF."""
+    with pikepdf.open(path) as pdf:
+        values, radios = {}, {}
+        for field in pdf.Root.AcroForm.Fields:
+            if '/Kids' in field:
+                radios[str(field.T)] = (str(field.V), [str(kid.get('/AS')) for kid in field.Kids])
+            elif field.get('/FT') == pikepdf.Name.Tx:
+                values.setdefault(str(field.T), []).append(str(field.get('/V', '')))
+        images = []
+        for page in pdf.pages:
+            page.contents_coalesce()
+            xobjects = page.Resources.get('/XObject', {})
+            for operands, operator in pikepdf.parse_content_stream(page):
+                if str(operator) == 'Do' and xobjects[operands[0]].get('/Subtype') == pikepdf.Name.Image:
+                    image = pikepdf.PdfImage(xobjects[operands[0]]).as_pil_image()
+                    images.append((image.size, image.convert('RGBA').tobytes()))
+        return values, radios, images
+
+
+def write_template(path, slot_image):
+    """A one-page form template like FormTemplates.template() makes: two
+    text fields, a radio group and a placeholder image slot 'map'."""
+    pdf = pikepdf.new()
+    pdf.add_blank_page(page_size=(300, 200))
+    page = pdf.pages[0]
+    fields = []
+    for index, name in enumerate(('organization', 'markername')):
+        fields.append(pdf.make_indirect(pikepdf.Dictionary(
+            Type=pikepdf.Name.Annot, Subtype=pikepdf.Name.Widget, FT=pikepdf.Name.Tx, T=pikepdf.String(name),
+            DA=pikepdf.String('/Helv 10 Tf 0 g' if index else '/Helv 0 Tf 0 0 1 rg'),
+            Rect=[10, 150 - 30 * index, 290, 170 - 30 * index], P=page.obj,
+            AP=pikepdf.Dictionary(N=pdf.make_stream(b'')),
+        )))
+    kids = pikepdf.Array()
+    for value in ('a', 'b'):
+        kids.append(pdf.make_indirect(pikepdf.Dictionary(
+            Type=pikepdf.Name.Annot, Subtype=pikepdf.Name.Widget, Rect=[10, 10, 20, 20], P=page.obj,
+            AP=pikepdf.Dictionary(N=pikepdf.Dictionary({'/' + value: pdf.make_stream(b''), '/Off': pdf.make_stream(b'')})),
+        )))
+    fields.append(pdf.make_indirect(pikepdf.Dictionary(FT=pikepdf.Name.Btn, T=pikepdf.String('choice'), Kids=kids)))
+    page.Annots = pikepdf.Array([*fields[:2], *kids])
+    pdf.Root.AcroForm = pdf.make_indirect(pikepdf.Dictionary(Fields=fields, DA=pikepdf.String('/Helv 0 Tf 0 g')))
+
+    placeholder = pdftemplate._image_xobject(pdf, slot_image)
+    placeholder[SLOT_KEY] = pikepdf.Name('/map')
+    page.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im1=placeholder))
+    page.Contents = pdf.make_stream(b'q 100 0 0 50 10 60 cm /Im1 Do Q')
+    slots = pdftemplate._image_slots(pdf)
+    pdftemplate._add_field_font(pdf)
+    pdf.save(path)
+    with open(path[:-len('.pdf')] + '.json', 'w') as f:
+        json.dump({slot: [page, str(name)] for slot, (page, name) in slots.items()}, f)
+
+
+def test_fill_stores_field_appearances(tmp_path):
+    pytest.importorskip('fontTools')
+    Image.new('RGB', (20, 10), 'white').save(tmp_path / 'placeholder.png')
+    Image.new('RGB', (20, 10), 'green').save(tmp_path / 'map.png')
+    template = str(tmp_path / 'template.pdf')
+    write_template(template, tmp_path / 'placeholder.png')
+
+    templates = FormTemplates(None, str(tmp_path))
+    fields = {'organization': JOURNAL_DATA['organization'], 'marker_name': 'SITE'}
+    templates.fill(template, str(tmp_path / 'out.pdf'), fields, 'choice', ['a', 'b'], 'b', {'map': tmp_path / 'map.png'})
+
+    with pikepdf.open(tmp_path / 'out.pdf') as pdf:
+        acroform = pdf.Root.AcroForm
+        assert FIELD_FONT_NAME in acroform.DR.Font
+        organization, marker_name, choice = acroform.Fields
+        for field, value in ((organization, fields['organization']), (marker_name, 'SITE')):
+            assert str(field.V) == value
+            assert str(field.DA).startswith(FIELD_FONT_NAME + ' ')
+            appearance = field.AP.N
+            assert FIELD_FONT_NAME in appearance.Resources.Font
+            assert list(appearance.BBox) == [0, 0, 280, 20]
+            shown = [
+                operands[0] for operands, operator in pikepdf.parse_content_stream(appearance)
+                if str(operator) == 'Tj'
+            ]
+            assert [bytes(text).decode(FIELD_FONT_ENCODING) for text in shown] == [value]
+        assert str(choice.V) == '/b'
+        assert [str(kid.AS) for kid in choice.Kids] == ['/Off', '/b']
+        image = pikepdf.PdfImage(pdf.pages[0].Resources.XObject['/Im1']).as_pil_image()
+        assert image.getpixel((0, 0)) == (0, 128, 0)
+
+
+def test_image_slots_are_found_by_name(tmp_path):
+    pdf = pikepdf.new()
+    pdf.add_blank_page()
+    Image.new('RGB', (4, 4), 'white').save(tmp_path / 'white.png')
+    xobjects = pikepdf.Dictionary()
+    for index, slot in enumerate(('antenna_b', None, 'map')):
+        xobject = pdftemplate._image_xobject(pdf, tmp_path / 'white.png')
+        if slot is not None:
+            xobject[SLOT_KEY] = pikepdf.Name('/' + slot)
+        xobjects[f'/Im{index + 1}'] = xobject
+    pdf.pages[0].Resources = pikepdf.Dictionary(XObject=xobjects)
+    assert pdftemplate._image_slots(pdf) == {'antenna_b': (0, '/Im1'), 'map': (0, '/Im3')}
+
+
+@pytest.mark.skipif(shutil.which('pdflatex') is None, reason='needs pdflatex')
+@pytest.mark.parametrize('antenna_height_type', ['tripod_base', 'phase', None])
+def test_template_journal_matches_compiled_journal(tmp_path, antenna_height_type):
+    pytest.importorskip('pylatex')
+    pytest.importorskip('fontTools')
+    data = dict(JOURNAL_DATA, **{'antenna height type': antenna_height_type})
+    latex = LatexBuilder('precompiled', str(tmp_path / 'build'))
+    templates = FormTemplates(latex, str(tmp_path / 'templates'))
+    outputs = {}
+    for mode in ('latex', 'template'):
+        os.makedirs(tmp_path / mode)
+        outputs[mode] = str(tmp_path / mode / data['marker name'])
+        location_map = functions.journal_map(dict(data), outputs[mode], tiles=BlankTiles())
+        functions.journal_pdf(dict(data), outputs[mode], location_map, latex=latex,
+                              templates=templates if mode == 'template' else None)
+    assert templates.stats()['fills'] == 1
+
+    compiled_values, compiled_radios, compiled_images = pdf_contents(outputs['latex'] + '.pdf')
+    values, radios, images = pdf_contents(outputs['template'] + '.pdf')
+    assert values == compiled_values
+    assert radios == compiled_radios
+    assert images == compiled_images
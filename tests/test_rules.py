@@ -0,0 +1,146 @@
+import glob
+import os
+
+import pytest
+
+from journal_by_rinex.batch import file_matches_rule, processed_config, resolve_file_metadata
+from journal_by_rinex.rules import FileRuleIndex, file_rule_index, literal_pattern
+
+FILES = [
+    'SITE0610.24o',
+    'site0610.24o',
+    'SITE0620.24o',
+    'SITE0640.24O',
+    'OTHR0610.24o',
+    'OTHR0610.24d.Z',
+    'site[1].24o',
+    'a*b?.24o',
+    '2024/SITE0610.24o',
+    '2024/day 061/BASE0610.24o',
+    'SITE_dir/BASE0620.24o',
+    'SITE00RUS_R_20240610000_01D_30S_MO.crx.gz',
+]
+
+
+def patterns(root):
+    root = root.replace(os.sep, '/')
+    return [
+        # Wildcards only
+        '*',
+        '*.*',
+        # By marker name
+        'SITE*',
+        'site*',
+        '*SITE*',
+        '[!S]*',
+        # By date: day of year ranges and years
+        '????06[0-2]0.24o',
+        '????06[1-4]?.24[oO]',
+        '*_R_2024061????_*',
+        '*.24?',
+        # By directory
+        '*/2024/*',
+        root + '/2024/*',
+        root + '/2024/day 061/*',
+        '*/SITE_dir/*',
+        # Exact names and paths, as processed_config() writes them
+        'SITE0610.24o',
+        glob.escape('site[1].24o'),
+        glob.escape('a*b?.24o'),
+        glob.escape(root + '/a*b?.24o'),
+        glob.escape(root + '/2024/day 061/BASE0610.24o'),
+        root + '/SITE0620.24o',
+        # Overlapping repeats of earlier rules
+        'SITE*',
+        glob.escape(root + '/2024/day 061/BASE0610.24o'),
+        # Matching nothing
+        'missing.24o',
+        '*.25o',
+        root + '/elsewhere/*',
+    ]
+
+
+@pytest.fixture
+def rinex_files(tmp_path, monkeypatch):
+    for name in FILES:
+        os.makedirs(tmp_path / os.path.dirname(name), exist_ok=True)
+        (tmp_path / name).touch()
+    monkeypatch.chdir(tmp_path)
+    # Absolute and relative paths (matched by their absolute path)
+    return [str(tmp_path / name) for name in FILES] + FILES
+
+
+def test_index_agrees_with_file_matches_rule(tmp_path, rinex_files):
+    rules = patterns(str(tmp_path))
+    index = FileRuleIndex(rules)
+    assert index.literals, 'exact rules should not be compiled as globs'
+    for file in rinex_files:
+        expected = [number for number, pattern in enumerate(rules) if file_matches_rule(file, pattern)]
+        assert index.matches(file) == expected, file
+
+
+@pytest.mark.parametrize('number', range(len(patterns(''))))
+def test_index_agrees_for_each_rule_alone(tmp_path, rinex_files, number):
+    pattern = patterns(str(tmp_path))[number]
+    index = FileRuleIndex([pattern])
+    for file in rinex_files:
+        assert index.matches(file) == ([0] if file_matches_rule(file, pattern) else []), (pattern, file)
+
+
+def test_literal_pattern():
+    assert literal_pattern('SITE0610.24o') == 'SITE0610.24o'
+    assert literal_pattern(glob.escape('/data/a*b?[1].24o')) == '/data/a*b?[1].24o'
+    assert literal_pattern('SITE*.24o') is None
+    assert literal_pattern('SITE06[1-2]0.24o') is None
+
+
+def test_overlapping_rules_apply_in_order(tmp_path, rinex_files):
+    root = str(tmp_path).replace(os.sep, '/')
+    file_rules = [
+        {'pattern': '*', 'operator': 'Everyone', 'object': 'Default'},
+        {'pattern': glob.escape(root + '/2024/SITE0610.24o'), 'object': 'Exact', 'centre_type': 'Exact'},
+        {'pattern': 'SITE*', 'operator': 'Site team', 'object': 'Site'},
+        {'pattern': '*/2024/*', 'centre_type': 'Archive'},
+    ]
+    settings = {
+        'base_metadata': {'operator': '', 'object': '', 'centre_type': 'Form'},
+        'gdop_range': None, 'pdop_range': None, 'file_rules': file_rules,
+        'file_rule_index': file_rule_index(file_rules),
+    }
+
+    # Later rules override earlier ones field by field
+    assert resolve_file_metadata('2024/SITE0610.24o', settings) == {
+        'operator': 'Site team', 'object': 'Site', 'centre_type': 'Archive',
+    }
+    assert resolve_file_metadata('SITE0610.24o', settings) == {
+        'operator': 'Site team', 'object': 'Site', 'centre_type': 'Form',
+    }
+    assert resolve_file_metadata('OTHR0610.24o', settings) == {
+        'operator': 'Everyone', 'object': 'Default', 'centre_type': 'Form',
+    }
+
+    for file in rinex_files:
+        expected = dict(settings['base_metadata'])
+        for rule in file_rules:
+            if file_matches_rule(file, rule['pattern']):
+                expected.update({k: v for k, v in rule.items() if k != 'pattern'})
+        assert resolve_file_metadata(file, settings) == expected
+        # Without a batch index, one is built from the rules
+        assert resolve_file_metadata(file, dict(settings, file_rule_index=None)) == expected
+
+
+def test_processed_config_rules_match_only_their_file(rinex_files):
+    records = [(file, {'operator': f'operator {number}'}) for number, file in enumerate(rinex_files[:len(FILES)])]
+    file_rules = processed_config(records)['file_rules']
+    index = file_rule_index(file_rules)
+    assert len(index.literals) == len(FILES)
+    assert index.basename_globs == (None, [])
+    for number, file in enumerate(rinex_files):
+        assert index.matches(file) == [number % len(FILES)]
+
+
+def test_matches_are_in_rule_order(rinex_files):
+    # Exact rules are looked up before the globs are tried, but a later
+    # exact rule still comes after an earlier glob
+    rules = ['*.24o', *(f'missing{number}.24o' for number in range(63)), 'SITE0610.24o', 'SITE*']
+    assert FileRuleIndex(rules).matches('SITE0610.24o') == [0, 64, 65]
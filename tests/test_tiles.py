@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from journal_by_rinex.tiles import (
+    HttpTileSource, MBTilesSource, MissingTileCounter, TileCache, XYZDirectorySource, quadkey, tile_url_template,
+)
+
+
+@pytest.fixture
+def tile_server():
+    """A local HTTP tile server: (URL template, list of requested paths).
+    Serves b'tile <path>' for every /z/x/y path, 404 for /404/..."""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append((self.path, self.headers.get('User-Agent')))
+            if self.path.startswith('/404/'):
+                self.send_error(404)
+                return
+            body = f'tile {self.path}'.encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}', requests
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_tile_source_downloads_once_then_hits_cache(tmp_path, tile_server):
+    base_url, requests = tile_server
+    cache = TileCache(str(tmp_path), 1024 * 1024)
+    source = HttpTileSource(base_url + '/{z}/{x}/{y}.png', 'test', cache)
+
+    assert source.get_tile(3, 4, 5) == b'tile /3/4/5.png'
+    assert source.get_tile(3, 4, 5) == b'tile /3/4/5.png'
+    assert [path for path, _ in requests] == ['/3/4/5.png']
+    assert requests[0][1] == 'journal_by_rinex'
+    assert source.stats() == {'hits': 1, 'misses': 1, 'evictions': 0}
+    assert (tmp_path / 'test' / '3' / '4' / '5').read_bytes() == b'tile /3/4/5.png'
+
+    # Another source (process) sharing the cache directory
+    other = HttpTileSource(base_url + '/{z}/{x}/{y}.png', 'test', TileCache(str(tmp_path), 1024 * 1024))
+    assert other.get_tile(3, 4, 5) == b'tile /3/4/5.png'
+    assert len(requests) == 1
+
+
+def test_http_tile_source_quadkey_url(tile_server):
+    base_url, requests = tile_server
+    source = HttpTileSource(base_url + '/q/{quadkey}', 'test')
+    assert source.get_tile(3, 3, 5) == b'tile /q/' + quadkey(3, 3, 5).encode()
+    assert quadkey(3, 3, 5) == '213'
+
+
+def test_http_tile_source_failed_download_is_not_cached(tmp_path, tile_server, capsys):
+    base_url, requests = tile_server
+    cache = TileCache(str(tmp_path), 1024 * 1024)
+    source = HttpTileSource(base_url + '/404/{z}/{x}/{y}', 'test', cache)
+    assert source.get_tile(1, 0, 0) is None
+    assert source.get_tile(1, 0, 0) is None
+    assert len(requests) == 2
+    assert 'Warning! Could not download map tile 1/0/0' in capsys.readouterr().out
+    assert not (tmp_path / 'test').exists()
+
+
+def test_tile_cache_evicts_least_recently_used(tmp_path):
+    cache = TileCache(str(tmp_path), 250)
+    for y in range(3):
+        cache.put('p', 1, 0, y, bytes(100))
+        os.utime(cache._path('p', 1, 0, y), (1000 + y, 1000 + y))
+    # Over max_bytes as soon as the third tile is in: the oldest goes
+    assert cache.get('p', 1, 0, 0) is None
+    assert cache.evictions == 1
+
+    # Reading a tile marks it as recently used, so tile 1 is kept now
+    # and tile 2 goes instead
+    os.utime(cache._path('p', 1, 0, 2), (1000, 1000))
+    assert cache.get('p', 1, 0, 1) == bytes(100)
+    cache.put('p', 1, 0, 3, bytes(100))
+    assert cache.get('p', 1, 0, 2) is None
+    assert cache.get('p', 1, 0, 1) == bytes(100)
+    assert cache.get('p', 1, 0, 3) == bytes(100)
+    assert cache.evictions == 2
+    assert cache._size == 200
+
+    # A new TileCache on the same directory starts from its size on disk
+    assert TileCache(str(tmp_path), 250)._size == 200
+
+
+def test_mbtiles_rows_are_flipped_from_tms(tmp_path):
+    path = str(tmp_path / 'tiles.mbtiles')
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+    # TMS row 6 at zoom 3 is XYZ row 1
+    connection.execute('INSERT INTO tiles VALUES (3, 2, 6, ?)', (b'north',))
+    connection.execute('INSERT INTO tiles VALUES (3, 2, 1, ?)', (b'south',))
+    connection.commit()
+    connection.close()
+
+    source = MBTilesSource(path)
+    assert source.get_tile(3, 2, 1) == b'north'
+    assert source.get_tile(3, 2, 6) == b'south'
+    assert source.get_tile(3, 5, 5) is None
+    assert source.stats() == {'hits': 2, 'misses': 1}
+
+
+def test_mbtiles_file_must_exist(tmp_path):
+    with pytest.raises(ValueError, match='MBTiles file not found'):
+        MBTilesSource(str(tmp_path / 'missing.mbtiles'))
+
+
+def test_xyz_directory_looks_up_extensions_in_order(tmp_path):
+    os.makedirs(tmp_path / '4' / '7')
+    (tmp_path / '4' / '7' / '9.jpg').write_bytes(b'jpg')
+    (tmp_path / '4' / '7' / '9.webp').write_bytes(b'webp')
+    (tmp_path / '4' / '7' / '10.webp').write_bytes(b'webp')
+    (tmp_path / '4' / '7' / '11.png').write_bytes(b'png')
+    (tmp_path / '4' / '7' / '11.jpeg').write_bytes(b'jpeg')
+
+    source = XYZDirectorySource(str(tmp_path))
+    assert source.get_tile(4, 7, 9) == b'jpg'
+    assert source.get_tile(4, 7, 10) == b'webp'
+    assert source.get_tile(4, 7, 11) == b'png'
+    assert source.get_tile(4, 7, 12) is None
+    assert source.stats() == {'hits': 3, 'misses': 1}
+
+
+def test_missing_tile_counter(tmp_path):
+    os.makedirs(tmp_path / '1' / '0')
+    (tmp_path / '1' / '0' / '0.png').write_bytes(b'png')
+    source = XYZDirectorySource(str(tmp_path))
+    counter = MissingTileCounter(source)
+    assert counter.key == source.key
+    assert counter.get_tile(1, 0, 0) == b'png'
+    assert counter.get_tile(1, 0, 1) is None
+    assert counter.missing == 1
+    assert counter.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_tile_url_template():
+    assert tile_url_template('osm') == 'https://tile.openstreetmap.org/{z}/{x}/{y}.png'
+    assert tile_url_template('https://example.com/{z}/{x}/{y}') == 'https://example.com/{z}/{x}/{y}'
+    with pytest.raises(ValueError, match='Unknown tile_provider'):
+        tile_url_template('https://example.com/{z}/{x}')